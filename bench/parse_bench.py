@@ -0,0 +1,50 @@
+# Parser benchmark on pathological inputs
+# Run from the repository root: python -m bench.parse_bench [size]
+#
+# Every case should parse in time linear in its size. Pass --legacy to also
+# time the heading regex the tokenizer used before classify_line, which is
+# quadratic on headings with long runs of whitespace.
+
+import re
+import sys
+import time
+
+from core.ast_md.parser import Parser
+
+LEGACY_HEADING_PATTERN = re.compile(r'^(.*?)\s*(\{id=([a-zA-Z][a-zA-Z0-9\-_]*)\})?$')
+
+
+def cases(size):
+    yield "long heading", "# " + "word " * (size // 5) + "\n"
+    yield "heading with whitespace run", "# " + " " * size + "x\n"
+    yield "heading with tab run and id", "# " + "\t" * size + "{id=block}\n"
+    yield "heading with long id", "# Title {id=a" + "b" * size + "}\n"
+    yield "heading with unclosed ids", "# " + "{id=a " * (size // 6) + "\n"
+    yield "thousands of #", "#" * size + " title\n"
+    yield "# without space", "#" * size + "\n"
+    yield "long operation line", "@" + "a" * size + "\n"
+    yield "long operation body", "@shell\nprompt: " + "x" * size + "\n"
+    yield "many headings", "# h {id=x}\ntext\n" * (size // 16)
+    yield "many operations", "@shell\nprompt: ls\n\n" * (size // 20)
+
+
+def run(size, legacy):
+    Parser(lazy_validation=True).parse("# warm up\n")  # Schema compilation isn't part of any case
+    print(f"{'case':<30} {'chars':>10} {'parse s':>10}" + (f" {'legacy s':>10}" if legacy else ""))
+    for name, text in cases(size):
+        start = time.perf_counter()
+        Parser(lazy_validation=True).parse(text)
+        elapsed = time.perf_counter() - start
+        row = f"{name:<30} {len(text):>10} {elapsed:>10.4f}"
+        if legacy:
+            start = time.perf_counter()
+            for line in text.splitlines():
+                if line.startswith('#'):
+                    LEGACY_HEADING_PATTERN.match(line)
+            row += f" {time.perf_counter() - start:>10.4f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != '--legacy']
+    run(int(args[0]) if args else 100_000, '--legacy' in sys.argv)
@@ -1,32 +1,124 @@
 # AST
 # - AST
+# - AST.empty
+# - AST.from_nodes
+# - AST.from_raw_text
+# - AST.update_text
+# - AST.digest
+# - AST.transaction
 # - nodes_to_ast
 # - perform_ast_operation
 # - get_ast_part_by_path
 # - get_ast_part_by_id
 # - get_ast_part_by_id_or_key
+# - get_part_nodes_by_path
 # - _get_ast_part
 
-import copy
-from typing import Dict, Optional
-from core.ast_md.parser import Parser, get_head, get_tail
+from typing import IO, Dict, List, Optional, Tuple, Union
+from core.ast_md.parser import Parser, HeadingBlock, get_head, get_tail, iter_document_blocks, iter_lines, schema_text
 from core.ast_md.node import Node, NodeType, OperationType
+from core.ast_md.selector import compile_selector, is_selector
+from core.ast_md.transaction import ASTTransaction
 from core.errors import BlockNotFoundError
+from core.config import Config
 
 class AST:
-    def __init__(self, content: str):
-        self.parser = Parser()
+    def __init__(self, content: Union[str, IO], track_lines: bool = False):
+        self.parser = Parser(track_lines=track_lines)
         self.parser.parse(content)
 
+    def apply_edit(self, start_line: int, end_line: int, text: Union[str, List[str]]) -> Tuple[List[Node], List[Node]]:
+        """Replace source lines [start_line, end_line) with text, see Parser.apply_edit."""
+        return self.parser.apply_edit(start_line, end_line, text)
+
+    def update_text(self, text: str) -> Tuple[List[Node], List[Node]]:
+        """
+        Bring an AST created with track_lines=True in line with the new full
+        text of the document, re-tokenizing only the lines that differ.
+        """
+        old_lines = self.parser.source_lines
+        if old_lines is None:
+            raise ValueError("update_text needs an AST created with track_lines=True and no AST changes since")
+        new_lines = list(iter_lines(text))
+        start = 0
+        limit = min(len(old_lines), len(new_lines))
+        while start < limit and old_lines[start] == new_lines[start]:
+            start += 1
+        old_end, new_end = len(old_lines), len(new_lines)
+        while old_end > start and new_end > start and old_lines[old_end - 1] == new_lines[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+        if start == old_end and start == new_end:
+            return [], []
+        return self.parser.apply_edit(start, old_end, new_lines[start:new_end])
+
+    @classmethod
+    def empty(cls) -> 'AST':
+        """Create an AST without running the markdown parser."""
+        new_ast = cls.__new__(cls)
+        new_ast.parser = Parser()
+        return new_ast
+
+    @classmethod
+    def from_raw_text(cls, header: str, text: str) -> 'AST':
+        """
+        One heading node holding header and text verbatim, without
+        tokenizing text. The node takes its level and id from the header
+        line, or is a level 1 block without id when there is no header.
+        """
+        new_ast = cls.empty()
+        header_line = header.strip()
+        block = next(iter_document_blocks([header_line], schema_text, validate=False), None) if header_line else None
+        if isinstance(block, HeadingBlock):
+            node_id = block.id or new_ast.parser.generate_id_from_title(block.title)
+            name, level = block.title, block.level
+        else:
+            node_id, name, level = None, header_line, 1
+        new_ast.parser.add_node(Node(
+            type=NodeType.HEADING,
+            name=name,
+            level=level,
+            id=node_id,
+            indent=level * 4,
+            content=f"{header}{text}".strip()
+        ))
+        return new_ast
+
+    @classmethod
+    def from_nodes(cls, nodes: Dict[str, Node]) -> 'AST':
+        """Wrap already linked nodes into an AST, head and tail follow dict order."""
+        new_ast = cls.empty()
+        new_ast.parser.nodes = nodes
+        new_ast.parser.head = next(iter(nodes.values())) if nodes else None
+        new_ast.parser.tail = next(reversed(nodes.values())) if nodes else None
+        # The tree index is built by walking the list from head
+        new_ast.parser.rebuild_index()
+        return new_ast
+
     def first(self) -> Optional[Node]:
         return self.parser.head
 
     def last(self) -> Optional[Node]:
         return self.parser.tail
 
+    def transaction(self) -> ASTTransaction:
+        """Batch of changes applied when the `with` block ends, see ASTTransaction."""
+        return ASTTransaction(self.parser)
+
+    def digest(self, node: Optional[Node] = None) -> str:
+        """Merkle digest of the branch at node, or of the whole document when node is None."""
+        return self.parser.tree.subtree_digest(node)
+
     def get_node(self, **kwargs) -> Optional[Node]:
         #print(f"Debug: get_node called with kwargs: {kwargs}")
-        for node in self.parser.nodes.values():
+        if 'key' in kwargs:
+            node = self.parser.nodes.get(kwargs['key'])
+            candidates = [node] if node else []
+        elif 'id' in kwargs:
+            candidates = self.parser.get_nodes_by_id(kwargs['id'])
+        else:
+            candidates = self.parser.nodes.values()
+        for node in candidates:
             if all(getattr(node, key) == value for key, value in kwargs.items()):
                 #print(f"Debug: Found matching node: key={node.key}, id={node.id}, content={node.content[:50]}...")
                 return node
@@ -41,24 +133,15 @@ class AST:
             raise ValueError("block_id_or_key_path cannot be None")
 
         block_ids_or_keys = block_id_or_key_path.split('/')
-        current_node = self.get_node(id=block_ids_or_keys[0]) or self.parser.nodes.get(block_ids_or_keys[0])
+        current_node = self.parser.get_node_by_id_or_key(block_ids_or_keys[0])
 
         if not current_node:
             raise BlockNotFoundError(f"get_node_by_path: Block with id or key '{block_ids_or_keys[0]}' not found.")
 
         for part in block_ids_or_keys[1:]:
-            found = False
-            next_level = current_node.level + 1
-            temp_node = current_node.next
-
-            while temp_node:
-                if (temp_node.id == part or temp_node.key == part) and temp_node.level == next_level:
-                    current_node = temp_node
-                    found = True
-                    break
-                temp_node = temp_node.next
-
-            if not found:
+            current_node = self.parser.get_child_by_id_or_key(current_node, part)
+
+            if not current_node:
                 raise BlockNotFoundError(f"get_node_by_path: Block with id or key '{part}' not found at the expected level.")
 
         return current_node
@@ -66,24 +149,23 @@ class AST:
     def replace_node(self, target_key: str, new_node: Node):
         self.parser.replace_node(target_key, new_node)
 
+    # new_ast.parser.nodes is in insertion order, which stops matching the
+    # list order once new_ast itself has been modified, so pass the nodes
+    # in list order
     def replace_node_with_ast(self, target_key: str, new_ast: 'AST'):
-        self.parser.replace_node_with_ast(target_key, new_ast.parser.nodes)
+        self.parser.replace_node_with_ast(target_key, new_ast.parser.ordered_nodes())
 
     def prepend_node_with_ast(self, target_key: str, new_ast: 'AST'):
-        self.parser.prepend_node_with_ast(target_key, new_ast.parser.nodes)
+        self.parser.prepend_node_with_ast(target_key, new_ast.parser.ordered_nodes())
 
     def append_node_with_ast(self, target_key: str, new_ast: 'AST'):
-        self.parser.append_node_with_ast(target_key, new_ast.parser.nodes)
+        self.parser.append_node_with_ast(target_key, new_ast.parser.ordered_nodes())
 
     def get_part_by_path(self, block_id_path: str, use_hierarchy: bool) -> Dict[str, Node]:
         return get_ast_part_by_path(self, block_id_path, use_hierarchy)
     
 def nodes_to_ast(nodes: Dict[str, Node]) -> AST:
-    new_ast = AST("")
-    new_ast.parser.nodes = nodes
-    new_ast.parser.head = next(iter(nodes.values())) if nodes else None
-    new_ast.parser.tail = list(nodes.values())[-1] if nodes else None
-    return new_ast
+    return AST.from_nodes(nodes)
 
 def perform_ast_operation(src_ast: AST, src_path: str, src_hierarchy: bool, 
                           dest_ast: AST, dest_path: str, dest_hierarchy: bool, 
@@ -133,26 +215,20 @@ def perform_ast_operation(src_ast: AST, src_path: str, src_hierarchy: bool,
 
     # Extract destination nodes
     if '/' in dest_path:
-        # If dest_path contains '/', it's definitely a path
-        dest_node_ast = get_ast_part_by_path(dest_ast, dest_path, dest_hierarchy)
+        # If dest_path contains '/', it's definitely a path. Resolve it to the
+        # live node, branch boundaries are found by walking from it below
+        dest_node = dest_ast.get_node_by_path(dest_path)
     else:
         # If no '/', it could be either a single node name (ID) or a key
-        # First, try to find the node by ID
-        dest_node = dest_ast.get_node(id=dest_path)
-        
-        if not dest_node:
-            # If not found by ID, then try to find by key
-            dest_node = dest_ast.parser.nodes.get(dest_path)
-        
+        dest_node = dest_ast.parser.get_node_by_id_or_key(dest_path)
+
         if not dest_node:
             # If neither ID nor key matched, raise an error
             print_operation_debug()
             raise BlockNotFoundError(f"Node with id or key '{dest_path}' not found.")
-        
-        # Create a single-node AST for consistency with path-based lookup
-        dest_node_ast = AST("")
-        dest_node_ast.parser.nodes = {dest_node.key: dest_node}
-        dest_node_ast.parser.head = dest_node_ast.parser.tail = dest_node
+
+    # Create a single-node AST for consistency with the operations below
+    dest_node_ast = AST.from_nodes({dest_node.key: dest_node})
 
     # Validate that the destination AST is not empty
     if not dest_node_ast.parser.nodes:
@@ -166,50 +242,18 @@ def perform_ast_operation(src_ast: AST, src_path: str, src_hierarchy: bool,
         #print(f"- Source nodes: {[n.id for n in source_ast.parser.nodes.values()]}")
         
         if dest_hierarchy:
-            base_level = dest_node_ast.parser.head.level
-            to_remove = set()
-            
-            # Modified collection logic
-            current = dest_node_ast.parser.head
-            while current:
-                if current.level < base_level:
-                    break
-                if current.level == base_level and current != dest_node_ast.parser.head:
-                    break
-                if current.level >= base_level:
-                    to_remove.add(current.key)
-                    #print(f"  Adding to remove: {current.id} (level={current.level})")
-                current = current.next
-
-            # Find preceding and following nodes
-            preceding_node = dest_node_ast.parser.head.prev
-            following_node = None
-            current = dest_node_ast.parser.head
-            while current:
-                if current.level <= base_level and current.key not in to_remove:
-                    following_node = current
-                    break
+            # The branch ends at its cached subtree end
+            branch_head = dest_node_ast.parser.head
+            branch_end = dest_ast.parser.tree.subtree_end(branch_head)
+            to_remove = [branch_head]
+            current = branch_head
+            while current is not branch_end:
                 current = current.next
+                to_remove.append(current)
 
-            # Remove old nodes
-            for key in to_remove:
-                if key in dest_ast.parser.nodes:
-                    del dest_ast.parser.nodes[key]
-
-            # Insert new nodes and fix links
-            dest_ast.parser.nodes.update(source_ast.parser.nodes)
-
-            if preceding_node:
-                preceding_node.next = source_ast.parser.head
-                source_ast.parser.head.prev = preceding_node
-            else:
-                dest_ast.parser.head = source_ast.parser.head
-
-            if following_node:
-                source_ast.parser.tail.next = following_node
-                following_node.prev = source_ast.parser.tail
-            else:
-                dest_ast.parser.tail = source_ast.parser.tail
+            # Swap the branch for the new nodes, only its ends are relinked
+            dest_ast.parser.splice(branch_head.prev, list(source_ast.parser.iter_nodes()),
+                                   branch_end.next, to_remove)
 
         else:
             # Non-hierarchical replace: Replace single node
@@ -234,34 +278,13 @@ def perform_ast_operation(src_ast: AST, src_path: str, src_hierarchy: bool,
 
         if dest_hierarchy:
             # Find last node in branch
-            base_level = dest_node_ast.parser.head.level
-            last_branch_node = dest_node_ast.parser.head
-            current = dest_node_ast.parser.head.next
-            
-            while current:
-                if current.level <= base_level:
-                    break
-                if current.type != NodeType.OPERATION:
-                    last_branch_node = current
-                current = current.next
+            last_branch_node = dest_ast.parser.tree.subtree_end(dest_node_ast.parser.head)
 
             # print(f"  Appending after last branch node: {last_branch_node.id}")
-            
+
             # Insert new nodes after last_branch_node
-            following_node = last_branch_node.next
-            
-            # Update links
-            last_branch_node.next = source_ast.parser.head
-            source_ast.parser.head.prev = last_branch_node
-            
-            if following_node:
-                source_ast.parser.tail.next = following_node
-                following_node.prev = source_ast.parser.tail
-            else:
-                dest_ast.parser.tail = source_ast.parser.tail
-
-            # Update nodes dictionary
-            dest_ast.parser.nodes.update(source_ast.parser.nodes)
+            dest_ast.parser.splice(last_branch_node, list(source_ast.parser.iter_nodes()),
+                                   last_branch_node.next)
         else:
             # Non-hierarchical append: use existing method
             dest_ast.append_node_with_ast(dest_node_ast.parser.tail.key, source_ast)
@@ -271,12 +294,9 @@ def perform_ast_operation(src_ast: AST, src_path: str, src_hierarchy: bool,
         print_operation_debug()
         raise ValueError(f"Unknown operation type: {operation}")
 
-    # Ensure the integrity of the doubly-linked list structure
-    current = dest_ast.parser.head
-    while current and current.next:
-        # Ensure each node's 'next' points to a node that points back to it
-        current.next.prev = current
-        current = current.next
+    # Splices keep the links consistent locally, the full walk is a debug aid
+    if Config.VERIFY_AST:
+        dest_ast.parser.verify_integrity()
 
     # Validate the resulting AST
     if not dest_ast.parser.head or not dest_ast.parser.tail or len(dest_ast.parser.nodes) == 0:
@@ -287,52 +307,45 @@ def perform_ast_operation(src_ast: AST, src_path: str, src_hierarchy: bool,
     # Output debug information
     #print(f"perform_ast_operation completed. Operation: {operation}, Destination path: {dest_path}")
 
-def _get_ast_part(ast: AST, starting_node: Node, use_hierarchy: bool) -> AST:
-    #print(f"\n[DEBUG] _get_ast_part:")
-    #print(f"- Starting node: {starting_node.id} (level={starting_node.level})")
-    #print(f"- Use hierarchy: {use_hierarchy}")
-    
-    new_ast = AST("")
-    result_nodes = {}
-    base_level = starting_node.level
-    
+def _get_part_nodes(ast: AST, starting_node: Node, use_hierarchy: bool) -> List[Node]:
     # Always include starting node
-    result_nodes[starting_node.key] = copy.deepcopy(starting_node)
-    
+    part_nodes = [starting_node]
+
     if use_hierarchy:
-        current_node = starting_node.next
-        while current_node:
-            #print(f"  Examining node: {current_node.id} (level={current_node.level}, base={base_level})")
-            
-            if current_node.level <= base_level:
-                #print(f"  -> Stopping: found same/higher level")
-                break
-            
+        branch_end = ast.parser.tree.subtree_end(starting_node)
+        current_node = starting_node
+        while current_node is not branch_end:
+            current_node = current_node.next
+            #print(f"  Examining node: {current_node.id} (level={current_node.level})")
+
             if current_node.type != NodeType.OPERATION:
-                result_nodes[current_node.key] = copy.deepcopy(current_node)
+                part_nodes.append(current_node)
                 #print(f"  -> Including child: {current_node.id}")
-            
-            current_node = current_node.next
-    
-    #print(f"Collected nodes: {[node.id for node in result_nodes.values()]}")
-    
-    new_ast.parser.nodes = result_nodes
-    new_ast.parser.head = get_head(result_nodes)
-    new_ast.parser.tail = get_tail(result_nodes)
 
-    # Rebuild node links
+    return part_nodes
+
+def _get_ast_part(ast: AST, starting_node: Node, use_hierarchy: bool) -> AST:
+    #print(f"\n[DEBUG] _get_ast_part:")
+    #print(f"- Starting node: {starting_node.id} (level={starting_node.level})")
+    #print(f"- Use hierarchy: {use_hierarchy}")
+    return _nodes_to_part_ast(_get_part_nodes(ast, starting_node, use_hierarchy))
+
+def _nodes_to_part_ast(nodes: List[Node]) -> AST:
+    # Views share content and params with the source nodes, only the links
+    # are new, so the part can be spliced elsewhere without touching ast
+    result_nodes = {}
     prev_node = None
-    for node in result_nodes.values():
-        node.prev = prev_node
-        node.next = None
+    for node in nodes:
+        node_view = node.view()
+        node_view.prev = prev_node
         if prev_node:
-            prev_node.next = node
-        prev_node = node
+            prev_node.next = node_view
+        result_nodes[node_view.key] = node_view
+        prev_node = node_view
 
-    if new_ast.parser.head:
-        new_ast.parser.head.prev = None
+    #print(f"Collected nodes: {[node.id for node in result_nodes.values()]}")
 
-    return new_ast
+    return AST.from_nodes(result_nodes)
 
 def get_ast_part_by_id(ast: AST, block_id: str, use_hierarchy: bool = False) -> AST:
 
@@ -347,9 +360,7 @@ def get_ast_part_by_id_or_key(ast: AST, block_id_or_key: str, use_hierarchy: boo
 
     # print(f"Debug: get_ast_part_by_id_or_key called with id or key: {block_id_or_key}")
 
-    starting_node = ast.get_node(id=block_id_or_key)
-    if not starting_node:
-        starting_node = ast.parser.nodes.get(block_id_or_key)
+    starting_node = ast.parser.get_node_by_id_or_key(block_id_or_key)
     if not starting_node:
         raise BlockNotFoundError(f"get_ast_part_by_id_or_key: Block with id or key '{block_id_or_key}' not found.")
     return _get_ast_part(ast, starting_node, use_hierarchy)
@@ -360,36 +371,58 @@ def get_ast_part_by_path(ast: AST, block_id_or_key_path: str, use_hierarchy: boo
 
     if block_id_or_key_path is None:
         raise ValueError("block_id_or_key_path cannot be None")
+
+    if is_selector(block_id_or_key_path):
+        return _nodes_to_part_ast(_get_selected_nodes(ast, block_id_or_key_path, use_hierarchy))
     
     block_ids_or_keys = block_id_or_key_path.split('/')
     current_node = None
     
-    # First, try to find by ID
-    current_node = ast.get_node(id=block_ids_or_keys[0])
-    
-    # If not found by ID, try to find by key
-    if not current_node:
-        current_node = ast.parser.nodes.get(block_ids_or_keys[0])
-    
+    # Try to find by ID first, then by key
+    current_node = ast.parser.get_node_by_id_or_key(block_ids_or_keys[0])
+
     if not current_node:
         #print(f"debug before raise of block_ids_or_keys:{block_ids_or_keys}")
         raise BlockNotFoundError(f"get_ast_part_by_path: Block with id or key '{block_ids_or_keys[0]}' not found.")
     
     for i in range(1, len(block_ids_or_keys)):
-        found = False
         next_block_id_or_key = block_ids_or_keys[i]
-        next_level = current_node.level + 1
+        current_node = ast.parser.get_child_by_id_or_key(current_node, next_block_id_or_key)
 
-        temp_node = current_node.next
-        while temp_node:
-            if (temp_node.id == next_block_id_or_key or temp_node.key == next_block_id_or_key) and temp_node.level == next_level:
-                current_node = temp_node
-                found = True
-                break
-            temp_node = temp_node.next
-
-        if not found:
+        if not current_node:
             raise BlockNotFoundError(f"get_ast_part_by_path: Block with id or key '{next_block_id_or_key}' not found at the expected level.")
 
     # Return the AST part starting from the final current_node
     return _get_ast_part(ast, current_node, use_hierarchy)
+
+def _get_selected_nodes(ast: AST, selector: str, use_hierarchy: bool) -> List[Node]:
+    selected = compile_selector(selector).select(ast)
+    if not selected:
+        raise BlockNotFoundError(f"Selector '{selector}' matched no blocks.")
+    if not use_hierarchy:
+        return selected
+
+    # With a trailing /* every match brings its branch along, matches inside
+    # an earlier match's branch are already part of it
+    part_nodes = []
+    covered = set()
+    for node in selected:
+        if node.key in covered:
+            continue
+        branch = _get_part_nodes(ast, node, True)
+        covered.update(n.key for n in branch)
+        part_nodes.extend(branch)
+    return part_nodes
+
+def get_part_nodes_by_path(ast: AST, block_id_or_key_path: str, use_hierarchy: bool = False) -> List[Node]:
+    """
+    Read-only counterpart of get_ast_part_by_path.
+
+    Returns the live nodes of ast without copying them, for consumers such as
+    prompt assembly that only read content. Use get_ast_part_by_path when the
+    nodes are going to be linked into another AST.
+    """
+    if is_selector(block_id_or_key_path):
+        return _get_selected_nodes(ast, block_id_or_key_path, use_hierarchy)
+    starting_node = ast.get_node_by_path(block_id_or_key_path)
+    return _get_part_nodes(ast, starting_node, use_hierarchy)
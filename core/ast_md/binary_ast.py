@@ -0,0 +1,317 @@
+# Binary AST
+# - save_binary_ast
+# - load_binary_ast
+# - LazyContent
+# - binary_ctx_path
+# - write_ctx_binary
+# - load_ctx_binary
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.ast_md.ast import AST
+from core.ast_md.node import Node, NodeType
+from core.ast_md.parser import Parser, iter_document_blocks, iter_lines, schema_text
+
+# Layout, all integers little-endian:
+#   header   magic, format version, .ctx size and SHA-256 (0 without a .ctx),
+#            node count and the offsets of the sections below
+#   contents UTF-8 node contents back to back, decoded on first use
+#   strings  table of the keys, names, ids, paths and params JSON, each
+#            distinct string stored once: the count, the end of every string
+#            in characters and the UTF-8 text of all of them, decoded at once
+#   nodes    one fixed-size record per node in list order, links are implied
+#            by the order
+# The run-once `enabled` flag belongs to the run that wrote the file and is
+# not stored, nodes load enabled as a parse of the .ctx gives them
+MAGIC = b'FCTX'
+FORMAT_VERSION = 3
+BINARY_SUFFIX = '.ctxb'
+
+_HEADER = struct.Struct('<4sHHQ32sIQQQ')
+# type, flags, level, indent, string table index of key, name, id,
+# source_path, source_block_id, target_path, target_block_id and params
+# (0 for None), then the (offset, length) of the content
+_NODE = struct.Struct('<BBHH' + 'I' * 8 + 'QQ')
+
+_TYPES = (NodeType.HEADING, NodeType.OPERATION)
+_FLAG_NEEDS_VALIDATION = 2
+
+_STRING_FIELDS = ('key', 'name', 'id', 'source_path', 'source_block_id', 'target_path', 'target_block_id')
+
+
+class LazyContent:
+    """Node content still sitting in a mapped binary AST, decoded when first read."""
+
+    __slots__ = ('_buffer', '_offset', '_length', '_text')
+
+    def __init__(self, buffer: Any, offset: int, length: int):
+        self._buffer = buffer
+        self._offset = offset
+        self._length = length
+        self._text = None
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = self._buffer[self._offset:self._offset + self._length].decode('utf-8')
+            self._buffer = None
+        return self._text
+
+    def chunks(self):
+        return iter((str(self),))
+
+
+class _StringTable:
+    def __init__(self):
+        # Index 0 stands for None
+        self.indexes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        index = self.indexes.get(value)
+        if index is None:
+            self.values.append(value)
+            index = self.indexes[value] = len(self.values)
+        return index
+
+    def to_bytes(self) -> bytes:
+        ends = []
+        end = 0
+        for value in self.values:
+            end += len(value)
+            ends.append(end)
+        return (struct.pack(f'<I{len(ends)}Q', len(ends), *ends)
+                + ''.join(self.values).encode('utf-8', 'surrogatepass'))
+
+
+def save_binary_ast(ast: AST, path: str, ctx: Optional[Tuple[int, bytes]] = None) -> None:
+    """
+    Write ast to path in the binary format. ctx is the (size, SHA-256) of
+    the .ctx text the copy stands for, load_ctx_binary only trusts the
+    binary copy while the .ctx still matches.
+    """
+    ctx_size, ctx_digest = ctx if ctx is not None else (0, b'')
+
+    strings = _StringTable()
+    params_json: Dict[int, Optional[str]] = {}
+    records = []
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\0' * _HEADER.size)
+            contents_offset = position = _HEADER.size
+
+            for node in ast.parser.iter_nodes():
+                content_start = position
+                for chunk in node.content_chunks():
+                    data = chunk.encode('utf-8')
+                    f.write(data)
+                    position += len(data)
+
+                flags = 0
+                needs_validation = node.needs_validation
+                params_ref = 0
+                if node.params is not None:
+                    # Params shared between nodes are encoded once
+                    if id(node.params) not in params_json:
+                        try:
+                            params_json[id(node.params)] = json.dumps(node.params, ensure_ascii=False)
+                        except (TypeError, ValueError):
+                            params_json[id(node.params)] = None
+                    encoded = params_json[id(node.params)]
+                    if encoded is None:
+                        needs_validation = True  # Not JSON, parsed again from the content when reached
+                    else:
+                        params_ref = strings.add(encoded)
+                if needs_validation:
+                    flags |= _FLAG_NEEDS_VALIDATION
+
+                refs = [strings.add(getattr(node, field)) for field in _STRING_FIELDS]
+                refs.append(params_ref)
+                records.append(_NODE.pack(_TYPES.index(node.type), flags, node.level, node.indent,
+                                          *refs, content_start, position - content_start))
+
+            strings_offset = position
+            string_data = strings.to_bytes()
+            f.write(string_data)
+            nodes_offset = strings_offset + len(string_data)
+            f.write(b''.join(records))
+
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, ctx_size, ctx_digest, len(records),
+                                 contents_offset, strings_offset, nodes_offset))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _map(path: str) -> Tuple[Any, Tuple[Any, ...]]:
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < _HEADER.size:
+        raise ValueError("Not a binary AST: file too short")
+    header = _HEADER.unpack_from(buffer, 0)
+    if header[0] != MAGIC:
+        raise ValueError("Not a binary AST: bad magic")
+    if header[1] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary AST version {header[1]}")
+    node_count, contents_offset, strings_offset, nodes_offset = header[5:]
+    # The node table ends the file, a cut short or padded copy is rejected
+    if not (_HEADER.size == contents_offset <= strings_offset <= nodes_offset
+            and nodes_offset + node_count * _NODE.size == len(buffer)):
+        raise ValueError("Not a binary AST: truncated or corrupt")
+    return buffer, header
+
+
+def load_binary_ast(path: str) -> AST:
+    """
+    Load an AST written by save_binary_ast. The file is memory mapped and
+    node contents are only decoded when read, nodes keep their keys, params
+    and validation state.
+    """
+    return _load(*_map(path))
+
+
+def _load(buffer: Any, header: Tuple[Any, ...]) -> AST:
+    _, _, _, _, _, node_count, _, strings_offset, nodes_offset = header
+
+    count, = struct.unpack_from('<I', buffer, strings_offset)
+    ends = struct.unpack_from(f'<{count}Q', buffer, strings_offset + 4)
+    text = buffer[strings_offset + 4 + 8 * count:nodes_offset].decode('utf-8', 'surrogatepass')
+    strings: List[Optional[str]] = [None]
+    start = 0
+    for end in ends:
+        strings.append(text[start:end])
+        start = end
+
+    # Params shared by nodes were written once, they are shared again on load
+    loaded_params: Dict[int, Any] = {}
+    nodes = []
+    prev_node = None
+    table = memoryview(buffer)[nodes_offset:nodes_offset + node_count * _NODE.size]
+    try:
+        for record in _NODE.iter_unpack(table):
+            type_index, flags, level, indent = record[:4]
+            params = None
+            if record[11]:
+                params = loaded_params.get(record[11])
+                if params is None:
+                    params = loaded_params[record[11]] = json.loads(strings[record[11]])
+            node = Node(
+                type=_TYPES[type_index],
+                name=strings[record[5]],
+                level=level,
+                params=params,
+                content=LazyContent(buffer, record[12], record[13]),
+                id=strings[record[6]],
+                indent=indent,
+                source_path=strings[record[7]],
+                source_block_id=strings[record[8]],
+                target_path=strings[record[9]],
+                target_block_id=strings[record[10]],
+                key=strings[record[4]],
+                needs_validation=bool(flags & _FLAG_NEEDS_VALIDATION),
+            )
+            node.prev = prev_node
+            if prev_node:
+                prev_node.next = node
+            nodes.append(node)
+            prev_node = node
+    finally:
+        table.release()
+
+    ast = AST.empty()
+    if nodes:
+        ast.parser.splice(None, nodes, None)
+    return ast
+
+
+def binary_ctx_path(ctx_path: str) -> str:
+    return os.path.splitext(ctx_path)[0] + BINARY_SUFFIX
+
+
+class _HashingReader:
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+        self.size = 0
+
+    def readline(self) -> bytes:
+        line = self.f.readline()
+        self.digest.update(line)
+        self.size += len(line)
+        return line
+
+
+def _parse_equivalent(ast: AST, ctx_path: str) -> Optional[Tuple[int, bytes]]:
+    """
+    (size, SHA-256) of the .ctx text if parsing it gives the nodes of ast,
+    with the same type, level, name, id, content and key, None otherwise.
+    """
+    parser = Parser(lazy_validation=True)
+    parsed = []
+    stubs = []
+    with open(ctx_path, 'rb') as f:
+        reader = _HashingReader(f, hashlib.sha256())
+        for block in iter_document_blocks(iter_lines(reader), schema_text, validate=False):
+            node = parser.node_from_block(block)
+            parsed.append((node.type, node.level, node.name, node.id, node.key))
+            # Only the content key is needed to derive keys of repeated blocks
+            stubs.append(Node(type=node.type, name='', level=node.level, key=node.key))
+    parser._claim_keys(stubs)
+
+    nodes = ast.parser.iter_nodes()
+    for (node_type, level, name, node_id, digest), stub in zip(parsed, stubs):
+        node = next(nodes, None)
+        if (node is None or (node.type, node.level, node.name, node.id) != (node_type, level, name, node_id)
+                or node.digest != digest or node.key != stub.key):
+            return None
+    if next(nodes, None) is not None:
+        return None
+    return reader.size, reader.digest.digest()
+
+
+def write_ctx_binary(ast: AST, ctx_path: str) -> None:
+    """
+    Binary copy of ast next to the .ctx file it was just rendered to.
+
+    parse_file loads the copy instead of parsing the .ctx, so it is only
+    written when both give the same nodes. Text of a `parse: false` block
+    that reads as a heading, or keys of repeated blocks derived in another
+    order than a parse would, leave the .ctx without a copy.
+    """
+    path = binary_ctx_path(ctx_path)
+    ctx = _parse_equivalent(ast, ctx_path)
+    if ctx is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    save_binary_ast(ast, path, ctx)
+
+
+def load_ctx_binary(ctx_path: str) -> Optional[AST]:
+    """
+    AST of ctx_path from its binary copy, None when there is none or the
+    .ctx text changed since the copy was written.
+    """
+    try:
+        buffer, header = _map(binary_ctx_path(ctx_path))
+        if header[3] != os.stat(ctx_path).st_size:
+            return None
+        digest = hashlib.sha256()
+        with open(ctx_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        if header[4] != digest.digest():
+            return None
+        return _load(buffer, header)
+    except (OSError, ValueError, struct.error, IndexError, KeyError, TypeError):
+        return None  # Missing, stale or corrupt, the .ctx is parsed instead
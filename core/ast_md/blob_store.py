@@ -0,0 +1,270 @@
+# Blob Store
+# - BlobContent
+# - BlobStore
+# - get_blob_store
+# - release_blob_store
+
+import codecs
+import hashlib
+import mmap
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows, blobs are kept until the directory is cleared
+    fcntl = None
+
+from core.config import Config
+from core.ast_md.rope import Rope, iter_chunks
+
+# Bytes decoded per chunk when a blob is streamed
+_READ_SIZE = 1024 * 1024
+
+# Every BlobContent still referenced in this process
+_handles = weakref.WeakSet()
+
+# Blobs read since the last release_blob_store, mapped once per run
+_mapped: Dict[str, mmap.mmap] = {}
+_mapped_lock = threading.Lock()
+
+
+def _map_blob(path: str) -> mmap.mmap:
+    buffer = _mapped.get(path)
+    if buffer is None:
+        with _mapped_lock:
+            buffer = _mapped.get(path)
+            if buffer is None:
+                try:
+                    os.utime(path)  # Eviction goes by last use
+                except OSError:
+                    pass
+                with open(path, 'rb') as f:
+                    buffer = _mapped[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return buffer
+
+
+class BlobContent:
+    """
+    Node content kept in a BlobStore file instead of memory.
+
+    Only the path is held, the file is mapped on the first read of a run
+    and its pages are only loaded while someone reads them. Blobs never
+    change once written, nodes and block copies share the same handle.
+    """
+
+    __slots__ = ('path', 'length', '__weakref__')
+
+    def __init__(self, path: str, length: int):
+        self.path = path
+        self.length = length
+        _handles.add(self)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __str__(self) -> str:
+        return ''.join(self.chunks())
+
+    def __repr__(self) -> str:
+        return f"BlobContent(path={self.path!r}, length={self.length})"
+
+    def chunks(self) -> Iterator[str]:
+        buffer = _map_blob(self.path)
+        # A character may be split between two reads
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for offset in range(0, len(buffer), _READ_SIZE):
+            chunk = decoder.decode(buffer[offset:offset + _READ_SIZE])
+            if chunk:
+                yield chunk
+        chunk = decoder.decode(b'', final=True)
+        if chunk:
+            yield chunk
+
+
+class BlobStore:
+    """
+    Content-addressed files for node contents of min_chars characters or
+    more, see spill. A blob is named after the hash of its text, so the same
+    output written twice (a @goto loop, the same @import in every run) is
+    stored once. Every open store holds a lease file, blobs are only
+    evicted by sweep and only while no other process holds one.
+    """
+
+    def __init__(self, blob_dir: str, min_chars: int, max_bytes: int):
+        self.blob_dir = blob_dir
+        self.min_chars = min_chars
+        self.max_bytes = max_bytes
+        os.makedirs(blob_dir, exist_ok=True)
+        # Keep the blobs out of the session git commits and `git status`
+        gitignore_path = os.path.join(blob_dir, '.gitignore')
+        if not os.path.exists(gitignore_path):
+            with open(gitignore_path, 'w', encoding='utf-8') as f:
+                f.write('*\n')
+        self.lock_path = os.path.join(blob_dir, 'sweep.lock')
+        self.lease_dir = os.path.join(blob_dir, 'leases')
+        self.lease = None
+        if fcntl is not None:
+            os.makedirs(self.lease_dir, exist_ok=True)
+            lease_path = os.path.join(self.lease_dir, f"{os.getpid()}.{os.urandom(4).hex()}")
+            self.lease = open(lease_path, 'w')
+            fcntl.flock(self.lease, fcntl.LOCK_EX)
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[bool]:
+        """
+        Holds the sweep lock, shared while blobs are written. The exclusive
+        lock does not wait, False is yielded if it is taken.
+        """
+        if fcntl is None:
+            yield True
+            return
+        with open(self.lock_path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB if exclusive else fcntl.LOCK_SH)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def put(self, chunks: Iterable[str]) -> BlobContent:
+        """Blob of the text made of chunks, written chunk by chunk."""
+        digest = hashlib.blake2b(digest_size=16)
+        length = 0
+        tmp_path = os.path.join(self.blob_dir, f"{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    data = chunk.encode('utf-8', 'surrogatepass')
+                    digest.update(data)
+                    f.write(data)
+                    length += len(chunk)
+            path = os.path.join(self.blob_dir, f"{digest.hexdigest()}.blob")
+            # A sweep must not remove the blob between the check and the handle
+            with self._locked(False):
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                    os.utime(path)
+                else:
+                    os.replace(tmp_path, path)
+                blob = BlobContent(path, length)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return blob
+
+    def spill(self, nodes: List) -> None:
+        """Move the contents of nodes that reach min_chars into blobs."""
+        for node in nodes:
+            content = node._content
+            if isinstance(content, (str, Rope)) and content and len(content) >= self.min_chars:
+                try:
+                    blob = self.put(iter_chunks(content))
+                except OSError:
+                    continue  # Stays in memory
+                # Same text, the cached digest and token counts still hold
+                node._content = blob
+
+    def close(self) -> None:
+        """Give up the lease, the store is not used after this."""
+        if self.lease is not None:
+            try:
+                os.remove(self.lease.name)
+            except OSError:
+                pass
+            self.lease.close()
+            self.lease = None
+
+    def sweep(self) -> None:
+        """
+        Evicts blobs once the directory grows past max_bytes, least recently
+        used first. Skipped while another process holds a lease, blobs still
+        referenced in this process are kept.
+        """
+        if fcntl is None or self.lease is None:
+            return
+        with self._locked(True) as locked:
+            if locked and not self._other_leases():
+                self.evict({blob.path for blob in list(_handles)})
+
+    def _other_leases(self) -> bool:
+        for entry in os.scandir(self.lease_dir):
+            if entry.path == self.lease.name:
+                continue
+            try:
+                with open(entry.path, 'a') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    # The lock was free, its process has exited
+                    os.remove(entry.path)
+            except BlockingIOError:
+                return True
+            except OSError:
+                continue
+        return False
+
+    def evict(self, keep: Set[str] = frozenset()) -> None:
+        entries = []
+        total = 0
+        for entry in os.scandir(self.blob_dir):
+            if not entry.name.endswith('.blob'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_blob_store: Optional[BlobStore] = None
+
+def get_blob_store() -> Optional[BlobStore]:
+    """Store for Config.BLOB_DIR, None while spilling is disabled."""
+    global _blob_store
+    if not Config.BLOB_DIR:
+        return None
+    blob_dir = os.path.abspath(Config.BLOB_DIR)
+    if (_blob_store is None or _blob_store.blob_dir != blob_dir
+            or _blob_store.min_chars != Config.BLOB_MIN_CHARS
+            or _blob_store.max_bytes != Config.BLOB_MAX_BYTES):
+        if _blob_store is not None:
+            _blob_store.close()
+            _blob_store = None
+        try:
+            _blob_store = BlobStore(blob_dir, Config.BLOB_MIN_CHARS, Config.BLOB_MAX_BYTES)
+        except OSError:
+            return None
+    return _blob_store
+
+
+def release_blob_store() -> None:
+    """
+    End of a run: sweep the store, give up its lease and unmap the blobs
+    read during the run. The next get_blob_store opens the store again.
+    """
+    global _blob_store
+    if _blob_store is not None:
+        _blob_store.sweep()
+        _blob_store.close()
+        _blob_store = None
+    with _mapped_lock:
+        for buffer in _mapped.values():
+            buffer.close()
+        _mapped.clear()
@@ -2,12 +2,16 @@
 # - Node
 # - NodeType
 # - OperationType
+# - intern_params
+# - content_key
+# - derive_key
 
+import copy
 import hashlib
-import uuid
+import json
 from enum import Enum
-from dataclasses import dataclass, field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, Union
+from core.ast_md.rope import Rope, iter_chunks
 
 
     
@@ -20,25 +24,114 @@ class OperationType(Enum):
     PREPEND = "prepend"
     APPEND = "append"
 
-@dataclass
+# Keys are derived from the node's type, level and content, so the same
+# document gets the same keys on every run. Parser.splice re-keys a node whose
+# key is already taken by another node of the list, with derive_key and a
+# per-key attempt counter. Derived keys depend on the order nodes were
+# spliced in: after update_text or an @run splice, repeated blocks can hold
+# other keys than a fresh parse of the same text gives them
+def content_key(type: 'NodeType', level: int, content: Union[str, Rope]) -> str:
+    digest = hashlib.blake2b(f"{type.value}\0{level}\0".encode(), digest_size=8)
+    for chunk in iter_chunks(content):
+        digest.update(chunk.encode())
+    return digest.hexdigest()
+
+def derive_key(key: str, attempt: int) -> str:
+    return hashlib.blake2b(f"{key}:{attempt}".encode(), digest_size=8).hexdigest()
+
+# Identical params dicts (same operation text parsed again by @run/@import or
+# repeated across a library) share one dict
+_interned_params: Dict[str, Dict[str, Any]] = {}
+
+def intern_params(params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not params:
+        return params
+    try:
+        signature = json.dumps(params, sort_keys=True)
+    except (TypeError, ValueError):
+        return params
+    return _interned_params.setdefault(signature, params)
+
 class Node:
-    type: NodeType
-    name: str
-    level: int
-    params: Optional[Dict[str, Any]] = None  # Proper type annotation
-    content: str = ""
-    id: Optional[str] = None
-    indent: int = 0
-    source_path: Optional[str] = None
-    source_block_id: Optional[str] = None
-    target_path: Optional[str] = None
-    target_block_id: Optional[str] = None
-    key: str = field(default_factory=lambda: str(uuid.uuid4())[:8])
-    prev: Optional['Node'] = None
-    next: Optional['Node'] = None
-    enabled: bool = True  # Persistent flag for run-once logic
+    __slots__ = (
+        'type', 'name', 'level', 'params', '_content', '_hash', 'id', 'indent',
+        'source_path', 'source_block_id', 'target_path', 'target_block_id',
+        'key', 'prev', 'next', 'enabled', 'needs_validation', 'tokens',
+    )
+
+    def __init__(self, type: NodeType, name: str, level: int,
+                 params: Optional[Dict[str, Any]] = None,
+                 content: Union[str, Rope] = "",
+                 id: Optional[str] = None,
+                 indent: int = 0,
+                 source_path: Optional[str] = None,
+                 source_block_id: Optional[str] = None,
+                 target_path: Optional[str] = None,
+                 target_block_id: Optional[str] = None,
+                 key: Optional[str] = None,
+                 prev: Optional['Node'] = None,
+                 next: Optional['Node'] = None,
+                 enabled: bool = True,  # Persistent flag for run-once logic
+                 needs_validation: bool = False):  # Operation params not parsed from content yet
+        self.type = type
+        self.name = name
+        self.level = level
+        self.params = params
+        self._content = content
+        self._hash = None
+        self.id = id
+        self.indent = indent
+        self.source_path = source_path
+        self.source_block_id = source_block_id
+        self.target_path = target_path
+        self.target_block_id = target_block_id
+        self.key = key if key is not None else self.digest
+        self.prev = prev
+        self.next = next
+        self.enabled = enabled
+        self.needs_validation = needs_validation
+        # Token counts of the content by counter name, see token_index.node_tokens
+        self.tokens: Optional[Dict[str, int]] = None
+
+    @property
+    def content(self) -> str:
+        content = self._content
+        return content if isinstance(content, str) else str(content)
 
+    def _set_content(self, value: Union[str, Rope]) -> None:
+        # Only through Parser.set_content/append_content, which also update
+        # the digests and indexes built on the content of listed nodes
+        self._content = value
+        self._hash = None
+        self.tokens = None
+
+    def content_chunks(self) -> Iterator[str]:
+        """The content in order as one or more strings, without joining a Rope."""
+        return iter_chunks(self._content)
+
+    def __repr__(self) -> str:
+        return f"Node(type={self.type}, name={self.name!r}, level={self.level}, id={self.id!r}, key={self.key!r})"
+
+    def view(self) -> 'Node':
+        """
+        Unlinked copy of this node that shares its content and params.
+
+        Only the node itself is copied, so extracting a block doesn't drag the
+        rest of the list along. Params are shared and treated as read-only
+        after parsing.
+        """
+        node_view = copy.copy(self)
+        node_view.prev = None
+        node_view.next = None
+        return node_view
+
+    @property
+    def digest(self) -> str:
+        """content_key of the node as it is now, the leaf of TreeIndex.subtree_digest."""
+        if self._hash is None:
+            self._hash = content_key(self.type, self.level, self._content)
+        return self._hash
 
     @property
     def hash(self) -> str:
-        return hashlib.md5(self.content.encode()).hexdigest()[:8]
\ No newline at end of file
+        return self.digest[:8]
@@ -0,0 +1,183 @@
+# Parse Cache
+# - ParseCache
+# - get_parse_cache
+# - digest_text
+# - digest_file
+
+import hashlib
+import io
+import json
+import os
+from typing import Any, List, Optional, Tuple
+
+from core.config import Config
+from core.ast_md.ast import AST
+from core.ast_md.node import Node, NodeType, intern_params
+from core.ast_md.parser import PARSER_VERSION, schema_text
+
+# Node fields stored per record, links and keys are rebuilt on load
+_RECORD_FIELDS = (
+    'name', 'level', 'params', 'content', 'id', 'indent', 'source_path',
+    'source_block_id', 'target_path', 'target_block_id', 'enabled',
+    'needs_validation',
+)
+
+_VERSION_TAG = f"{PARSER_VERSION}:{hashlib.sha256(schema_text.encode()).hexdigest()[:16]}"
+
+
+class ParseCache:
+    """
+    On-disk cache of parse results keyed by file content.
+
+    Entries are the node lists of parsed documents, stored as plain lists
+    with their validated params, one JSON file per digest from digest_text
+    or digest_file. The cache sits in the project folder, so entries are
+    only ever read as data, never unpickled. The parser version and the
+    schema text are part of the digest, so any change to either just
+    misses. When the directory grows past max_bytes, the least recently
+    used entries (by mtime, refreshed on every hit) are removed until it is
+    back under 90% of it.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # Keep the cache out of the session git commits and `git status`
+        gitignore_path = os.path.join(cache_dir, '.gitignore')
+        if not os.path.exists(gitignore_path):
+            with open(gitignore_path, 'w', encoding='utf-8') as f:
+                f.write('*\n')
+        # Size of the entries, counted by the first put and kept up to date
+        # by later ones, None until then
+        self.total_bytes: Optional[int] = None
+
+    def _entry_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def get(self, digest: str) -> Optional[AST]:
+        records = self.get_object(digest)
+        if records is None:
+            return None
+        try:
+            return records_to_ast(records)
+        except (TypeError, KeyError, IndexError, ValueError, AttributeError):
+            return None  # Corrupt entry, parsed again
+
+    def put(self, digest: str, ast: AST) -> None:
+        self.put_object(digest, ast_to_records(ast))
+
+    def get_object(self, digest: str) -> Any:
+        """Raw JSON entry for digest (tuples come back as lists), None on a miss."""
+        path = self._entry_path(digest)
+        try:
+            with open(path, 'rb') as f:
+                obj = json.loads(f.read().decode('utf-8'))
+            os.utime(path)
+        except (OSError, ValueError, RecursionError):
+            return None
+        return obj
+
+    def put_object(self, digest: str, obj: Any) -> None:
+        path = self._entry_path(digest)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            # Params that aren't plain JSON (YAML dates, ...) leave the entry out
+            data = json.dumps(obj, ensure_ascii=False, allow_nan=False).encode('utf-8')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError, RecursionError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        if self.total_bytes is not None:
+            self.total_bytes += len(data) - replaced
+        # Other processes may add entries too, the directory is only counted
+        # again when the budget looks exceeded
+        if self.total_bytes is None or self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                # Pickled entry of an older version, never read again
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        if total > self.max_bytes:
+            # Down to 90% of the budget, so a full cache isn't counted again
+            # on every put
+            target = self.max_bytes * 9 // 10
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        self.total_bytes = total
+
+
+# Lazily and eagerly validated parses of the same file are different entries
+def digest_text(text: str, lazy_validation: bool) -> str:
+    return digest_file_obj(io.BytesIO(text.encode('utf-8')), lazy_validation)
+
+def digest_file(path: str, lazy_validation: bool) -> str:
+    with open(path, 'rb') as f:
+        return digest_file_obj(f, lazy_validation)
+
+def digest_file_obj(f, lazy_validation: bool) -> str:
+    digest = hashlib.sha256(f"{_VERSION_TAG}:{'lazy' if lazy_validation else 'eager'}\0".encode())
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def ast_to_records(ast: AST) -> List[Tuple[Any, ...]]:
+    return [
+        (node.type.value,) + tuple(getattr(node, field) for field in _RECORD_FIELDS)
+        for node in ast.parser.iter_nodes()
+    ]
+
+def records_to_ast(records: List[Tuple[Any, ...]]) -> AST:
+    ast = AST.empty()
+    for record in records:
+        fields = dict(zip(_RECORD_FIELDS, record[1:]))
+        fields['params'] = intern_params(fields['params'])
+        ast.parser.add_node(Node(type=NodeType(record[0]), **fields))
+    return ast
+
+
+_parse_cache: Optional[ParseCache] = None
+
+def get_parse_cache() -> Optional[ParseCache]:
+    """Cache for Config.PARSE_CACHE_DIR, None while caching is disabled."""
+    global _parse_cache
+    if not Config.PARSE_CACHE_DIR:
+        return None
+    cache_dir = os.path.abspath(Config.PARSE_CACHE_DIR)
+    if (_parse_cache is None or _parse_cache.cache_dir != cache_dir
+            or _parse_cache.max_bytes != Config.PARSE_CACHE_MAX_BYTES):
+        try:
+            _parse_cache = ParseCache(cache_dir, Config.PARSE_CACHE_MAX_BYTES)
+        except OSError:
+            return None
+    return _parse_cache
@@ -1,18 +1,32 @@
 # Parser
 # - Parser
+# - PARSER_VERSION
+# - iter_lines
+# - iter_document_blocks
+# - classify_line
+# - validate_operation_node
 # - print_parsed_structure
 
 from ast import AST
+import bisect
+import io
+import itertools
 import re
-from typing import Dict, Optional, Union
-from core.ast_md.node import Node, NodeType
+from typing import IO, Dict, Iterable, Iterator, Optional, Tuple, Union
+from core.ast_md.node import Node, NodeType, derive_key, intern_params
+from core.ast_md.rope import Rope, iter_chunks
+from core.ast_md.tree_index import TreeIndex
+from core.ast_md.blob_store import get_blob_store
+from core.ast_md.selector import compile_selector, is_selector
+from core.config import Config
 # from core.ast_md.operation_parser import OperationParser
 import unicodedata
 
 import re
 import yaml
 import jsonschema
-from dataclasses import dataclass
+from functools import lru_cache
+from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional
 from rich.console import Console
 from rich.panel import Panel
@@ -43,6 +57,10 @@ operations:
         type: string
         x-process: block-path
         description: "Target block path where content will be placed, supports nested flag"
+      keep:
+        type: integer
+        minimum: 1
+        description: "Keep only the blocks inserted by the last N runs of this operation, e.g. in a @goto loop. Older ones are removed"
       run-once:
         type: boolean
         default: false
@@ -88,6 +106,10 @@ operations:
         enum: ["append", "prepend", "replace"]
         default: "append"
         description: "How to insert LLM response into target block"
+      parse:
+        type: boolean
+        default: true
+        description: "Set to false to insert the response verbatim as one block, '#' and '@' lines in it don't become new blocks"
       to:
         type: string
         x-process: block-path
@@ -103,6 +125,10 @@ operations:
         minimum: 0
         maximum: 1
         description: "Optional temperature setting for LLM call to control randomness"
+      keep:
+        type: integer
+        minimum: 1
+        description: "Keep only the blocks inserted by the last N runs of this operation, e.g. in a @goto loop. Older ones are removed"
       run-once:
         type: boolean
         default: false
@@ -149,6 +175,10 @@ operations:
         type: string
         x-process: block-path
         description: "Target block where execution results will be placed"
+      keep:
+        type: integer
+        minimum: 1
+        description: "Keep only the blocks inserted by the last N runs of this operation, e.g. in a @goto loop. Older ones are removed"
       run-once:
         type: boolean
         default: false
@@ -172,10 +202,18 @@ operations:
         enum: ["append", "prepend", "replace"]
         default: "append"
         description: "How to insert command output"
+      parse:
+        type: boolean
+        default: true
+        description: "Set to false to insert the output verbatim as one block, '#' and '@' lines in it don't become new blocks"
       to:
         type: string
         x-process: block-path
         description: "Target block where command output will be placed"
+      keep:
+        type: integer
+        minimum: 1
+        description: "Keep only the blocks inserted by the last N runs of this operation, e.g. in a @goto loop. Older ones are removed"
       run-once:
         type: boolean
         default: false
@@ -316,18 +354,25 @@ computed_fields:
       prompt-nested-flag: true
 '''
 
+# Bump when parse output changes for the same input, persisted parse
+# results are keyed by it together with the schema text
+PARSER_VERSION = 2
+
 @dataclass
 class HeadingBlock:
     level: int
     title: str
     id: Optional[str]
     content: str
+    line: int = 0  # Index of the first source line of the block
 
 @dataclass
 class OperationBlock:
     operation: str
     params: Dict[str, Any]
     content: str
+    error: Optional[str] = None  # Set when the block failed YAML or schema validation
+    line: int = 0
 
 @dataclass
 class SchemaProcessor:
@@ -339,6 +384,16 @@ class SchemaProcessor:
     special_cases: Dict[str, Any]
     error_handling: Dict[str, Any]
     extension_points: Dict[str, Any]
+    validators: Dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        # Prebuild one format-checked validator per operation so that
+        # validate_operation doesn't recompile the schema for every block
+        format_checker = jsonschema.FormatChecker()
+        for operation_name, schema in self.operations_schema.items():
+            validator_cls = jsonschema.validators.validator_for(schema)
+            validator_cls.check_schema(schema)
+            self.validators[operation_name] = validator_cls(schema, format_checker=format_checker)
 
     def validate_operation(self, operation_block: OperationBlock):
         console = Console()
@@ -372,7 +427,9 @@ class SchemaProcessor:
 
         # Validate against schema before processing
         try:
-            jsonschema.validate(instance=params, schema=schema)
+            error = jsonschema.exceptions.best_match(self.validators[operation_name].iter_errors(params))
+            if error is not None:
+                raise error
         except jsonschema.ValidationError as e:
             # Display operation content on validation error
             console.print(f"\n[bold red]✗ Validation Error in operation '{operation_name}':[/bold red]")
@@ -443,19 +500,19 @@ class SchemaProcessor:
         if isinstance(value, list):
             blocks = []
             for block_path in value:
-                block_info = self._process_single_block_path(block_path)
+                block_info = self._process_single_block_path(block_path, field_name)
                 blocks.append(block_info)
             result['blocks'] = blocks
             result['is_multi'] = True
         else:
             # Handle single block path (maintain backward compatibility)
-            block_info = self._process_single_block_path(value)
+            block_info = self._process_single_block_path(value, field_name)
             result.update(block_info)
             result['is_multi'] = False
 
         return result
 
-    def _process_single_block_path(self, path: str) -> Dict[str, Any]:
+    def _process_single_block_path(self, path: str, field_name: str) -> Dict[str, Any]:
         """Helper to process individual block path"""
         path_parts = path.split('/')
         nested_flag = False
@@ -464,8 +521,15 @@ class SchemaProcessor:
             nested_flag = True
             path_parts = path_parts[:-1]
 
+        block_uri = '/'.join(path_parts)
+        if is_selector(block_uri):
+            # The destination is resolved by path, id or key only
+            if field_name == 'to':
+                raise ValueError(f"'to' takes a block path, id or key, not a selector: {block_uri}")
+            compile_selector(block_uri)  # Report malformed selectors with the other validation errors
+
         return {
-            'block_uri': '/'.join(path_parts),
+            'block_uri': block_uri,
             'nested_flag': nested_flag
         }
 
@@ -497,7 +561,9 @@ class SchemaProcessor:
         return {'block_uri': value}
 
 
-def parse_document(text: str, schema_text: str) -> List[Any]:
+@lru_cache(maxsize=None)
+def get_schema_processor(schema_text: str) -> SchemaProcessor:
+    """Compile the operations schema once per process and reuse it."""
     schema = yaml.safe_load(schema_text)
     operations_schema = schema.get('operations', {})
     processors = schema.get('processors', {})
@@ -508,7 +574,7 @@ def parse_document(text: str, schema_text: str) -> List[Any]:
     error_handling = schema.get('error_handling', {})
     extension_points = schema.get('extension_points', {})
 
-    schema_processor = SchemaProcessor(
+    return SchemaProcessor(
         operations_schema=operations_schema,
         processors=processors,
         settings=settings.get('properties', {}),
@@ -519,225 +585,627 @@ def parse_document(text: str, schema_text: str) -> List[Any]:
         extension_points=extension_points
     )
 
-    lines = text.splitlines()
-    blocks = []
+def iter_lines(source: Union[str, bytes, IO]) -> Iterator[str]:
+    """
+    Yield the lines of source without their line endings.
+
+    source can be a string, a text file object, or a binary buffer such as
+    an open binary file or an mmap, which is decoded as UTF-8 line by line.
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source, newline=None)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    readline = source.readline
+    while True:
+        raw = readline()
+        if not raw:
+            return
+        if isinstance(raw, (bytes, bytearray)):
+            raw = raw.decode('utf-8')
+        if raw.endswith('\n'):
+            raw = raw[:-1]
+            if raw.endswith('\r'):
+                raw = raw[:-1]
+        yield raw
+
+# Line kinds of classify_line
+LINE_TEXT = 0
+LINE_HEADING = 1
+LINE_OPERATION = 2
+
+_ASCII_LETTERS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_BLOCK_ID_PATTERN = re.compile(r'[a-zA-Z][a-zA-Z0-9\-_]*')
+
+def classify_line(line: str) -> Tuple[int, int]:
+    """
+    Return (kind, heading level) of a line: a heading is '#'s followed by a
+    space, an operation is '@' followed by a letter. Only str methods that
+    look at each character once are used, so the cost is linear in the line
+    length whatever the line contains.
+    """
+    if line.startswith('#'):
+        rest = line.lstrip('#')
+        if rest.startswith(' '):
+            return LINE_HEADING, len(line) - len(rest)
+    elif line.startswith('@') and len(line) > 1 and line[1] in _ASCII_LETTERS:
+        return LINE_OPERATION, 0
+    return LINE_TEXT, 0
+
+def heading_id(line: str) -> Optional[str]:
+    """Explicit id of a heading line ending with {id=...}, None otherwise."""
+    if not line.endswith('}'):
+        return None
+    start = line.rfind('{id=')
+    if start < 0:
+        return None
+    value = line[start + 4:-1]
+    return value if _BLOCK_ID_PATTERN.fullmatch(value) else None
+
+def validate_block(schema_processor: SchemaProcessor, block: OperationBlock) -> None:
+    try:
+        schema_processor.validate_operation(block)
+    except Exception as e:
+        block.error = str(e)
+        print(f"Error processing operation '{block.operation}': {str(e)}\n")
+
+def iter_document_blocks(lines: Iterable[str], schema_text: str, validate: bool = True,
+                         first_line: int = 0) -> Iterator[Any]:
+    """
+    Tokenize lines into HeadingBlock/OperationBlock items, yielding each block
+    as soon as the next one starts. Block content is collected in a list and
+    joined once, operation blocks are validated right before they are yielded
+    unless validate is False.
+
+    Blocks record the index of their first line, counting from first_line.
+    Tokenizing from any line that starts a block gives the same blocks as
+    tokenizing the whole document, which is what Parser.apply_edit relies on.
+    """
+    schema_processor = get_schema_processor(schema_text)
+
     parsing_state = 'normal'
     current_block = None
+    current_parts: List[str] = []
     previous_line = None
+    # A blank line ends an operation block unless it's the last line of the
+    # document, which is only known once the next line arrives
+    pending_blank_line = None
 
-    for idx, l in enumerate(lines):
+    def finish_block():
+        current_block.content = ''.join(current_parts)
+        if validate and isinstance(current_block, OperationBlock):
+            validate_block(schema_processor, current_block)
+        return current_block
+
+    for line_index, l in enumerate(lines, first_line):
         line = l.rstrip('\n')
 
+        if pending_blank_line is not None:
+            parsing_state = 'normal'
+            pending_blank_line = None
+
+        line_kind, level = classify_line(line)
+
         # Heading Block Detection
-        if re.match(r'^#+ ', line) and parsing_state != 'operation_block':
-            parsing_state = 'heading_block'
-            level = len(line) - len(line.lstrip('#'))
+        if line_kind == LINE_HEADING and parsing_state != 'operation_block':
             heading_line = line# line[level:].strip()
-            m = re.match(r'^(.*?)\s*(\{id=([a-zA-Z][a-zA-Z0-9\-_]*)\})?$', heading_line)
-            if m:
-                title = heading_line# m.group(1).strip()
-                id_value = m.group(3)
-            else:
-                title = heading_line
-                id_value = None
+            title = heading_line
+            id_value = heading_id(heading_line)
+            if current_block is not None:
+                yield finish_block()
             current_block = HeadingBlock(
                 level=level,
                 title=title,
                 id=id_value,
-                content=heading_line+'\n'#''
+                content='',
+                line=line_index
             )
-            blocks.append(current_block)
+            current_parts = [heading_line, '\n']
             parsing_state = 'heading_block'
             previous_line = l
             continue
 
         # Operation Block Detection
-        if re.match(r'^@[a-zA-Z]+', line) and (previous_line is None or previous_line.strip() == ''):
-            parsing_state = 'operation_block'
+        if line_kind == LINE_OPERATION and (previous_line is None or previous_line.strip() == ''):
             operation = line.strip('@').strip()
+            if current_block is not None:
+                yield finish_block()
             current_block = OperationBlock(
               operation=operation,
               params={},
-              content=line+'\n'  # Remove '@' and operation name (first line actually) would be done in schema_processor.validate_operation(block)
+              content='',  # Remove '@' and operation name (first line actually) would be done in schema_processor.validate_operation(block)
+              line=line_index
             )
-            blocks.append(current_block)
+            current_parts = [line, '\n']
+            parsing_state = 'operation_block'
             previous_line = l
             continue
 
         # Content Addition
         if parsing_state == 'heading_block':
-            current_block.content += l + '\n'
+            current_parts.append(l)
+            current_parts.append('\n')
         elif parsing_state == 'operation_block':
-            if line.strip() == '' and idx != len(lines) - 1:
-                parsing_state = 'normal'
+            if line.strip() == '':
+                pending_blank_line = l
             else:
-                current_block.content += l + '\n'
-        else:
-            pass
+                current_parts.append(l)
+                current_parts.append('\n')
 
         previous_line = l
 
     # Handle end of file for operation block
-    if parsing_state == 'operation_block':
-        parsing_state = 'normal'
+    if pending_blank_line is not None:
+        current_parts.append(pending_blank_line)
+        current_parts.append('\n')
 
-    # After parsing, process operation blocks
-    for block in blocks:
-        if isinstance(block, OperationBlock):
-            try:
-                # print(f"!!! Processing BLOCK '{block}'")
-                schema_processor.validate_operation(block)
-            except Exception as e:
-                print(f"Error processing operation '{block.operation}': {str(e)}\n")
-    return blocks
+    if current_block is not None:
+        yield finish_block()
 
-class Parser:
-    HEADING_PATTERN = re.compile(r'^(#+)\s+(.*?)\s*(?:\{id=(\w+)\})?$')
-    OPERATION_PATTERN = re.compile(r'^@(\w+)(?:\s*\((.*?)\))?$')
+def _collect(lines: Iterable[str], into: List[str]) -> Iterator[str]:
+    for line in lines:
+        into.append(line)
+        yield line
 
-    def __init__(self):
+def parse_document(text: str, schema_text: str) -> List[Any]:
+    return list(iter_document_blocks(iter_lines(text), schema_text))
+
+def set_operation_params(node: Node, params: Dict[str, Any]) -> None:
+    node.params = params # Its deconstructed YAML operation params
+    node.source_path = params.get('path', '') # TODO !!! ALL PARAMS LOOKS WRONG
+    node.source_block_id = params.get('block_uri', '')
+    node.target_path = params.get('to', {}).get('path', '') # 
+    node.target_block_id = params.get('to', {}).get('block_uri', '')
+    node.needs_validation = False
+
+def validate_operation_node(node: Node) -> None:
+    """
+    Validate an operation node parsed with lazy validation and store its
+    params on the node. Raises ValueError if the operation is invalid.
+    """
+    if not node.needs_validation:
+        return
+    block = OperationBlock(operation=node.name, params={}, content=node.content)
+    get_schema_processor(schema_text).validate_operation(block)
+    # Same operation reached again (a @goto loop, a reparsed @run file)
+    # shares its params dict, as on the eager path
+    set_operation_params(node, intern_params(block.params))
+
+class Parser:
+    def __init__(self, intern_params: bool = True, lazy_validation: Optional[bool] = None,
+                 track_lines: bool = False):
         self.nodes: Dict[str, Node] = {}
         self.head: Optional[Node] = None
         self.tail: Optional[Node] = None
+        # id -> {key: node}, kept in the same insertion order as self.nodes so
+        # that duplicate ids resolve to the same node a scan over self.nodes would
+        self.id_index: Dict[str, Dict[str, Node]] = {}
+        self.tree = TreeIndex()
+        # Bumped on every change to the node list
+        self.version = 0
+        # Called with the last unchanged node before every change to the
+        # list (None when the change starts at the head), see
+        # prefix_context.PrefixContext and token_index.TokenIndex
+        self.change_listeners: List[Any] = []
+        # When set, every node added to the list is appended to it, the
+        # runner uses it to find the blocks an operation inserted
+        self.insert_log: Optional[List[Node]] = None
+        # Last derive_key attempt per repeated content key, see _claim_keys
+        self.key_attempts: Dict[str, int] = {}
 
         self.schema_text = schema_text  # Ensure schema_text is defined
+        # Share identical operation params dicts between nodes, params are
+        # read-only once parsed
+        self.intern_params = intern_params
+        # Keep operation YAML unparsed until the runner reaches the operation,
+        # see validate_operation_node. Defaults to Config.LAZY_VALIDATION
+        self.lazy_validation = Config.LAZY_VALIDATION if lazy_validation is None else lazy_validation
+        # Validation errors of the last parse or edit, one entry per failed operation
+        self.errors: List[str] = []
+        # With track_lines the source lines and the first line of every block
+        # are kept so that apply_edit can re-tokenize only the edited blocks.
+        # Any other change to the node list drops them
+        self.track_lines = track_lines
+        self.source_lines: Optional[List[str]] = None
+        self.block_lines: List[int] = []
+        self.block_nodes: List[Node] = []
     def generate_id_from_title(self, title: str) -> str:
         # Normalize the title, remove non-alphanumeric characters, and convert to kebab-case
         normalized_title = unicodedata.normalize('NFKD', title).encode('ascii', 'ignore').decode('ascii')
         kebab_case_id = re.sub(r'[^a-zA-Z0-9]+', '-', normalized_title).strip('-').lower()
         return kebab_case_id
 
-    def parse(self, text: str) -> Dict[str, Node]:
-        blocks = parse_document(text, self.schema_text)
+    def parse(self, source: Union[str, bytes, IO]) -> Dict[str, Node]:
+        """Parse a markdown string, file object or binary buffer (e.g. mmap)."""
+        self.errors = []
+        if self.track_lines:
+            self.source_lines = []
+        if not source:
+            return {}
         nodes = {}
-
-        for block in blocks:
-            if isinstance(block, HeadingBlock):
-                node_id = block.id or self.generate_id_from_title(block.title)
-                node = Node(
-                    type=NodeType.HEADING,
-                    name=block.title,
-                    level=block.level,
-                    id=node_id,
-                    indent=block.level * 4,
-                    content= block.content.strip()
-                )
-            elif isinstance(block, OperationBlock):
-                node = Node(
-                    type=NodeType.OPERATION,
-                    name=block.operation,
-                    level=1,
-                    indent=4,
-                    params = block.params, # Its deconstructed YAML operation params
-                    content=block.content.strip(),
-                    source_path=block.params.get('path', ''), # TODO !!! ALL PARAMS LOOKS WRONG
-                    source_block_id=block.params.get('block_uri', ''),
-                    target_path=block.params.get('to', {}).get('path', ''), # 
-                    target_block_id=block.params.get('to', {}).get('block_uri', '')
-                )
-            else:
+        lines = iter_lines(source)
+        if self.track_lines:
+            source_lines = []
+            lines = _collect(lines, source_lines)
+        block_lines = []
+        block_nodes = []
+
+        # Blocks are consumed as the tokenizer produces them
+        for block in iter_document_blocks(lines, self.schema_text,
+                                          validate=not self.lazy_validation):
+            node = self.node_from_block(block)
+            if node is None:
                 continue  # Handle other block types if necessary
 
             self.add_node(node)
             nodes[node.key] = node
-
+            if self.track_lines:
+                block_lines.append(block.line)
+                block_nodes.append(node)
+
+        if self.track_lines:
+            self.source_lines = source_lines
+            self.block_lines = block_lines
+            self.block_nodes = block_nodes
         return nodes
 
-    def add_node(self, node: Node) -> None:
-        self.nodes[node.key] = node
-        if not self.head:
-            self.head = node
-            self.tail = node
+    def node_from_block(self, block: Any) -> Optional[Node]:
+        """Node for a HeadingBlock or OperationBlock from iter_document_blocks."""
+        if isinstance(block, OperationBlock) and block.error:
+            self.errors.append(f"@{block.operation}: {block.error}")
+
+        if isinstance(block, HeadingBlock):
+            node_id = block.id or self.generate_id_from_title(block.title)
+            return Node(
+                type=NodeType.HEADING,
+                name=block.title,
+                level=block.level,
+                id=node_id,
+                indent=block.level * 4,
+                content= block.content.strip()
+            )
+        if isinstance(block, OperationBlock):
+            node = Node(
+                type=NodeType.OPERATION,
+                name=block.operation,
+                level=1,
+                indent=4,
+                content=block.content.strip(),
+                needs_validation=self.lazy_validation
+            )
+            if not self.lazy_validation:
+                set_operation_params(node, intern_params(block.params) if self.intern_params else block.params)
+            return node
+        return None
+
+    def apply_edit(self, start_line: int, end_line: int, text: Union[str, List[str]]) -> Tuple[List[Node], List[Node]]:
+        """
+        Replace source lines [start_line, end_line) with text, given either as
+        a list of lines or as a string split like a file would be, and
+        patch the node list to match, as if the edited document was parsed
+        again. Returns (removed_nodes, added_nodes).
+
+        Tokenizing restarts at the last block that begins before start_line
+        and stops at the first new block that begins at an unchanged line
+        which also began a block before the edit. Re-tokenized blocks equal
+        to the ones they replace keep their node, so ids and keys of
+        untouched blocks stay stable and only new operation blocks are
+        validated. Needs a parser created with track_lines=True.
+        """
+        if self.source_lines is None:
+            raise ValueError("apply_edit needs a parser created with track_lines=True and no AST changes since")
+        source_lines = self.source_lines
+        block_lines = self.block_lines
+        block_nodes = self.block_nodes
+        if not 0 <= start_line <= end_line <= len(source_lines):
+            raise ValueError(f"Edit range {start_line}:{end_line} is outside the document ({len(source_lines)} lines)")
+
+        new_lines = list(text) if isinstance(text, list) else list(iter_lines(text))
+        source_lines[start_line:end_line] = new_lines
+        new_end = start_line + len(new_lines)
+        delta = new_end - end_line
+
+        first = bisect.bisect_left(block_lines, start_line) - 1
+        restart_line = block_lines[first] if first >= 0 else 0
+        first = max(first, 0)
+
+        # Old block starts after the edit, in new line numbers
+        resync_at = {}
+        for index in range(bisect.bisect_left(block_lines, end_line), len(block_lines)):
+            resync_at[block_lines[index] + delta] = index
+
+        self.errors = []
+        schema_processor = get_schema_processor(self.schema_text)
+        blocks = []
+        last = len(block_nodes)
+        for block in iter_document_blocks(itertools.islice(source_lines, restart_line, None),
+                                          self.schema_text, validate=False, first_line=restart_line):
+            if block.line >= new_end and block.line in resync_at:
+                last = resync_at[block.line]
+                break
+            blocks.append(block)
+
+        old_nodes = block_nodes[first:last]
+        new_nodes = []
+        prefix = 0
+        while prefix < min(len(old_nodes), len(blocks)) and self._same_block(old_nodes[prefix], blocks[prefix]):
+            prefix += 1
+        suffix = 0
+        while (suffix < min(len(old_nodes), len(blocks)) - prefix
+               and self._same_block(old_nodes[-1 - suffix], blocks[-1 - suffix])):
+            suffix += 1
+
+        changed_blocks = blocks[prefix:len(blocks) - suffix]
+        removed = old_nodes[prefix:len(old_nodes) - suffix]
+        for block in changed_blocks:
+            if not self.lazy_validation and isinstance(block, OperationBlock):
+                validate_block(schema_processor, block)
+            node = self.node_from_block(block)
+            if new_nodes:
+                new_nodes[-1].next = node
+                node.prev = new_nodes[-1]
+            new_nodes.append(node)
+
+        if removed or new_nodes:
+            before = first + prefix - 1
+            after = last - suffix
+            self.splice(block_nodes[before] if before >= 0 else None, new_nodes,
+                        block_nodes[after] if after < len(block_nodes) else None, removed)
+
+        self.source_lines = source_lines
+        self.block_lines = (block_lines[:first]
+                            + [block.line for block in blocks]
+                            + [line + delta for line in block_lines[last:]])
+        self.block_nodes = block_nodes[:first] + old_nodes[:prefix] + new_nodes + old_nodes[len(old_nodes) - suffix:] + block_nodes[last:]
+        return removed, new_nodes
+
+    def _same_block(self, node: Node, block: Any) -> bool:
+        if isinstance(block, HeadingBlock):
+            return (node.type == NodeType.HEADING and node.name == block.title and node.level == block.level
+                    and node.id == (block.id or self.generate_id_from_title(block.title))
+                    and node.content == block.content.strip())
+        return (node.type == NodeType.OPERATION and node.name == block.operation
+                and node.content == block.content.strip())
+
+    def _index_node(self, node: Node) -> None:
+        if node.id is not None:
+            self.id_index.setdefault(node.id, {})[node.key] = node
+
+    def _unindex_node(self, node: Node) -> None:
+        bucket = self.id_index.get(node.id)
+        if bucket is not None:
+            bucket.pop(node.key, None)
+            if not bucket:
+                del self.id_index[node.id]
+
+    def register_nodes(self, nodes: Dict[str, Node]) -> None:
+        for key, node in nodes.items():
+            existing = self.nodes.get(key)
+            if existing is not None and existing is not node:
+                self._unindex_node(existing)
+            self.nodes[key] = node
+            self._index_node(node)
+
+    def unregister_node(self, key: str) -> Optional[Node]:
+        node = self.nodes.pop(key, None)
+        if node is not None:
+            self._unindex_node(node)
+        return node
+
+    def rebuild_index(self) -> None:
+        self.version += 1
+        for listener in self.change_listeners:
+            listener(None)
+        self.id_index = {}
+        for node in self.nodes.values():
+            self._index_node(node)
+        self.tree.build(self.iter_nodes())
+
+    def iter_nodes(self):
+        current = self.head
+        while current:
+            yield current
+            if current is self.tail:
+                break
+            current = current.next
+
+    def ordered_nodes(self) -> Dict[str, Node]:
+        return {node.key: node for node in self.iter_nodes()}
+
+    def splice(self, prev_node: Optional[Node], new_nodes: List[Node],
+               next_node: Optional[Node], removed: List[Node] = ()) -> None:
+        """
+        Put new_nodes (already linked to each other, in list order) between
+        prev_node and next_node, dropping the removed nodes that sat there.
+
+        Only the links at both ends are touched, along with the key, id and
+        tree indexes, so the cost depends on the size of the change and not
+        on the size of the list. If anything fails on the way the list and
+        its indexes are left as they were.
+        """
+        removed = list(removed)
+        self.source_lines = None
+        self.version += 1
+        state = self._splice_state(new_nodes)
+        try:
+            for listener in self.change_listeners:
+                listener(prev_node)
+            for node in removed:
+                self.unregister_node(node.key)
+            self._claim_keys(new_nodes)
+            self.register_nodes({node.key: node for node in new_nodes})
+            blob_store = get_blob_store()
+            if blob_store is not None:
+                blob_store.spill(new_nodes)
+            if self.insert_log is not None:
+                self.insert_log.extend(new_nodes)
+            self.tree.splice(prev_node, new_nodes, next_node, removed)
+        except BaseException:
+            # Nothing is linked yet, only the indexes need to be put back
+            for node in new_nodes:
+                if self.nodes.get(node.key) is node:
+                    self.unregister_node(node.key)
+            self._restore_splice_state(new_nodes, state)
+            self.register_nodes({node.key: node for node in removed})
+            self.tree.build(self.iter_nodes())
+            raise
+
+        first_node = new_nodes[0] if new_nodes else next_node
+        last_node = new_nodes[-1] if new_nodes else prev_node
+
+        if prev_node:
+            prev_node.next = first_node
         else:
-            self.tail.next = node
-            node.prev = self.tail
-            self.tail = node
+            self.head = first_node
+        if first_node:
+            first_node.prev = prev_node
+
+        if next_node:
+            next_node.prev = last_node
+        else:
+            self.tail = last_node
+        if last_node:
+            last_node.next = next_node
+
+    def _splice_state(self, new_nodes: List[Node]) -> Tuple[List[str], Dict[str, Optional[int]], Optional[int]]:
+        # What splicing new_nodes changes besides the list and the indexes:
+        # their keys, the key attempts of those keys and the insert log
+        return ([node.key for node in new_nodes],
+                {node.key: self.key_attempts.get(node.key) for node in new_nodes},
+                len(self.insert_log) if self.insert_log is not None else None)
+
+    def _restore_splice_state(self, new_nodes: List[Node],
+                              state: Tuple[List[str], Dict[str, Optional[int]], Optional[int]]) -> None:
+        keys, attempts, log_length = state
+        for node, key in zip(new_nodes, keys):
+            node.key = key
+        for key, attempt in attempts.items():
+            if attempt is None:
+                self.key_attempts.pop(key, None)
+            else:
+                self.key_attempts[key] = attempt
+        if log_length is not None and self.insert_log is not None:
+            del self.insert_log[log_length:]
+
+    def _claim_keys(self, new_nodes: List[Node]) -> None:
+        # Content keys repeat for repeated blocks, the later node gets a key
+        # derived from the taken one. Keys already in the list never change,
+        # so a fresh parse only reproduces them for a list built in document
+        # order
+        claimed = set()
+        for node in new_nodes:
+            existing = self.nodes.get(node.key)
+            if (existing is not None and existing is not node) or node.key in claimed:
+                base_key = node.key
+                attempt = self.key_attempts.get(base_key, 0)
+                while True:
+                    attempt += 1
+                    node.key = derive_key(base_key, attempt)
+                    if node.key not in self.nodes and node.key not in claimed:
+                        break
+                self.key_attempts[base_key] = attempt
+            claimed.add(node.key)
+
+    def verify_integrity(self) -> None:
+        """Full walk over the list, only used when Config.VERIFY_AST is set."""
+        seen = 0
+        prev_node = None
+        current = self.head
+        while current:
+            if current.prev is not prev_node:
+                raise ValueError(f"Broken prev link at node '{current.key}'")
+            if self.nodes.get(current.key) is not current:
+                raise ValueError(f"Node '{current.key}' is linked but not registered")
+            seen += 1
+            prev_node = current
+            current = current.next
+        if prev_node is not self.tail:
+            raise ValueError("Tail does not match the last linked node")
+        if seen != len(self.nodes):
+            raise ValueError(f"{len(self.nodes)} nodes registered but {seen} linked")
+
+    def set_content(self, node: Node, content: Union[str, Rope]) -> None:
+        """
+        Replace the content of node, a node of this list. Its key stays, the
+        subtree digests above it and the listeners' caches from it on are
+        dropped.
+        """
+        self.source_lines = None
+        self.version += 1
+        for listener in self.change_listeners:
+            listener(node.prev)
+        node._set_content(content)
+        self.tree.content_changed(node)
+
+    def append_content(self, node: Node, text: str) -> None:
+        """Add text to the end of node's content without copying what is there, see set_content."""
+        content = node._content if isinstance(node._content, Rope) else Rope(iter_chunks(node._content))
+        self.set_content(node, content.append(text))
+
+    def add_node(self, node: Node) -> None:
+        self.splice(self.tail, [node], None)
+
     def get_node_by_id(self, id: str) -> Optional[Node]:
-            return next((node for node in self.nodes.values() if node.id == id), None)
+        bucket = self.id_index.get(id)
+        return next(iter(bucket.values())) if bucket else None
+
+    def get_nodes_by_id(self, id: str) -> List[Node]:
+        return list(self.id_index.get(id, {}).values())
+
+    def get_node_by_id_or_key(self, id_or_key: str) -> Optional[Node]:
+        return self.get_node_by_id(id_or_key) or self.nodes.get(id_or_key)
+
+    def get_child_by_id_or_key(self, parent: Node, id_or_key: str) -> Optional[Node]:
+        """Find the first node one level below parent that matches id_or_key."""
+        level = parent.level + 1
+        candidates = self.get_nodes_by_id(id_or_key)
+        by_key = self.nodes.get(id_or_key)
+        if by_key is not None and all(node is not by_key for node in candidates):
+            candidates.append(by_key)
+        matches = {node.key: node for node in candidates
+                   if node.level == level and self.tree.get_parent(node) is parent}
+        if len(matches) == 1:
+            return next(iter(matches.values()))
+        if matches:
+            return next(node for node in self.tree.children(parent) if node.key in matches)
+
+        # Paths have always resolved to the first matching node after parent,
+        # even outside its branch, so keep that as the fallback
+        current = self.tree.subtree_end(parent).next
+        while current:
+            if (current.id == id_or_key or current.key == id_or_key) and current.level == level:
+                return current
+            current = current.next
+        return None
 
     def replace_node(self, target_key: str, new_node: Node):
         target_node = self.nodes.get(target_key)
         if not target_node:
             raise KeyError(f"Node with key '{target_key}' not found.")
 
-        if target_node.prev:
-            target_node.prev.next = new_node
-            new_node.prev = target_node.prev
-        else:
-            self.head = new_node
-
-        if target_node.next:
-            target_node.next.prev = new_node
-            new_node.next = target_node.next
-        else:
-            self.tail = new_node
-
-        del self.nodes[target_key]
-        self.nodes[new_node.key] = new_node
+        self.splice(target_node.prev, [new_node], target_node.next, [target_node])
 
     def replace_node_with_ast(self, target_key: str, new_ast: Dict[str, Node]):
         old_node = self.nodes.get(target_key)
         if not old_node:
             raise KeyError(f"Node with key '{target_key}' not found.")
 
-        new_nodes = list(new_ast.values())
-        first_new_node = new_nodes[0]
-        last_new_node = new_nodes[-1]
-
-        if old_node.prev:
-            old_node.prev.next = first_new_node
-            first_new_node.prev = old_node.prev
-        else:
-            self.head = first_new_node
-
-        if old_node.next:
-            old_node.next.prev = last_new_node
-            last_new_node.next = old_node.next
-        else:
-            self.tail = last_new_node
-
-        del self.nodes[target_key]
-        self.nodes.update({node.key: node for node in new_nodes})
+        self.splice(old_node.prev, list(new_ast.values()), old_node.next, [old_node])
 
     def prepend_node_with_ast(self, target_key: str, new_ast: Dict[str, Node]):
         target_node = self.nodes.get(target_key)
         if not target_node:
             raise KeyError(f"Node with key '{target_key}' not found.")
 
-        new_nodes = list(new_ast.values())
-        first_new_node = new_nodes[0]
-        last_new_node = new_nodes[-1]
-
-        if target_node.prev:
-            target_node.prev.next = first_new_node
-            first_new_node.prev = target_node.prev
-        else:
-            self.head = first_new_node
-
-        target_node.prev = last_new_node
-        last_new_node.next = target_node
-
-        self.nodes.update({node.key: node for node in new_nodes})
+        self.splice(target_node.prev, list(new_ast.values()), target_node)
 
     def append_node_with_ast(self, target_key: str, new_ast: Dict[str, Node]):
         target_node = self.nodes.get(target_key)
         if not target_node:
             raise KeyError(f"Node with key '{target_key}' not found.")
 
-        new_nodes = list(new_ast.values())
-        first_new_node = new_nodes[0]
-        last_new_node = new_nodes[-1]
-
-        if target_node.next:
-            target_node.next.prev = last_new_node
-            last_new_node.next = target_node.next
-        else:
-            self.tail = last_new_node
-
-        target_node.next = first_new_node
-        first_new_node.prev = target_node
-
-        self.nodes.update({node.key: node for node in new_nodes})
+        self.splice(target_node, list(new_ast.values()), target_node.next)
 
 def get_preceding_node(nodes: Dict[str, Node], head_node: Node) -> Optional[Node]:
     return head_node.prev
@@ -747,7 +1215,7 @@ def get_following_node(nodes: Dict[str, Node], tail_node: Node) -> Optional[Node
 
 def remove_nodes_by_keys(parser: Parser, keys: list[str]) -> None:
     for key in keys:
-        del parser.nodes[key]
+        parser.unregister_node(key)
 
 def connect_nodes(preceding_node: Optional[Node], new_head: Node, new_tail: Node, following_node: Optional[Node]) -> None:
     if preceding_node:
@@ -0,0 +1,123 @@
+# Prefetch
+# - Prefetcher
+# - static_file_refs
+# - get_active_prefetcher
+# - set_active_prefetcher
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.ast_md.ast import AST
+from core.ast_md.node import NodeType
+from core.ast_md.parse_cache import ast_to_records, records_to_ast
+
+# Operations whose 'file' parameter names a markdown source to parse
+PREFETCH_OPERATIONS = ('import', 'run')
+
+# Top-level `file: value` line of an operation's YAML, the value plain or quoted
+_FILE_LINE = re.compile(r'''^file:[ \t]*(?:"([^"]*)"|'([^']*)'|([^\s#'"|>][^#]*?))[ \t]*(?:#.*)?$''')
+
+_active: Optional['Prefetcher'] = None
+
+
+def static_file_refs(ast: AST, base_dir: str) -> List[str]:
+    """
+    Absolute paths of the files named by the @import and @run operations of
+    ast, relative paths are resolved against base_dir like the runner does.
+
+    Operations still waiting for lazy validation are not validated here,
+    their file field is read from the YAML lines directly. The paths are
+    only a hint: a file the runner never loads costs a wasted parse, and an
+    operation whose file field isn't a plain one line value is left to the
+    runner.
+    """
+    paths = []
+    for node in ast.parser.iter_nodes():
+        if node.type != NodeType.OPERATION or node.name not in PREFETCH_OPERATIONS:
+            continue
+        if node.needs_validation:
+            file_value = _scan_file_field(node.content)
+        else:
+            file_params = (node.params or {}).get('file') or {}
+            file_value = file_params.get('file') and os.path.join(file_params.get('path', ''), file_params['file'])
+        if file_value:
+            paths.append(os.path.abspath(os.path.join(base_dir, file_value)))
+    return paths
+
+
+def _scan_file_field(content: str) -> Optional[str]:
+    for line in content.splitlines():
+        match = _FILE_LINE.match(line)
+        if match:
+            return next((value for value in match.groups() if value is not None), None)
+    return None
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Prefetcher:
+    """
+    Parses the files a workflow will @import or @run in a thread pool
+    before the runner reaches them.
+
+    Every prefetched file is scanned for its own @import/@run sources, so
+    the whole static call graph is loaded ahead of time. Results are kept as
+    node records and turned into a fresh AST on every take, since the
+    runner consumes the ASTs it gets. A result is only used if the file has
+    not changed since it was read.
+    """
+
+    def __init__(self, load: Callable[[str], AST], max_workers: int):
+        self.load = load
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.futures: Dict[str, object] = {}
+        self.lock = threading.Lock()
+
+    def prefetch(self, paths: List[str]) -> None:
+        for path in paths:
+            with self.lock:
+                if path in self.futures or not os.path.isfile(path):
+                    continue
+                try:
+                    self.futures[path] = self.executor.submit(self._load, path)
+                except RuntimeError:
+                    return  # Shut down while a worker was still scanning
+
+    def _load(self, path: str):
+        signature = _file_signature(path)
+        ast = self.load(path)
+        self.prefetch(static_file_refs(ast, os.path.dirname(path)))
+        return signature, ast_to_records(ast)
+
+    def take(self, filename: str) -> Optional[AST]:
+        """Prefetched AST of filename, None if it wasn't prefetched or changed since."""
+        path = os.path.abspath(filename)
+        with self.lock:
+            future = self.futures.get(path)
+        if future is None:
+            return None
+        try:
+            signature, records = future.result()
+            if _file_signature(path) != signature:
+                return None
+        except Exception:
+            return None  # Loading again reports the error where it happens
+        return records_to_ast(records)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_active_prefetcher() -> Optional[Prefetcher]:
+    return _active
+
+
+def set_active_prefetcher(prefetcher: Optional[Prefetcher]) -> None:
+    global _active
+    _active = prefetcher
@@ -0,0 +1,133 @@
+# Prefix Context
+# - PrefixContext
+# - get_previous_headings
+
+import weakref
+from typing import Dict, List, Optional
+
+from core.ast_md.blob_store import BlobContent
+from core.ast_md.node import Node, NodeType
+
+
+class PrefixContext:
+    """
+    Heading contents in list order up to some node, extended and cut back
+    as the list changes.
+
+    @llm without blocks sends every heading before it. The walk over the
+    list is kept between calls: a later @llm only walks the nodes added
+    since, and a change to the list drops the cached entries from the
+    changed point on. The joined context is kept too and only the new
+    headings are appended to it, up to the first heading spilled to a
+    blob: that one and the ones after it are read again on every call, so
+    the blob is not kept in memory between calls.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.nodes: List[Node] = []
+        self.positions: Dict[str, int] = {}
+        self.headings: List[Node] = []
+        # Number of headings before each cached node
+        self.heading_counts: List[int] = []
+        # Contents of the first headings joined by blank lines, and where
+        # each of them ends in it
+        self.joined = ''
+        self.joined_ends: List[int] = []
+        parser.change_listeners.append(self.invalidate)
+
+    def invalidate(self, last_unchanged: Optional[Node]) -> None:
+        if last_unchanged is None:
+            keep = 0
+        else:
+            position = self.positions.get(last_unchanged.key)
+            if position is None or self.nodes[position] is not last_unchanged:
+                return  # The change is past the cached part of the list
+            keep = position + 1
+        if keep >= len(self.nodes):
+            return
+        for node in self.nodes[keep:]:
+            del self.positions[node.key]
+        del self.nodes[keep:]
+        del self.heading_counts[keep:]
+        heading_count = self.heading_counts[-1] if self.heading_counts else 0
+        if self.nodes and self.nodes[-1].type == NodeType.HEADING:
+            heading_count += 1
+        del self.headings[heading_count:]
+        if len(self.joined_ends) > heading_count:
+            del self.joined_ends[heading_count:]
+            self.joined = self.joined[:self.joined_ends[-1]] if self.joined_ends else ''
+
+    def _extend_to(self, node: Node) -> bool:
+        current = self.nodes[-1].next if self.nodes else self.parser.head
+        while current is not None:
+            self.positions[current.key] = len(self.nodes)
+            self.nodes.append(current)
+            self.heading_counts.append(len(self.headings))
+            if current.type == NodeType.HEADING:
+                self.headings.append(current)
+            if current is node:
+                return True
+            current = current.next
+        return False
+
+    def previous_headings(self, node: Node) -> str:
+        """Contents of the headings before node joined by blank lines."""
+        position = self.positions.get(node.key)
+        if position is None or self.nodes[position] is not node:
+            if position is not None or not self._extend_to(node):
+                # Not in this list, walk it the plain way
+                return _walk_previous_headings(self.parser, node)
+            position = self.positions[node.key]
+        return self._join(self.heading_counts[position])
+
+    def _join(self, count: int) -> str:
+        joined_count = len(self.joined_ends)
+        if joined_count < count:
+            chunks = [self.joined]
+            length = len(self.joined)
+            for heading in self.headings[joined_count:count]:
+                if isinstance(heading._content, BlobContent):
+                    break
+                if joined_count:
+                    chunks.append("\n\n")
+                    length += 2
+                for chunk in heading.content_chunks():
+                    chunks.append(chunk)
+                    length += len(chunk)
+                self.joined_ends.append(length)
+                joined_count += 1
+            self.joined = ''.join(chunks)
+        if count <= joined_count:
+            return self.joined[:self.joined_ends[count - 1]] if count else ''
+        return _join_contents(self.headings[joined_count:count], self.joined if joined_count else None)
+
+
+def _join_contents(headings: List[Node], joined: Optional[str] = None) -> str:
+    # joined holds the headings before these ones
+    chunks = [] if joined is None else [joined]
+    for index, heading in enumerate(headings):
+        if index or joined is not None:
+            chunks.append("\n\n")
+        chunks.extend(heading.content_chunks())
+    return ''.join(chunks)
+
+
+def _walk_previous_headings(parser, node: Node) -> str:
+    headings = []
+    current = parser.head
+    while current and current is not node:
+        if current.type == NodeType.HEADING:
+            headings.append(current)
+        current = current.next
+    return _join_contents(headings)
+
+
+_prefix_contexts: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+
+def get_previous_headings(ast, node: Node) -> str:
+    """Previous headings of node in ast, through the AST's PrefixContext."""
+    prefix_context = _prefix_contexts.get(ast.parser)
+    if prefix_context is None:
+        prefix_context = _prefix_contexts[ast.parser] = PrefixContext(ast.parser)
+    return prefix_context.previous_headings(node)
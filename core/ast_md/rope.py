@@ -0,0 +1,95 @@
+# Rope
+# - Rope
+# - iter_chunks
+
+import bisect
+from itertools import islice
+from typing import Iterable, Iterator, List, Union
+
+
+class Rope:
+    """
+    Append-friendly text stored as a list of pieces, used for Node content
+    that grows a chunk at a time.
+
+    append returns a new Rope and shares the piece list with the old one:
+    the newest version appends in place and an older version copies its
+    prefix first, so appending n chunks costs O(n) and every version keeps
+    its text. str() joins the pieces once and keeps the result, later
+    appends start from that single piece. slice and chunks never join.
+    """
+
+    __slots__ = ('_pieces', '_ends', '_count', '_text')
+
+    def __init__(self, pieces: Iterable[str] = ()):
+        self._pieces: List[str] = []
+        # End offset of every piece, for slicing by bisect
+        self._ends: List[int] = []
+        length = 0
+        for piece in pieces:
+            if piece:
+                length += len(piece)
+                self._pieces.append(piece)
+                self._ends.append(length)
+        self._count = len(self._pieces)
+        self._text = None
+
+    def __len__(self) -> int:
+        return self._ends[self._count - 1] if self._count else 0
+
+    def __str__(self) -> str:
+        if self._text is None:
+            if self._count == 1:
+                self._text = self._pieces[0]
+            else:
+                self._text = ''.join(islice(self._pieces, self._count))
+                # Own piece list from here on, the shared one may keep growing
+                self._pieces = [self._text] if self._text else []
+                self._ends = [len(self._text)] if self._text else []
+                self._count = len(self._pieces)
+        return self._text
+
+    def append(self, text: str) -> 'Rope':
+        if not text:
+            return self
+        pieces, ends = self._pieces, self._ends
+        if len(pieces) != self._count:
+            # An older version, later pieces belong to another Rope
+            pieces, ends = pieces[:self._count], ends[:self._count]
+        pieces.append(text)
+        ends.append(len(self) + len(text))
+        rope = Rope.__new__(Rope)
+        rope._pieces, rope._ends, rope._count, rope._text = pieces, ends, len(pieces), None
+        return rope
+
+    def chunks(self) -> Iterator[str]:
+        if self._text is not None:
+            return iter((self._text,))
+        return islice(self._pieces, self._count)
+
+    def slice(self, start: int, stop: int) -> str:
+        """Text of [start, stop), only the pieces that overlap it are copied."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return ''
+        if self._text is not None:
+            return self._text[start:stop]
+        ends = self._ends
+        first = bisect.bisect_right(ends, start, 0, self._count)
+        last = bisect.bisect_left(ends, stop, first, self._count)
+        parts = []
+        for index in range(first, last + 1):
+            piece_start = ends[index] - len(self._pieces[index])
+            parts.append(self._pieces[index][max(start - piece_start, 0):stop - piece_start])
+        return ''.join(parts)
+
+
+def iter_chunks(content: Union[str, Rope]) -> Iterator[str]:
+    """
+    Chunks of node content in order. A str is a single chunk, any other
+    content type (Rope, binary_ast.LazyContent, blob_store.BlobContent)
+    has a chunks method.
+    """
+    if isinstance(content, str):
+        return iter((content,))
+    return content.chunks()
@@ -0,0 +1,234 @@
+# Selector
+# - Selector
+# - compile_selector
+# - is_selector
+
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from core.ast_md.node import Node, NodeType
+
+# Block references made only of ids, keys and '/' keep the plain path lookup,
+# any of these characters makes the reference a selector
+_SELECTOR_CHARS = set('*[]~=<>!"')
+
+_NAME = re.compile(r'[A-Za-z0-9_\-]+')
+_CONDITION = re.compile(r'\s*(level|title|id|key|content)\s*(<=|>=|!=|=|<|>|~)\s*("(?:[^"\\]|\\.)*"|[^\]\s]+)\s*$')
+_HEADER_ID = re.compile(r'\s*\{id=[^}]*\}\s*$')
+
+_COMPARE: Dict[str, Callable[[Any, Any], bool]] = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def is_selector(path: str) -> bool:
+    return any(ch in _SELECTOR_CHARS for ch in path)
+
+
+def _node_field(node: Node, field: str) -> Any:
+    if field == 'title':
+        return _HEADER_ID.sub('', node.name.lstrip('#')).strip() if node.type == NodeType.HEADING else node.name
+    return getattr(node, field)
+
+
+def _compile_condition(text: str, fields: Set[str]) -> Callable[[Node], bool]:
+    m = _CONDITION.match(text)
+    if not m:
+        raise ValueError(f"Invalid selector condition '{text}'")
+    field, op, value = m.groups()
+    fields.add(field)
+    if value.startswith('"'):
+        value = re.sub(r'\\(.)', r'\1', value[1:-1])
+
+    if op == '~':
+        try:
+            pattern = re.compile(value)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression in selector condition '{text}': {e}")
+        return lambda node: isinstance(_node_field(node, field), str) and pattern.search(_node_field(node, field)) is not None
+
+    if field == 'level':
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError(f"Level in selector condition '{text}' must be a number")
+    elif op not in ('=', '!='):
+        raise ValueError(f"Operator '{op}' only applies to level in selector condition '{text}'")
+    compare = _COMPARE[op]
+    return lambda node: compare(_node_field(node, field), value)
+
+
+def _split(text: str, sep: str) -> List[str]:
+    """Split text on sep outside of quotes and brackets."""
+    parts, current, depth, quoted, escaped = [], [], 0, False, False
+    for ch in text:
+        if escaped:
+            escaped = False
+        elif quoted:
+            if ch == '\\':
+                escaped = True
+            elif ch == '"':
+                quoted = False
+        elif ch == '"':
+            quoted = True
+        elif ch == '[':
+            depth += 1
+        elif ch == ']':
+            depth -= 1
+        elif ch == sep and depth == 0:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(ch)
+    if quoted or depth:
+        raise ValueError(f"Unbalanced quotes or brackets in selector '{text}'")
+    parts.append(''.join(current))
+    return parts
+
+
+def _parse_step(text: str, fields: Set[str]) -> Tuple[str, Optional[str], List[Callable[[Node], bool]]]:
+    step = text.strip()
+    if not step:
+        raise ValueError("Empty step in selector")
+
+    # A bare condition filters all descendants: title~"x" is **[title~"x"]
+    if _CONDITION.match(step):
+        return 'descendants', None, [_compile_condition(step, fields)]
+
+    if step.startswith('**'):
+        kind, name, rest = 'descendants', None, step[2:]
+    elif step.startswith('*'):
+        kind, name, rest = 'children', None, step[1:]
+    else:
+        m = _NAME.match(step)
+        if not m:
+            raise ValueError(f"Invalid selector step '{step}'")
+        kind, name, rest = 'name', m.group(0), step[m.end():]
+
+    conditions = []
+    rest = rest.strip()
+    while rest:
+        end = _closing_bracket(rest) if rest.startswith('[') else -1
+        if end < 0:
+            raise ValueError(f"Invalid selector step '{step}'")
+        conditions.append(_compile_condition(rest[1:end], fields))
+        rest = rest[end + 1:].strip()
+    return kind, name, conditions
+
+
+def _closing_bracket(text: str) -> int:
+    quoted, escaped = False, False
+    for i, ch in enumerate(text):
+        if escaped:
+            escaped = False
+        elif quoted:
+            if ch == '\\':
+                escaped = True
+            elif ch == '"':
+                quoted = False
+        elif ch == '"':
+            quoted = True
+        elif ch == ']':
+            return i
+    return -1
+
+
+class Selector:
+    """
+    Compiled block selector, see compile_selector.
+
+    Steps are separated by '/' and each one maps the nodes matched so far
+    to new ones:
+    - `name` is the block with that id or key, anywhere in the document for
+      the first step and among the children of the current blocks after it
+    - `*` are the children and `**` all descendants of the current blocks
+      (the top level and the whole document for a first step)
+    - `[field op value]` filters the nodes of a step, for level, title, id,
+      key and content with =, !=, ~ (regular expression search) and
+      <, <=, >, >= for level. `title~"x"` alone stands for `**[title~"x"]`
+
+    Wildcards skip operation nodes. Named steps and `*` are answered from
+    the id and tree indexes of the parser. `**` and a bare condition visit
+    every descendant of the current blocks, for a first step that is the
+    whole document.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        # Node fields read by the conditions
+        self.fields: Set[str] = set()
+        self.steps = [_parse_step(step, self.fields) for step in _split(text, '/')]
+
+    def select(self, ast) -> List[Node]:
+        """Matching nodes of ast in document order."""
+        parser = ast.parser
+        tree = parser.tree
+        current: List[Optional[Node]] = [None]  # None is the document root
+
+        for kind, name, conditions in self.steps:
+            matched: List[Node] = []
+            seen = set()
+            for context in current:
+                if kind == 'name':
+                    if context is None:
+                        candidates = [parser.get_node_by_id_or_key(name)]
+                    else:
+                        candidates = [parser.get_child_by_id_or_key(context, name)]
+                elif kind == 'children':
+                    candidates = [n for n in tree.children(context) if n.type != NodeType.OPERATION]
+                else:
+                    candidates = [n for n in self._descendants(tree, context) if n.type != NodeType.OPERATION]
+                for node in candidates:
+                    if node is None or node.key in seen:
+                        continue
+                    if all(condition(node) for condition in conditions):
+                        seen.add(node.key)
+                        matched.append(node)
+            current = matched
+            if not current:
+                break
+
+        return self._document_order(tree, current)
+
+    @staticmethod
+    def _descendants(tree, node: Optional[Node]):
+        stack = list(tree.children(node))
+        stack.reverse()
+        while stack:
+            child = stack.pop()
+            yield child
+            grandchildren = list(tree.children(child))
+            grandchildren.reverse()
+            stack.extend(grandchildren)
+
+    @staticmethod
+    def _document_order(tree, nodes: List[Node]) -> List[Node]:
+        # Nodes matched from nested contexts can come out of order, sort
+        # them by their position in the tree
+        if len(nodes) < 2:
+            return nodes
+        positions: Dict[Optional[str], Dict[str, int]] = {}
+
+        def sort_key(node: Node) -> List[int]:
+            key = []
+            for ancestor in tree.ancestors(node):
+                parent = tree.get_parent(ancestor)
+                parent_key = parent.key if parent else None
+                if parent_key not in positions:
+                    positions[parent_key] = {child.key: i for i, child in enumerate(tree.children(parent))}
+                key.append(positions[parent_key][ancestor.key])
+            return key
+
+        return sorted(nodes, key=sort_key)
+
+
+@lru_cache(maxsize=256)
+def compile_selector(text: str) -> Selector:
+    """Compile a selector once per process, raises ValueError if it is malformed."""
+    return Selector(text)
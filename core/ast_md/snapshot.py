@@ -0,0 +1,260 @@
+# Snapshot
+# - ASTSnapshot
+# - SnapshotHistory
+# - get_snapshot_history
+# - set_snapshot_history
+
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from core.ast_md.ast import AST
+from core.ast_md.node import Node
+
+# A chunk of a snapshot ends after a node whose content digest has none of
+# these bits set, so chunk borders move with the nodes and an insertion only
+# changes the chunks around it
+_CHUNK_MASK = 0x1f
+# ASTs whose last views are kept, nested @run calls capture their own AST
+_TRACKED_ASTS = 8
+
+
+class ASTSnapshot:
+    """
+    Read-only state of an AST at one point of a run.
+
+    Nodes are frozen views (see Node.view) that share content and params
+    with the live nodes, grouped in chunks that are shared with the
+    snapshots around it whenever nothing in the chunk changed.
+    """
+
+    __slots__ = ('index', 'filename', 'label', 'chunks')
+
+    def __init__(self, index: int, filename: str, label: str, chunks: Tuple[Tuple[Node, ...], ...]):
+        self.index = index
+        self.filename = filename
+        self.label = label
+        self.chunks = chunks
+
+    def __repr__(self) -> str:
+        return f"ASTSnapshot(index={self.index}, filename={self.filename!r}, label={self.label!r})"
+
+    def __len__(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def iter_nodes(self) -> Iterator[Node]:
+        for chunk in self.chunks:
+            yield from chunk
+
+    def to_ast(self) -> AST:
+        """A new AST with the snapshot's nodes, free to be modified or run."""
+        ast = AST.empty()
+        prev_node = None
+        nodes = []
+        for frozen in self.iter_nodes():
+            node = frozen.view()
+            node.prev = prev_node
+            if prev_node:
+                prev_node.next = node
+            nodes.append(node)
+            prev_node = node
+        if nodes:
+            ast.parser.splice(None, nodes, None)
+        return ast
+
+
+class _Chunk:
+    """Frozen views of a run of nodes, and the live nodes they were taken from."""
+
+    __slots__ = ('views', 'nodes')
+
+    def __init__(self, views: Tuple[Node, ...], nodes: Tuple[Node, ...]):
+        self.views = views
+        self.nodes = nodes
+
+
+class _Tracker:
+    """
+    Chunks of the last capture of one AST and the ones changed since.
+
+    The parser reports every change with the last node before it, the
+    chunk holding that node is marked, or the whole list when the change
+    starts at the head. An update reuses unmarked chunks as they are and
+    walks the list only from a marked chunk up to the start of the next
+    old chunk that is still in place.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.version: Optional[int] = None  # parser.version at the last capture
+        self.chunks: List[_Chunk] = []
+        self.snapshot_chunks: Tuple[Tuple[Node, ...], ...] = ()
+        # id of a live node -> (live node, frozen view, chunk)
+        self.views: Dict[int, tuple] = {}
+        self.dirty: Set[_Chunk] = set()
+        self.from_head = True
+        parser.change_listeners.append(self.changed)
+
+    def close(self) -> None:
+        self.parser.change_listeners.remove(self.changed)
+
+    def changed(self, last_unchanged: Optional[Node]) -> None:
+        if last_unchanged is None:
+            self.from_head = True
+            return
+        entry = self.views.get(id(last_unchanged))
+        if entry is not None and entry[0] is last_unchanged:
+            self.dirty.add(entry[2])
+        # Otherwise the node was added since the last capture, after a
+        # change that is already marked, and is walked over anyway
+
+    def update(self, touched: Iterable[Node]) -> Tuple[Tuple[Node, ...], ...]:
+        """Chunks of the AST as it is now, see SnapshotHistory.capture."""
+        for node in touched:
+            entry = self.views.get(id(node))
+            if entry is not None and entry[0] is node and not _same_state(entry[1], node):
+                self.dirty.add(entry[2])
+        if self.version == self.parser.version and not self.dirty and not self.from_head:
+            return self.snapshot_chunks
+
+        old = self.chunks
+        positions = {chunk: i for i, chunk in enumerate(old)}
+        chunks: List[_Chunk] = []
+        views: List[Node] = []
+        nodes: List[Node] = []
+        next_old = 0  # Old chunks before it are reused or dropped
+        walking = self.from_head
+        node = self.parser.head
+        while True:
+            if not walking:
+                while next_old < len(old) and old[next_old] not in self.dirty:
+                    chunks.append(old[next_old])
+                    next_old += 1
+                if next_old == len(old):
+                    break
+                node = chunks[-1].nodes[-1].next if chunks else self.parser.head
+                walking = True
+            if node is None:
+                break
+            entry = self.views.get(id(node))
+            if entry is not None and entry[0] is not node:
+                entry = None
+            if entry is not None and not nodes:
+                # Back in step with the old chunks
+                chunk = entry[2]
+                position = positions.get(chunk, -1)
+                if (position >= next_old and chunk.nodes[0] is node and chunk not in self.dirty
+                        and _same_state(entry[1], node)):
+                    next_old = position
+                    walking = False
+                    continue
+            view = entry[1] if entry is not None and _same_state(entry[1], node) else node.view()
+            views.append(view)
+            nodes.append(node)
+            if int(node.digest, 16) & _CHUNK_MASK == 0:
+                chunks.append(self._chunk(views, nodes))
+                views, nodes = [], []
+            node = node.next
+        if nodes:
+            chunks.append(self._chunk(views, nodes))
+
+        kept = set(chunks)
+        for chunk in old:
+            if chunk not in kept:
+                for node in chunk.nodes:
+                    entry = self.views.get(id(node))
+                    if entry is not None and entry[2] is chunk:
+                        del self.views[id(node)]
+        for chunk in chunks:
+            if chunk not in positions:
+                for node, view in zip(chunk.nodes, chunk.views):
+                    self.views[id(node)] = (node, view, chunk)
+
+        self.chunks = chunks
+        self.snapshot_chunks = tuple(chunk.views for chunk in chunks)
+        self.dirty = set()
+        self.from_head = False
+        self.version = self.parser.version
+        return self.snapshot_chunks
+
+    def _chunk(self, views: List[Node], nodes: List[Node]) -> _Chunk:
+        # A walked run of unchanged nodes gives back the chunk it was in
+        entry = self.views.get(id(nodes[0]))
+        if entry is not None and entry[0] is nodes[0] and entry[2].views == tuple(views):
+            return entry[2]
+        return _Chunk(tuple(views), tuple(nodes))
+
+
+class SnapshotHistory:
+    """
+    The last max_snapshots snapshots taken by capture, oldest first.
+
+    Each AST captured recently keeps a _Tracker fed by the parser's change
+    listeners, so a capture only walks the parts of the list changed since
+    the previous capture of the same AST, and a capture after an operation
+    that changed nothing shares the previous snapshot's chunks.
+    """
+
+    def __init__(self, max_snapshots: int):
+        self.snapshots: deque = deque(maxlen=max_snapshots)
+        self.count = 0
+        # id of a parser -> its _Tracker, least recently captured first
+        self._tracked: 'OrderedDict[int, _Tracker]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+    def __iter__(self) -> Iterator[ASTSnapshot]:
+        return iter(self.snapshots)
+
+    def get(self, index: int) -> Optional[ASTSnapshot]:
+        """Snapshot number index (counted from 0 over all captures), None once dropped."""
+        if not self.snapshots:
+            return None
+        position = index - self.snapshots[0].index
+        if 0 <= position < len(self.snapshots):
+            return self.snapshots[position]
+        return None
+
+    def latest(self) -> Optional[ASTSnapshot]:
+        return self.snapshots[-1] if self.snapshots else None
+
+    def capture(self, ast: AST, filename: str, label: str, touched: Iterable[Node] = ()) -> ASTSnapshot:
+        """
+        Snapshot of ast as it is now. touched are nodes changed in place
+        since the last capture without going through the parser, such as
+        the operation node the runner validated or disabled.
+        """
+        tracker = self._tracked.pop(id(ast.parser), None)
+        if tracker is not None and tracker.parser is not ast.parser:
+            tracker.close()
+            tracker = None
+        if tracker is None:
+            tracker = _Tracker(ast.parser)
+        chunks = tracker.update(touched)
+
+        self._tracked[id(ast.parser)] = tracker
+        while len(self._tracked) > _TRACKED_ASTS:
+            self._tracked.popitem(last=False)[1].close()
+
+        snapshot = ASTSnapshot(self.count, filename, label, chunks)
+        self.count += 1
+        self.snapshots.append(snapshot)
+        return snapshot
+
+
+def _same_state(view: Node, node: Node) -> bool:
+    # Fields the runner and the operations change on live nodes
+    return (view._content is node._content and view.key == node.key and view.params is node.params
+            and view.enabled == node.enabled and view.needs_validation == node.needs_validation)
+
+
+_history: Optional[SnapshotHistory] = None
+
+def get_snapshot_history() -> Optional[SnapshotHistory]:
+    """History of the last run, None when snapshots are disabled or nothing ran yet."""
+    return _history
+
+
+def set_snapshot_history(history: Optional[SnapshotHistory]) -> None:
+    global _history
+    _history = history
@@ -0,0 +1,227 @@
+# Symbol Index
+# - SymbolIndex
+# - get_symbol_index
+# - find_workflows
+# - file_reference
+# - outline_ast
+
+import contextlib
+import hashlib
+import io
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from core.ast_md.ast import AST, get_ast_part_by_id_or_key
+from core.ast_md.node import Node, NodeType
+from core.ast_md.parse_cache import ParseCache
+from core.ast_md.parser import Parser, iter_document_blocks, schema_text, validate_operation_node
+from core.config import Config
+from core.errors import BlockNotFoundError
+
+# Operations whose 'file' parameter names another workflow file
+FILE_OPERATIONS = ('import', 'run')
+# Fields of a stored entry, see scan_file
+_ENTRY_KEYS = {'mtime_ns', 'size', 'end', 'blocks', 'refs'}
+# Part of the entry digest, bump it whenever scan_file stores something else
+_ENTRY_VERSION = 2
+
+
+def find_workflows(root: str) -> List[str]:
+    """Markdown files under root, skipping hidden folders such as .git and .fractalic_cache."""
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+        paths.extend(os.path.join(dir_path, name) for name in sorted(file_names) if name.endswith('.md'))
+    return paths
+
+
+def outline_ast(outline: List[Tuple[str, int, Optional[str], str, Optional[str]]]) -> AST:
+    """
+    Content-less AST of (node type, level, id, name, key) entries, for
+    resolving block paths. Without a key the node gets one from add_node,
+    the path can then only name it by id.
+    """
+    ast = AST.empty()
+    for type_value, level, node_id, name, key in outline:
+        ast.parser.add_node(Node(type=NodeType(type_value), name=name, level=level, id=node_id, key=key))
+    return ast
+
+
+def file_reference(node: Node) -> Optional[Tuple[str, str, bool]]:
+    """
+    (file path, block uri, nested flag) a validated @import or @run node
+    points at, None if it names no file. Only @import takes a block from
+    the referenced file, the block of @run is part of the calling file.
+    """
+    file_params = (node.params or {}).get('file') or {}
+    if not file_params.get('file'):
+        return None
+    path = os.path.join(file_params.get('path', ''), file_params['file'])
+    if node.name != 'import':
+        return path, '', False
+    block_params = node.params.get('block') or {}
+    return path, block_params.get('block_uri', ''), block_params.get('nested_flag', False)
+
+
+def _iter_lines_with_offsets(f, offsets: List[int]) -> Iterator[str]:
+    position = 0
+    for raw in f:
+        offsets.append(position)
+        position += len(raw)
+        line = raw.decode('utf-8')
+        if line.endswith('\n'):
+            line = line[:-1]
+            if line.endswith('\r'):
+                line = line[:-1]
+        yield line
+    offsets.append(position)
+
+
+def scan_file(path: str) -> Dict[str, Any]:
+    """
+    Index entry of one markdown file:
+    - blocks: (node type, level, id, byte offset, name, key) of every block
+      in order, a block runs up to the offset of the next one or the end of
+      the file. Keys are the ones a parse of the whole file gives
+    - refs: (operation, referenced file relative to path's folder, block
+      uri) of every @import/@run
+    """
+    stat = os.stat(path)
+    offsets: List[int] = []
+    with open(path, 'rb') as f:
+        blocks = list(iter_document_blocks(_iter_lines_with_offsets(f, offsets), schema_text, validate=False))
+
+    # The same nodes the parser would build, with the keys it would give them
+    parser = Parser(lazy_validation=True)
+    nodes = [parser.node_from_block(block) for block in blocks]
+    parser._claim_keys(nodes)
+    entries = []
+    refs = []
+    for block, node in zip(blocks, nodes):
+        entries.append((node.type.value, node.level, node.id, offsets[block.line], node.name, node.key))
+        if node.type != NodeType.OPERATION or node.name not in FILE_OPERATIONS:
+            continue
+        try:
+            # Validation errors are printed, they belong to the run or check
+            with contextlib.redirect_stdout(io.StringIO()):
+                validate_operation_node(node)
+        except Exception:
+            continue
+        reference = file_reference(node)
+        if reference:
+            refs.append((node.name, reference[0], reference[1]))
+
+    return {
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'end': offsets[-1] if offsets else 0,
+        'blocks': entries,
+        'refs': refs,
+    }
+
+
+class SymbolIndex:
+    """
+    Persistent map of markdown files to their blocks and byte offsets.
+
+    Entries are kept per file path and rebuilt when the file's mtime or
+    size changes, both in memory and under index_dir. With an entry a
+    block path can be resolved and the block read straight from its byte
+    range (load_block), and @import/@run references can be looked up
+    across a project (find_references).
+    """
+
+    def __init__(self, index_dir: str, max_bytes: int):
+        self.store = ParseCache(index_dir, max_bytes)
+        self.index_dir = index_dir
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        # Outline AST of a file's blocks and the position of every outline node
+        self.outlines: Dict[str, Tuple[AST, Dict[str, int]]] = {}
+
+    def entry(self, path: str) -> Dict[str, Any]:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is None:
+            entry = self.store.get_object(self._entry_digest(path))
+            if not isinstance(entry, dict) or not _ENTRY_KEYS <= entry.keys():
+                entry = None  # Missing or corrupt
+        if entry is None or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+            entry = scan_file(path)
+            self.store.put_object(self._entry_digest(path), entry)
+            self.outlines.pop(path, None)
+        self.entries[path] = entry
+        return entry
+
+    @staticmethod
+    def _entry_digest(path: str) -> str:
+        return hashlib.sha256(f"{_ENTRY_VERSION}:{path}".encode('utf-8')).hexdigest()
+
+    def block_range(self, path: str, block_uri: str, use_hierarchy: bool) -> Tuple[int, int]:
+        """Byte range of the block at block_uri, with its branch if use_hierarchy is set."""
+        entry = self.entry(path)
+        path = os.path.abspath(path)
+        if path not in self.outlines:
+            outline = outline_ast([block[:3] + block[4:] for block in entry['blocks']])
+            self.outlines[path] = outline, {n.key: i for i, n in enumerate(outline.parser.iter_nodes())}
+        outline, positions = self.outlines[path]
+        node = outline.get_node_by_path(block_uri)
+        last = outline.parser.tree.subtree_end(node) if use_hierarchy else node
+
+        blocks = entry['blocks']
+        end_index = positions[last.key] + 1
+        end = blocks[end_index][3] if end_index < len(blocks) else entry['end']
+        return blocks[positions[node.key]][3], end
+
+    def load_block(self, path: str, block_uri: str, use_hierarchy: bool) -> AST:
+        """
+        Parse only the bytes of one block (and its branch) of path, giving
+        the same AST part as get_ast_part_by_path on the whole file.
+        """
+        start, end = self.block_range(path, block_uri, use_hierarchy)
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        part = AST(data.decode('utf-8'))
+        if part.first() is None:
+            raise BlockNotFoundError(f"Block '{block_uri}' not found in '{path}'.")
+        return get_ast_part_by_id_or_key(part, part.first().key, use_hierarchy)
+
+    def update(self, root: str) -> List[str]:
+        """Bring the entries of every workflow under root up to date."""
+        paths = find_workflows(root)
+        for path in paths:
+            self.entry(path)
+        return paths
+
+    def find_references(self, target: str, block_id: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        """
+        (file, operation, block uri) of every indexed @import/@run of target,
+        restricted to references into block_id's path when it is given.
+        """
+        target = os.path.abspath(target)
+        references = []
+        for path, entry in self.entries.items():
+            for operation, ref_path, block_uri in entry['refs']:
+                if os.path.normpath(os.path.join(os.path.dirname(path), ref_path)) != target:
+                    continue
+                if block_id is not None and block_id not in block_uri.split('/'):
+                    continue
+                references.append((path, operation, block_uri))
+        return references
+
+
+_symbol_index: Optional[SymbolIndex] = None
+
+def get_symbol_index() -> Optional[SymbolIndex]:
+    """Index for Config.SYMBOL_INDEX_DIR, None while it is disabled."""
+    global _symbol_index
+    if not Config.SYMBOL_INDEX_DIR:
+        return None
+    index_dir = os.path.abspath(Config.SYMBOL_INDEX_DIR)
+    if _symbol_index is None or _symbol_index.index_dir != index_dir:
+        try:
+            _symbol_index = SymbolIndex(index_dir, Config.PARSE_CACHE_MAX_BYTES)
+        except OSError:
+            return None
+    return _symbol_index
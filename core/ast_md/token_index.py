@@ -0,0 +1,162 @@
+# Token Index
+# - TokenCounter
+# - get_token_counter
+# - estimate_tokens
+# - node_tokens
+# - TokenIndex
+# - get_token_index
+
+import weakref
+from array import array
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional
+
+from core.ast_md.node import Node, NodeType
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast provider-independent estimate, about four characters per token."""
+    return (len(text) + 3) // 4
+
+
+class TokenCounter:
+    def __init__(self, name: str, count: Callable[[str], int]):
+        self.name = name  # Node token caches are keyed by it
+        self.count = count
+
+
+ESTIMATE_COUNTER = TokenCounter('estimate', estimate_tokens)
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(provider: Optional[str] = None, model: Optional[str] = None) -> TokenCounter:
+    """
+    Token counter for a provider. OpenAI models are counted with tiktoken
+    when it is installed, every other provider (and OpenAI without
+    tiktoken) uses estimate_tokens.
+    """
+    if provider and provider.lower() == 'openai':
+        try:
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding('o200k_base')
+            except KeyError:
+                encoding = tiktoken.get_encoding('o200k_base')
+            return TokenCounter(f"tiktoken:{encoding.name}",
+                                lambda text: len(encoding.encode(text, disallowed_special=())))
+        except Exception:
+            pass  # Not installed or the encoding can't be loaded
+    return ESTIMATE_COUNTER
+
+
+def node_tokens(node: Node, counter: TokenCounter = ESTIMATE_COUNTER) -> int:
+    """Token count of node.content, computed once per counter until the content changes."""
+    tokens = node.tokens
+    if tokens is None:
+        tokens = node.tokens = {}
+    count = tokens.get(counter.name)
+    if count is None:
+        count = tokens[counter.name] = counter.count(node.content)
+    return count
+
+
+class TokenIndex:
+    """
+    Prefix sums of node token counts in list order, for one parser.
+
+    Two arrays are kept, over all nodes and over heading nodes only (what
+    prompt context and `/*` branches are made of), so the tokens of any
+    contiguous run of nodes come from one subtraction. The arrays cover the
+    list from the head up to the furthest node asked about and are extended
+    from the cached per-node counts on demand. A change to the list cuts
+    them back to the changed point (Parser.change_listeners), so after an
+    @llm inserts its response only the nodes from there to the next query
+    are summed again.
+    """
+
+    def __init__(self, parser, counter: TokenCounter):
+        self.parser = parser
+        self.counter = counter
+        self.nodes: List[Node] = []
+        self.positions: Dict[str, int] = {}
+        # prefix[i] is the sum over nodes[:i]
+        self.prefix = array('q', [0])
+        self.heading_prefix = array('q', [0])
+        parser.change_listeners.append(self.invalidate)
+
+    def invalidate(self, last_unchanged: Optional[Node]) -> None:
+        if last_unchanged is None:
+            keep = 0
+        else:
+            position = self.positions.get(last_unchanged.key)
+            if position is None or self.nodes[position] is not last_unchanged:
+                return  # The change is past the summed part of the list
+            keep = position + 1
+        if keep >= len(self.nodes):
+            return
+        for node in self.nodes[keep:]:
+            del self.positions[node.key]
+        del self.nodes[keep:]
+        del self.prefix[keep + 1:]
+        del self.heading_prefix[keep + 1:]
+
+    def _position(self, node: Optional[Node]) -> int:
+        # Position of node, summing the list up to it first. None sums the
+        # whole list and gives its length
+        if node is not None:
+            position = self.positions.get(node.key)
+            if position is not None and self.nodes[position] is node:
+                return position
+        current = self.nodes[-1].next if self.nodes else self.parser.head
+        total, heading_total = self.prefix[-1], self.heading_prefix[-1]
+        while current is not None:
+            count = node_tokens(current, self.counter)
+            total += count
+            if current.type == NodeType.HEADING:
+                heading_total += count
+            self.positions[current.key] = len(self.nodes)
+            self.nodes.append(current)
+            self.prefix.append(total)
+            self.heading_prefix.append(heading_total)
+            if current is node:
+                return len(self.nodes) - 1
+            current = current.next
+        if node is not None:
+            raise KeyError(node.key)
+        return len(self.nodes)
+
+    def total(self, headings_only: bool = False) -> int:
+        self._position(None)
+        return (self.heading_prefix if headings_only else self.prefix)[-1]
+
+    def tokens_before(self, node: Node, headings_only: bool = False) -> int:
+        """Tokens of all nodes before node, e.g. the previous headings @llm sends as context."""
+        position = self._position(node)
+        return (self.heading_prefix if headings_only else self.prefix)[position]
+
+    def range_tokens(self, first: Node, last: Node, headings_only: bool = False) -> int:
+        """Tokens of the nodes from first to last, both included."""
+        end = self._position(last)
+        prefix = self.heading_prefix if headings_only else self.prefix
+        return prefix[end + 1] - prefix[self._position(first)]
+
+    def branch_tokens(self, node: Node) -> int:
+        """Tokens of node and its branch as a `/*` reference selects it (operations left out)."""
+        end = self._position(self.parser.tree.subtree_end(node))
+        start = self._position(node)
+        own = node_tokens(node, self.counter) if node.type == NodeType.OPERATION else 0
+        return own + self.heading_prefix[end + 1] - self.heading_prefix[start]
+
+    def nodes_tokens(self, nodes: Iterable[Node]) -> int:
+        return sum(node_tokens(node, self.counter) for node in nodes)
+
+
+_token_indexes: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+
+def get_token_index(ast, counter: TokenCounter = ESTIMATE_COUNTER) -> TokenIndex:
+    """Token index of ast for counter, kept for as long as the AST's parser lives."""
+    indexes = _token_indexes.setdefault(ast.parser, {})
+    index = indexes.get(counter.name)
+    if index is None:
+        index = indexes[counter.name] = TokenIndex(ast.parser, counter)
+    return index
@@ -0,0 +1,140 @@
+# Transaction
+# - ASTTransaction
+
+from typing import Dict, List, Optional, Tuple
+
+from core.ast_md.node import Node
+from core.config import Config
+
+
+class ASTTransaction:
+    """
+    Batch of inserts, replaces and removes applied to a parser at once.
+
+    Positions refer to the list as it was when the transaction started, so
+    queued changes don't see each other. Leaving the `with` block applies the
+    queue: each stretch of the list that changes becomes a single splice,
+    however many changes were queued there (stacking n blocks at the end is
+    one splice of all their nodes). An exception inside the block drops the
+    queue. One while applying it leaves the failing splice undone (see
+    Parser.splice) and undoes the splices already made, along with the keys
+    given to the new nodes, the key attempts and the insert log, so the
+    list is either fully changed or untouched.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        # Nodes to insert keyed by the node they follow, None for the head
+        self.inserts: Dict[Optional[str], List[Node]] = {}
+        self.removed: Dict[str, Node] = {}
+
+    def __enter__(self) -> 'ASTTransaction':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.inserts.clear()
+            self.removed.clear()
+        return False
+
+    def _check(self, node: Node) -> None:
+        if self.parser.nodes.get(node.key) is not node:
+            raise ValueError(f"Node '{node.key}' is not part of this AST")
+
+    def _queue_insert(self, after: Optional[Node], new_nodes) -> None:
+        nodes = list(new_nodes.parser.iter_nodes()) if hasattr(new_nodes, 'parser') else list(new_nodes)
+        self.inserts.setdefault(after.key if after else None, []).extend(nodes)
+
+    def _branch(self, node: Node, branch: bool) -> List[Node]:
+        nodes = [node]
+        if branch:
+            end = self.parser.tree.subtree_end(node)
+            while nodes[-1] is not end:
+                nodes.append(nodes[-1].next)
+        return nodes
+
+    def insert_after(self, node: Optional[Node], new_nodes) -> None:
+        """Queue new_nodes (an AST or a list of unlinked nodes) after node, at the head for None."""
+        if node is not None:
+            self._check(node)
+        self._queue_insert(node, new_nodes)
+
+    def insert_before(self, node: Node, new_nodes) -> None:
+        self._check(node)
+        self._queue_insert(node.prev, new_nodes)
+
+    def append(self, new_nodes) -> None:
+        """Queue new_nodes at the end of the list."""
+        self._queue_insert(self.parser.tail, new_nodes)
+
+    def remove(self, node: Node, branch: bool = False) -> None:
+        """Queue removal of node, with branch its whole branch."""
+        self._check(node)
+        for removed in self._branch(node, branch):
+            if removed.key in self.removed:
+                raise ValueError(f"Node '{removed.key}' is removed twice")
+            self.removed[removed.key] = removed
+
+    def replace(self, node: Node, new_nodes, branch: bool = False) -> None:
+        """Queue new_nodes in place of node, with branch in place of its whole branch."""
+        prev_node = node.prev
+        self.remove(node, branch)
+        self._queue_insert(prev_node, new_nodes)
+
+    def _regions(self) -> List[Tuple[Optional[Node], List[Node], Optional[Node], List[Node]]]:
+        # (prev_node, new_nodes, next_node, removed) per changed stretch, a
+        # stretch runs from a kept node over removed nodes to the next kept
+        # node. Stretches are applied in queue order, which keeps the keys
+        # Parser.splice derives for repeated blocks the same on every run
+        regions = []
+        starts = dict.fromkeys(key for key in self.inserts if key not in self.removed)
+        for key in self.removed:
+            prev_node = self.removed[key].prev
+            while prev_node is not None and prev_node.key in self.removed:
+                prev_node = prev_node.prev
+            starts[prev_node.key if prev_node else None] = None
+
+        for start in starts:
+            prev_node = self.parser.nodes[start] if start is not None else None
+            new_nodes = list(self.inserts.get(start, ()))
+            removed = []
+            current = prev_node.next if prev_node else self.parser.head
+            while current is not None and current.key in self.removed:
+                removed.append(current)
+                new_nodes.extend(self.inserts.get(current.key, ()))
+                current = current.next
+            regions.append((prev_node, new_nodes, current, removed))
+        return regions
+
+    def commit(self) -> None:
+        regions = self._regions()
+        self.inserts.clear()
+        self.removed.clear()
+
+        all_new_nodes = [node for _, new_nodes, _, _ in regions for node in new_nodes]
+        state = self.parser._splice_state(all_new_nodes)
+        done = []
+        try:
+            for prev_node, new_nodes, next_node, removed in regions:
+                if not new_nodes and not removed:
+                    continue
+                for before, after in zip(new_nodes, new_nodes[1:]):
+                    before.next = after
+                    after.prev = before
+                if new_nodes:
+                    new_nodes[0].prev = None
+                    new_nodes[-1].next = None
+                self.parser.splice(prev_node, new_nodes, next_node, removed)
+                done.append((prev_node, new_nodes, next_node, removed))
+        except BaseException:
+            # Removed stretches keep their inner links, so each splice is
+            # undone by splicing them back in
+            for prev_node, new_nodes, next_node, removed in reversed(done):
+                self.parser.splice(prev_node, removed, next_node, new_nodes)
+            self.parser._restore_splice_state(all_new_nodes, state)
+            raise
+
+        if Config.VERIFY_AST:
+            self.parser.verify_integrity()
@@ -0,0 +1,196 @@
+# Tree Index
+# - TreeIndex
+
+import hashlib
+from typing import Dict, Iterable, Iterator, List, Optional
+from core.ast_md.node import Node
+
+
+class TreeIndex:
+    """
+    Parent/child structure of a node list, kept next to the doubly-linked list.
+
+    A node's parent is the nearest preceding node with a lower level, which is
+    the same rule the branch (`/*`) walks use. Links are stored by node key so
+    that a node wrapped by several ASTs only carries the structure of the
+    parser that owns this index.
+
+    Subtree digests are Merkle hashes over the node digests, computed on
+    demand and dropped along the ancestor chain whenever a child is linked or
+    unlinked. A cached digest implies cached digests for the whole subtree,
+    so dropping stops at the first ancestor that has none. Contents are
+    expected to change through Parser.splice and Parser.set_content only.
+    """
+
+    def __init__(self):
+        self.parent: Dict[str, Optional[Node]] = {}
+        # Keyed by parent key, None stands for the top level
+        self.first_child: Dict[Optional[str], Node] = {}
+        self.last_child: Dict[Optional[str], Node] = {}
+        self.prev_sibling: Dict[str, Node] = {}
+        self.next_sibling: Dict[str, Node] = {}
+        # Keyed by node key, None stands for the whole document
+        self.digests: Dict[Optional[str], str] = {}
+
+    def clear(self) -> None:
+        self.parent.clear()
+        self.first_child.clear()
+        self.last_child.clear()
+        self.prev_sibling.clear()
+        self.next_sibling.clear()
+        self.digests.clear()
+
+    def contains(self, node: Node) -> bool:
+        return node.key in self.parent
+
+    def get_parent(self, node: Node) -> Optional[Node]:
+        return self.parent.get(node.key)
+
+    def ancestors(self, node: Optional[Node]) -> List[Node]:
+        """Return the chain from the top level down to and including node."""
+        chain = []
+        while node is not None:
+            chain.append(node)
+            node = self.parent.get(node.key)
+        chain.reverse()
+        return chain
+
+    def children(self, node: Optional[Node]) -> Iterator[Node]:
+        child = self.first_child.get(node.key if node else None)
+        while child is not None:
+            yield child
+            child = self.next_sibling.get(child.key)
+
+    def subtree_end(self, node: Node) -> Node:
+        """Last node of the branch that starts at node, found in O(depth)."""
+        last = self.last_child.get(node.key)
+        while last is not None:
+            node = last
+            last = self.last_child.get(node.key)
+        return node
+
+    def subtree_digest(self, node: Optional[Node]) -> str:
+        """
+        Merkle digest of the branch that starts at node (the whole document
+        for None). Equal branches, in this list or any other, have equal
+        digests.
+        """
+        key = node.key if node else None
+        digest = self.digests.get(key)
+        if digest is None:
+            combined = hashlib.blake2b(node.digest.encode() if node else b'', digest_size=16)
+            for child in self.children(node):
+                combined.update(self.subtree_digest(child).encode())
+            digest = self.digests[key] = combined.hexdigest()
+        return digest
+
+    def content_changed(self, node: Node) -> None:
+        """Drop the digests that covered the old content of node."""
+        self._invalidate(node)
+
+    def _invalidate(self, node: Node) -> None:
+        self.digests.pop(node.key, None)
+        parent = self.parent.get(node.key)
+        while True:
+            key = parent.key if parent else None
+            if self.digests.pop(key, None) is None or parent is None:
+                break
+            parent = self.parent.get(key)
+
+    def build(self, nodes: Iterable[Node]) -> None:
+        self.clear()
+        stack: List[Node] = []
+        for node in nodes:
+            self._place(stack, node)
+
+    def splice(self, prev_node: Optional[Node], new_nodes: List[Node],
+               next_node: Optional[Node], removed: Iterable[Node] = ()) -> None:
+        """
+        Update the index after the list between prev_node and next_node changed.
+
+        removed are the nodes that used to sit in that gap and new_nodes the
+        ones that sit there now, in list order. Only the new nodes and the
+        following nodes that get a different parent are touched.
+        """
+        removed = list(removed)
+        for node in removed:
+            self._unlink(node)
+
+        stack = self.ancestors(prev_node)
+        for node in new_nodes:
+            self._place(stack, node)
+
+        new_keys = {node.key for node in new_nodes}
+        current = next_node
+        while current is not None:
+            old_parent = self.parent.get(current.key)
+            self._place(stack, current)
+            # Nodes after this one are either inside its branch or have a
+            # lower level, so once nothing new is left above it they keep
+            # their old parents
+            if old_parent is self.parent[current.key] and not any(n.key in new_keys for n in stack[:-1]):
+                break
+            current = self.subtree_end(current).next
+
+        for node in removed:
+            if node.key in self.parent:
+                continue  # Removed and inserted again
+            self.first_child.pop(node.key, None)
+            self.last_child.pop(node.key, None)
+
+    def _place(self, stack: List[Node], node: Node) -> None:
+        # stack holds the ancestor chain of the previous node, so the last
+        # popped entry is the previous child of the new parent
+        prev_sibling = None
+        while stack and stack[-1].level >= node.level:
+            prev_sibling = stack.pop()
+        parent = stack[-1] if stack else None
+        self._unlink(node)
+        self._link(node, parent, prev_sibling)
+        stack.append(node)
+
+    def _link(self, node: Node, parent: Optional[Node], prev_sibling: Optional[Node]) -> None:
+        parent_key = parent.key if parent else None
+        self.parent[node.key] = parent
+        self._invalidate(node)
+        if prev_sibling is None:
+            following = self.first_child.get(parent_key)
+            self.first_child[parent_key] = node
+        else:
+            following = self.next_sibling.get(prev_sibling.key)
+            self.next_sibling[prev_sibling.key] = node
+            self.prev_sibling[node.key] = prev_sibling
+        if following is not None:
+            self.next_sibling[node.key] = following
+            self.prev_sibling[following.key] = node
+        else:
+            self.last_child[parent_key] = node
+
+    def _unlink(self, node: Node) -> None:
+        if node.key not in self.parent:
+            return
+        self._invalidate(node)
+        parent = self.parent.pop(node.key)
+        parent_key = parent.key if parent else None
+        prev_sibling = self.prev_sibling.pop(node.key, None)
+        following = self.next_sibling.pop(node.key, None)
+
+        if prev_sibling is not None:
+            if following is not None:
+                self.next_sibling[prev_sibling.key] = following
+            else:
+                self.next_sibling.pop(prev_sibling.key, None)
+        elif following is not None:
+            self.first_child[parent_key] = following
+        else:
+            self.first_child.pop(parent_key, None)
+
+        if following is not None:
+            if prev_sibling is not None:
+                self.prev_sibling[following.key] = prev_sibling
+            else:
+                self.prev_sibling.pop(following.key, None)
+        elif prev_sibling is not None:
+            self.last_child[parent_key] = prev_sibling
+        else:
+            self.last_child.pop(parent_key, None)
@@ -0,0 +1,123 @@
+# Workflow Check
+# - check_file
+# - check_workflows
+
+import contextlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from core.ast_md.ast import AST, get_part_nodes_by_path
+from core.ast_md.node import NodeType
+from core.ast_md.parse_cache import ParseCache, digest_file
+from core.ast_md.parser import Parser
+from core.ast_md.selector import compile_selector, is_selector
+from core.ast_md.symbol_index import FILE_OPERATIONS, file_reference, outline_ast
+from core.errors import BlockNotFoundError
+
+# Part of the cache key of check results, bump it whenever check_file
+# returns something different for the same file
+CHECK_FORMAT_VERSION = 3
+_RESULT_KEYS = {'errors', 'refs', 'outline'}
+
+
+def check_file(path: str) -> Dict[str, Any]:
+    """
+    Parse path with eager validation and return its check result:
+    - errors: validation errors of its operations
+    - refs: (operation, file path relative to path's folder, block uri,
+      nested flag) of every @import/@run
+    - outline: (node type, level, id, name, key) of every node, enough to
+      resolve block references into this file without parsing it again,
+      except for selectors on content
+    Runs in worker processes, so the result only holds plain data.
+    """
+    parser = Parser(lazy_validation=False)
+    # The tokenizer prints every validation error, they are reported once
+    # by the caller instead
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                parser.parse(f)
+        except (OSError, UnicodeDecodeError) as e:
+            return {'errors': [f"Cannot read file: {e}"], 'refs': [], 'outline': []}
+
+    refs = []
+    outline = []
+    for node in parser.iter_nodes():
+        outline.append((node.type.value, node.level, node.id, node.name, node.key))
+        if node.type != NodeType.OPERATION or node.name not in FILE_OPERATIONS or not node.params:
+            continue
+        reference = file_reference(node)
+        if reference:
+            refs.append((node.name,) + reference)
+    return {'errors': list(parser.errors), 'refs': refs, 'outline': outline}
+
+
+def check_workflows(paths: List[str], max_workers: Optional[int] = None,
+                    cache: Optional[ParseCache] = None) -> Dict[str, List[str]]:
+    """
+    Check every file in paths and return {path: errors}.
+
+    Files are parsed in a process pool, results are cached by content
+    digest so unchanged files are not parsed again. @import/@run references
+    are then resolved across files: the referenced file has to exist and,
+    for @import, contain the referenced block. Selectors on block content
+    are left to the run, the outlines hold no content.
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    results: Dict[str, Dict[str, Any]] = {}
+    digests: Dict[str, str] = {}
+    misses = []
+    for path in paths:
+        if cache is not None:
+            try:
+                digests[path] = f"v{CHECK_FORMAT_VERSION}-{digest_file(path, False)}"
+            except OSError:
+                pass
+            result = cache.get_object(digests[path]) if path in digests else None
+            if isinstance(result, dict) and _RESULT_KEYS <= result.keys():
+                results[path] = result
+                continue
+        misses.append(path)
+
+    if len(misses) > 1 and max_workers != 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for path, result in zip(misses, executor.map(check_file, misses, chunksize=8)):
+                results[path] = result
+    else:
+        for path in misses:
+            results[path] = check_file(path)
+
+    if cache is not None:
+        for path in misses:
+            if path in digests:
+                cache.put_object(digests[path], results[path])
+
+    outlines: Dict[str, AST] = {}
+    report: Dict[str, List[str]] = {}
+    for path in paths:
+        errors = list(results[path]['errors'])
+        for operation, ref_path, block_uri, nested in results[path]['refs']:
+            target = os.path.normpath(os.path.join(os.path.dirname(path), ref_path))
+            if not os.path.isfile(target):
+                errors.append(f"@{operation}: file not found: {ref_path}")
+                continue
+            if not block_uri:
+                continue
+            try:
+                if is_selector(block_uri) and 'content' in compile_selector(block_uri).fields:
+                    continue
+            except ValueError:
+                pass  # Malformed, reported below
+            if target not in results:
+                results[target] = check_file(target)
+            if target not in outlines:
+                outlines[target] = outline_ast(results[target]['outline'])
+            try:
+                get_part_nodes_by_path(outlines[target], block_uri, nested)
+            except (BlockNotFoundError, ValueError):
+                errors.append(f"@{operation}: block '{block_uri}' not found in {ref_path}")
+        report[path] = errors
+    return report
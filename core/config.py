@@ -16,6 +16,21 @@ class Config:
     SYSTEM_PROMPT = None  # TODO: not used now, implement later
 
     TOML_SETTINGS = None # it store raw file content of settings.toml
+
+    VERIFY_AST = False  # walk the whole node list after every AST operation to check its links
+
+    LAZY_VALIDATION = True  # validate operation YAML when the runner reaches it, not at parse time
+
+    PARSE_CACHE_DIR = None  # directory of the persistent parse cache, None disables it
+    PARSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    SYMBOL_INDEX_DIR = None  # directory of the persistent block index used by @import, None disables it
+    BLOB_DIR = None  # directory of the blob store holding large block contents on disk, None keeps them in memory
+    BLOB_MIN_CHARS = 1024 * 1024  # contents of at least this many characters are moved to the blob store
+    BLOB_MAX_BYTES = 1024 * 1024 * 1024
+
+    PREFETCH_WORKERS = 4  # threads parsing @import/@run sources ahead of the runner, 0 disables prefetch
+    CTX_BINARY = True  # write a binary AST (.ctxb) next to every .ctx that parses back to the same nodes, parse_file loads it instead of the .ctx
+    SNAPSHOT_LIMIT = 100  # AST snapshots the runner keeps in memory, one per operation, 0 disables them
     #base_url = None  # Add base_url property
 
 # Limit for @goto operation for one node in each run context
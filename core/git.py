@@ -175,6 +175,7 @@ def create_gitignore(repo_path):
                 f.write("__pycache__/\n")
                 f.write(".idea/\n")
                 f.write(".vscode/\n")
+                f.write("*.ctxb\n")
             with git.Repo(repo_path) as repo:
                 repo.index.add(['.gitignore'])
                 repo.index.commit("Add .gitignore")
@@ -186,7 +187,7 @@ def create_gitignore(repo_path):
 def ensure_gitignore(repo_path):
     """Ensure .gitignore exists and contains necessary patterns."""
     gitignore_path = os.path.join(repo_path, '.gitignore')
-    needed_patterns = [".DS_Store", "*.pyc", "__pycache__/", ".idea/", ".vscode/"]
+    needed_patterns = [".DS_Store", "*.pyc", "__pycache__/", ".idea/", ".vscode/", "*.ctxb"]
 
     if not os.path.exists(gitignore_path):
         create_gitignore(repo_path)
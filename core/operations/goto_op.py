@@ -18,13 +18,9 @@ def process_goto(ast: AST, current_node: Node, goto_count: dict) -> Optional[Nod
     if not block_uri:
         raise ValueError("@goto operation requires 'block' parameter")
         
-    # Find target node by searching through AST nodes
-    target_node = None
-    for node in ast.parser.nodes.values():
-        if node.id == block_uri:
-            target_node = node
-            break
-            
+    # Find target node through the parser's id index
+    target_node = ast.parser.get_node_by_id(block_uri)
+
     if target_node is None:
         raise BlockNotFoundError(f"Block with path '{block_uri}' not found")
         
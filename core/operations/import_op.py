@@ -4,6 +4,8 @@ import os
 from typing import Optional
 from core.config import Config
 from core.utils import parse_file
+from core.ast_md.selector import is_selector
+from core.ast_md.symbol_index import get_symbol_index
 from core.ast_md.node import Node, OperationType
 from core.ast_md.ast import AST, perform_ast_operation
 from core.errors import BlockNotFoundError, FileNotFoundError
@@ -42,15 +44,26 @@ def process_import(ast: AST, current_node: Node) -> Optional[Node]:
     if not os.path.exists(full_source_path):
         raise FileNotFoundError(f"Source file not found: {full_source_path}")
 
-    # Read the source file
-    source_ast = parse_file(full_source_path)
-
-    # If source block URI is provided, get the AST part from source_ast
-    if source_block_uri:
+    # A single block is read straight from its byte range when the project
+    # index knows it, otherwise the whole file is parsed
+    source_ast = None
+    index = get_symbol_index()
+    if source_block_uri and index is not None and not is_selector(source_block_uri):
         try:
-            source_ast = source_ast.get_part_by_path(source_block_uri, source_nested)
-        except BlockNotFoundError:
-            raise BlockNotFoundError(f"Block with URI '{source_block_uri}' not found in source file.")
+            source_ast = index.load_block(full_source_path, source_block_uri, source_nested)
+        except (BlockNotFoundError, OSError, UnicodeDecodeError):
+            source_ast = None
+
+    if source_ast is None:
+        # Read the source file
+        source_ast = parse_file(full_source_path)
+
+        # If source block URI is provided, get the AST part from source_ast
+        if source_block_uri:
+            try:
+                source_ast = source_ast.get_part_by_path(source_block_uri, source_nested)
+            except BlockNotFoundError:
+                raise BlockNotFoundError(f"Block with URI '{source_block_uri}' not found in source file.")
 
     # Determine the target node using get_node_by_path
     if target_block_uri:
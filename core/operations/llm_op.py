@@ -6,7 +6,9 @@ from pathlib import Path
 import time
 
 from core.ast_md.node import Node, OperationType, NodeType
-from core.ast_md.ast import AST, get_ast_part_by_path, perform_ast_operation
+from core.ast_md.ast import AST, get_part_nodes_by_path, perform_ast_operation
+from core.ast_md.token_index import get_token_counter, get_token_index
+from core.ast_md.prefix_context import get_previous_headings
 from core.errors import BlockNotFoundError
 from core.config import Config
 from core.llm.llm_client import LLMClient  # Import the LLMClient class
@@ -23,15 +25,6 @@ def process_llm(ast: AST, current_node: Node) -> Optional[Node]:
     """Process @llm operation with updated schema support"""
     console = Console(force_terminal=True)
 
-    def get_previous_headings(node: Node) -> str:
-        context = []
-        current = ast.first()
-        while current and current != node:
-            if current.type == NodeType.HEADING:
-                context.append(current.content)
-            current = current.next
-        return "\n\n".join(context)
-
     # Get parameters
     params = current_node.params or {}
     prompt = params.get('prompt')
@@ -52,6 +45,9 @@ def process_llm(ast: AST, current_node: Node) -> Optional[Node]:
 
     # Build prompt parts based on parameters
     prompt_parts = []
+    # Nodes the prompt is made of, for the token estimate
+    prompt_nodes = []
+    uses_previous_headings = False
 
     # Handle blocks first - can be single block or array
     if block_params:
@@ -62,10 +58,11 @@ def process_llm(ast: AST, current_node: Node) -> Optional[Node]:
                 try:
                     block_uri = block_info.get('block_uri')
                     nested_flag = block_info.get('nested_flag', False)
-                    block_ast = get_ast_part_by_path(ast, block_uri, nested_flag)
-                    if block_ast.parser.nodes:
-                        block_content = "\n\n".join(node.content for node in block_ast.parser.nodes.values())
+                    block_nodes = get_part_nodes_by_path(ast, block_uri, nested_flag)
+                    if block_nodes:
+                        block_content = "\n\n".join(node.content for node in block_nodes)
                         prompt_parts.append(block_content)
+                        prompt_nodes.extend(block_nodes)
                 except BlockNotFoundError:
                     raise ValueError(f"Block with URI '{block_uri}' not found")
         else:
@@ -73,18 +70,20 @@ def process_llm(ast: AST, current_node: Node) -> Optional[Node]:
             try:
                 block_uri = block_params.get('block_uri')
                 nested_flag = block_params.get('nested_flag', False)
-                block_ast = get_ast_part_by_path(ast, block_uri, nested_flag)
-                if block_ast.parser.nodes:
-                    block_content = "\n\n".join(node.content for node in block_ast.parser.nodes.values())
+                block_nodes = get_part_nodes_by_path(ast, block_uri, nested_flag)
+                if block_nodes:
+                    block_content = "\n\n".join(node.content for node in block_nodes)
                     prompt_parts.append(block_content)
+                    prompt_nodes.extend(block_nodes)
             except BlockNotFoundError:
                 raise ValueError(f"Block with URI '{block_uri}' not found")
 
     # Add context if only prompt is provided (no blocks)
     elif prompt:
-        context = get_previous_headings(current_node)
+        context = get_previous_headings(ast, current_node)
         if context:
             prompt_parts.append(context)
+            uses_previous_headings = True
 
     # Add prompt if specified (always last)
     if prompt:
@@ -99,12 +98,20 @@ def process_llm(ast: AST, current_node: Node) -> Optional[Node]:
     llm_client = LLMClient(provider=llm_provider, model=llm_model)
     actual_model = model or (getattr(llm_client.client, "settings", {}).get("model"))
 
+    # Cached per-node counts, the previous headings come from one prefix sum
+    token_index = get_token_index(ast, get_token_counter(llm_provider, actual_model))
+    prompt_tokens = token_index.nodes_tokens(prompt_nodes)
+    if uses_previous_headings:
+        prompt_tokens += token_index.tokens_before(current_node, headings_only=True)
+    if prompt:
+        prompt_tokens += token_index.counter.count(prompt)
+
     start_time = time.time()
     try:
         with console.status(
             f"[cyan] @llm [turquoise2]({llm_provider}/{actual_model}"
             f"{('/' + llm_client.base_url) if hasattr(llm_client, 'base_url') and llm_client.base_url else ''})[/turquoise2]"
-            f"[/cyan] processing...",
+            f"[/cyan] processing (~{prompt_tokens} tokens)...",
             spinner="dots"
         ) as status:
             response = llm_client.llm_call(prompt_text, params)
@@ -141,7 +148,11 @@ def process_llm(ast: AST, current_node: Node) -> Optional[Node]:
     else:
         header = "# LLM Response block\n"
 
-    response_ast = AST(f"{header}{response}\n")
+    # parse: false keeps the output as one block, whatever it contains
+    if params.get('parse', True) is False:
+        response_ast = AST.from_raw_text(header, response)
+    else:
+        response_ast = AST(f"{header}{response}\n")
 
     # Handle target block insertion
     operation_type = OperationType(params.get('mode', Config.DEFAULT_OPERATION))
@@ -25,6 +25,7 @@ def process_return(ast: AST, current_node: Node) -> Optional[AST]:
             if block_params.get('is_multi'):
                 # Handle array of blocks
                 blocks = block_params.get('blocks', [])
+                block_asts = []
                 for block_info in blocks:
                     block_uri = block_info.get('block_uri')
                     nested_flag = block_info.get('nested_flag', False)
@@ -32,21 +33,15 @@ def process_return(ast: AST, current_node: Node) -> Optional[AST]:
                     block_ast = get_ast_part_by_path(ast, block_uri, nested_flag)
                     if not block_ast.parser.nodes:
                         raise BlockNotFoundError(f"Block with path '{block_uri}' is empty.")
-                        
-                    if return_ast:
-                        # Stack blocks by appending
-                        perform_ast_operation(
-                            src_ast=block_ast,
-                            src_path='',
-                            src_hierarchy=False,
-                            dest_ast=return_ast,
-                            dest_path=return_ast.parser.tail.key,
-                            dest_hierarchy=False,
-                            operation=OperationType.APPEND
-                        )
-                    else:
-                        # First block becomes base AST
-                        return_ast = block_ast
+                    block_asts.append(block_ast)
+
+                if block_asts:
+                    # First block becomes base AST, the others are stacked
+                    # after it in one splice
+                    return_ast = block_asts[0]
+                    with return_ast.transaction() as transaction:
+                        for block_ast in block_asts[1:]:
+                            transaction.append(block_ast)
             else:
                 # Handle single block
                 block_uri = block_params.get('block_uri')
@@ -1,15 +1,20 @@
 # runner.py
 
 import os
-import uuid
-from typing import Optional, Tuple, Union
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Union
 from pathlib import Path
 
 from core.ast_md.ast import AST, get_ast_part_by_id, perform_ast_operation, get_ast_part_by_path
 from core.ast_md.node import Node, NodeType, OperationType
+from core.ast_md.parser import validate_operation_node
+from core.ast_md.prefetch import Prefetcher, static_file_refs, get_active_prefetcher, set_active_prefetcher
+from core.ast_md.binary_ast import write_ctx_binary
+from core.ast_md.blob_store import release_blob_store
+from core.ast_md.snapshot import SnapshotHistory, get_snapshot_history, set_snapshot_history
 from core.errors import BlockNotFoundError, UnknownOperationError
 from core.config import Config
-from core.utils import parse_file, get_content_without_header
+from core.utils import parse_file, load_file, get_content_without_header
 from core.render.render_ast import render_ast_to_markdown
 from core.operations.import_op import process_import
 from core.operations.llm_op import process_llm
@@ -37,6 +42,28 @@ def print_ast_state(ast):
             print(f"Node Hash: {current_node.hash}, Type: {current_node.type}, Enabled: {current_node.enabled}")
         current_node = current_node.next
 
+def retain_inserted(ast: AST, operation_node: Node, inserted: List[Node], keep: int,
+                    retained: Dict[str, deque], next_node: Optional[Node]) -> Optional[Node]:
+    """
+    Record the nodes one run of operation_node inserted and remove the ones
+    inserted by all but its last `keep` runs. Returns the node to continue
+    with, next_node or the first node after it that is still in the AST.
+    """
+    runs = retained.setdefault(operation_node.key, deque())
+    runs.append(inserted)
+    expired = []
+    while len(runs) > keep:
+        expired.extend(runs.popleft())
+    if expired:
+        with ast.transaction() as transaction:
+            for node in expired:
+                if ast.parser.nodes.get(node.key) is node:
+                    transaction.remove(node)
+        # Removed nodes keep their links, which lead back into the list
+        while next_node is not None and ast.parser.nodes.get(next_node.key) is not next_node:
+            next_node = next_node.next
+    return next_node
+
 def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new_branch: bool = True,
         p_parent_filename=None, p_parent_operation: str = None, p_call_tree_node=None,
         committed_files=None, file_commit_hashes=None, base_dir=None) -> Tuple[AST, CallTreeNode, str, str, str]:
@@ -55,8 +82,22 @@ def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new
         base_dir = file_dir
 
     goto_count = {}
+    # Nodes inserted by each run of operations with a `keep` limit
+    retained: Dict[str, deque] = {}
     branch_name = None
     original_cwd = os.getcwd()
+
+    # The outermost run owns the prefetcher, nested @run calls share it
+    prefetcher = None
+    if Config.PREFETCH_WORKERS > 0 and get_active_prefetcher() is None:
+        prefetcher = Prefetcher(load_file, Config.PREFETCH_WORKERS)
+        set_active_prefetcher(prefetcher)
+
+    # The outermost run starts a new snapshot history and leaves it for
+    # whoever inspects the run afterwards, nested @run calls add to it
+    if p_call_tree_node is None:
+        set_snapshot_history(SnapshotHistory(Config.SNAPSHOT_LIMIT) if Config.SNAPSHOT_LIMIT > 0 else None)
+    snapshot_history = get_snapshot_history()
     
     try:
         os.chdir(file_dir)
@@ -107,6 +148,9 @@ def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new
                 print(f"[ERROR runner.py] Could not read file: {str(read_error)}")
             raise
 
+        if prefetcher is not None:
+            prefetcher.prefetch(static_file_refs(ast, file_dir))
+
         # RESTORING LOGIC 
         # Initialize call tree node with relative path
         if p_call_tree_node is None:
@@ -146,13 +190,9 @@ def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new
                     level=1,
                     #content=f"# Input Parameters\n{get_content_without_header(param_node)}",
                     content=f"{param_node.content}",
-                    id="InputParameters",
-                    key=str(uuid.uuid4())[:8]
+                    id="InputParameters"
                 )
-                param_ast = AST("")
-                param_ast.parser.nodes = {decorated_param_node.key: decorated_param_node}
-                param_ast.parser.head = decorated_param_node
-                param_ast.parser.tail = decorated_param_node
+                param_ast = AST.from_nodes({decorated_param_node.key: decorated_param_node})
                 ast.prepend_node_with_ast(ast.first().key, param_ast)
 
         # RESTORING LOGIC
@@ -174,11 +214,20 @@ def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new
             # If the node's parameters include a run-once flag, disable the node for future runs
             # print(f'[DEBUG runner.py] Current node run_once: {current_node.params.get("run-once") if current_node.params else None}')
 
+            # Operations parsed with lazy validation get their params the
+            # first time they are reached, the result stays on the node
+            if current_node.type == NodeType.OPERATION and current_node.needs_validation:
+                validate_operation_node(current_node)
+
             if current_node.params and current_node.params.get("run-once") is True:
                 current_node.enabled = False
 
             if current_node.type == NodeType.OPERATION:
+                operation_node = current_node
                 operation_name = f"@{current_node.name}"
+                keep = current_node.params.get('keep') if current_node.params else None
+                if keep:
+                    ast.parser.insert_log = []
                 if operation_name == "@import":
                     current_node = process_import(ast, current_node)
                 elif operation_name == "@run":
@@ -200,12 +249,17 @@ def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new
                     current_node = process_shell(ast, current_node)
                 elif operation_name == "@return":
                     return_result = process_return(ast, current_node)
+                    if snapshot_history is not None:
+                        snapshot_history.capture(ast, relative_file_path, f"{operation_name} {operation_node.key}",
+                                                 touched=(operation_node,))
                     if return_result:
                         ctx_filename = Path(local_file_name).with_suffix('.ctx')
                         output_file = os.path.join(file_dir, ctx_filename)
                         relative_ctx_path = get_relative_path(base_dir, output_file)
                         
                         render_ast_to_markdown(ast, output_file)
+                        if Config.CTX_BINARY:
+                            write_ctx_binary(ast, output_file)
 
                         #print(f"[DEBUG runner.py] Committing return operation files")
                         ctx_commit_hash = commit_changes(
@@ -226,6 +280,14 @@ def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new
                     break  # Exit processing on return
                 else:
                     raise UnknownOperationError(f"Unknown operation: {operation_name}")
+
+                if keep:
+                    inserted, ast.parser.insert_log = ast.parser.insert_log, None
+                    current_node = retain_inserted(ast, operation_node, inserted, keep, retained, current_node)
+
+                if snapshot_history is not None:
+                    snapshot_history.capture(ast, relative_file_path, f"{operation_name} {operation_node.key}",
+                                             touched=(operation_node,))
             else:
                 current_node = current_node.next
 
@@ -234,6 +296,8 @@ def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new
         relative_ctx_path = os.path.relpath(output_file, base_dir)
         
         render_ast_to_markdown(ast, output_file)
+        if Config.CTX_BINARY:
+            write_ctx_binary(ast, output_file)
 
         ctx_commit_hash = commit_changes(
             base_dir,
@@ -284,6 +348,12 @@ def run(filename: str, param_node: Optional[Union[Node, AST]] = None, create_new
         return ast, new_node, new_node.ctx_file, ctx_commit_hash, branch_name
 
     finally:
+        if prefetcher is not None:
+            prefetcher.shutdown()
+            set_active_prefetcher(None)
+        # Blobs of nested runs may still be in use until the outermost one ends
+        if p_call_tree_node is None:
+            release_blob_store()
         os.chdir(original_cwd)
 
 def process_run(ast: AST, current_node: Node, local_file_name, parent_operation, call_tree_node,
@@ -326,6 +396,7 @@ def process_run(ast: AST, current_node: Node, local_file_name, parent_operation,
             if block_params.get('is_multi'):
                 # Handle array of blocks
                 blocks = block_params.get('blocks', [])
+                block_asts = []
                 for block_info in blocks:
                     block_uri = block_info.get('block_uri')
                     nested_flag = block_info.get('nested_flag', False)
@@ -333,21 +404,15 @@ def process_run(ast: AST, current_node: Node, local_file_name, parent_operation,
                     block_ast = get_ast_part_by_path(ast, block_uri, nested_flag)
                     if not block_ast.parser.nodes:
                         raise BlockNotFoundError(f"Block with path '{block_uri}' is empty.")
-                        
-                    if input_ast:
-                        # Stack blocks by appending
-                        perform_ast_operation(
-                            src_ast=block_ast,
-                            src_path='',
-                            src_hierarchy=False,
-                            dest_ast=input_ast,
-                            dest_path=input_ast.parser.tail.key,
-                            dest_hierarchy=False,
-                            operation=OperationType.APPEND
-                        )
-                    else:
-                        # First block becomes base AST
-                        input_ast = block_ast
+                    block_asts.append(block_ast)
+
+                if block_asts:
+                    # First block becomes base AST, the others are stacked
+                    # after it in one splice
+                    input_ast = block_asts[0]
+                    with input_ast.transaction() as transaction:
+                        for block_ast in block_asts[1:]:
+                            transaction.append(block_ast)
             else:
                 # Handle single block (existing logic)
                 block_uri = block_params.get('block_uri')
@@ -375,15 +440,11 @@ def process_run(ast: AST, current_node: Node, local_file_name, parent_operation,
             name="Input Parameters",
             level=1,
             content=parameter_value,
-            id="InputParameters",
-            key=str(uuid.uuid4())[:8]
+            id="InputParameters"
         )
         
         # Create prompt AST
-        prompt_ast = AST("")
-        prompt_ast.parser.nodes = {param_node.key: param_node}
-        prompt_ast.parser.head = param_node
-        prompt_ast.parser.tail = param_node
+        prompt_ast = AST.from_nodes({param_node.key: param_node})
         
         if input_ast:
             # Append prompt to existing blocks
@@ -415,8 +476,7 @@ def process_run(ast: AST, current_node: Node, local_file_name, parent_operation,
             name="Input Parameters",
             level=1,
             content=parameter_value,
-            id="InputParameters",
-            key=str(uuid.uuid4())[:8]
+            id="InputParameters"
         )
 
     # Execute run
@@ -117,7 +117,11 @@ def process_shell(ast: AST, current_node: Node) -> Optional[Node]:
     else:
         header = "# OS Shell Tool response block\n"
         
-    response_ast = AST(f"{header}{response}\n")
+    # parse: false keeps the output as one block, whatever it contains
+    if params.get('parse', True) is False:
+        response_ast = AST.from_raw_text(header, response)
+    else:
+        response_ast = AST(f"{header}{response}\n")
     
     # Handle target block insertion
     operation_type = OperationType(params.get('mode', Config.DEFAULT_OPERATION))
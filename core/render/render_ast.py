@@ -2,14 +2,36 @@
 # - render_ast_to_markdown
 
 import os
+import re
 from core.ast_md.ast import AST
 
+# Every line boundary str.splitlines knows besides "\n", written as "\n"
+_OTHER_BREAKS = '\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+_LINE_BREAKS = re.compile('\r\n|[' + _OTHER_BREAKS + ']')
+
 # it soesnt grab header while using content
 
 def render_ast_to_markdown(ast: AST, output_file: str = "out.ctx") -> None:
     with open(output_file, 'w') as f:
         current = ast.first()
         while current:
-            f.write(''.join(f"{line}\n" for line in current.content.splitlines())+"\n")
+            # Same as writing every line of content.splitlines() with "\n"
+            # and a blank line after, chunk by chunk without joining
+            last_char = ''
+            for chunk in current.content_chunks():
+                if not chunk:
+                    continue
+                if last_char == '\r' and chunk[0] == '\n':
+                    chunk = chunk[1:]  # \r\n split between two chunks
+                    last_char = '\n'
+                    if not chunk:
+                        continue
+                last_char = chunk[-1]
+                # A scan per character is much faster than a regex search
+                if any(break_char in chunk for break_char in _OTHER_BREAKS):
+                    chunk = _LINE_BREAKS.sub('\n', chunk)
+                f.write(chunk)
+            if last_char and last_char != '\n' and last_char not in _OTHER_BREAKS:
+                f.write("\n")
+            f.write("\n")
             current = current.next
-
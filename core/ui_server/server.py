@@ -10,6 +10,14 @@ from pathlib import Path
 import json
 import os
 import toml
+import contextlib
+import io
+from collections import OrderedDict
+
+# The server runs from core/ui_server, the parser lives in the repo root packages
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
 
 app = FastAPI()
 
@@ -88,6 +96,42 @@ def enrich_call_tree(node, repo):
 
     return node
 
+# Files saved from the editor: path -> (AST created with track_lines=True,
+# validation error by operation node key). A save re-parses only the lines
+# that changed since the previous save of the file
+_saved_asts = OrderedDict()
+_SAVED_AST_LIMIT = 16
+
+def check_saved_file(path, content):
+    """Validation errors of the operations in content, the new text of path."""
+    from core.ast_md.ast import AST
+    from core.ast_md.node import NodeType
+    from core.ast_md.parser import validate_operation_node
+
+    # Validation errors are printed by the parser, they are returned instead
+    with contextlib.redirect_stdout(io.StringIO()):
+        entry = _saved_asts.pop(path, None)
+        if entry is None or entry[0].parser.source_lines is None:
+            ast = AST(content, track_lines=True)
+            errors = {}
+            removed, added = [], list(ast.parser.iter_nodes())
+        else:
+            ast, errors = entry
+            removed, added = ast.update_text(content)
+        _saved_asts[path] = (ast, errors)
+        while len(_saved_asts) > _SAVED_AST_LIMIT:
+            _saved_asts.popitem(last=False)
+
+        for node in removed:
+            errors.pop(node.key, None)
+        for node in added:
+            if node.type == NodeType.OPERATION and node.needs_validation:
+                try:
+                    validate_operation_node(node)
+                except Exception as e:
+                    errors[node.key] = f"@{node.name}: {e}"
+    return [errors[node.key] for node in ast.parser.iter_nodes() if node.key in errors]
+
 
 
 @app.get("/list_directory/")
@@ -321,9 +365,16 @@ async def save_file(request: Request):
         
         # Write content to file
         full_path.write_text(content)
-        
+
+        response = {"message": "File saved successfully"}
+        if full_path.suffix == '.md':
+            try:
+                response["errors"] = check_saved_file(str(full_path), content)
+            except Exception as e:
+                print(f"Error checking '{full_path}': {e}")
+
         return JSONResponse(
-            content={"message": "File saved successfully"},
+            content=response,
             status_code=200
         )
         
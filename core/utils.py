@@ -1,4 +1,6 @@
 # Utilities
+# - parse_file
+# - load_file
 # - read_file
 # - change_working_directory
 # - print_ast_nodes
@@ -12,10 +14,52 @@ from contextlib import contextmanager
 
 from core.ast_md.node import NodeType, Node
 from core.ast_md.ast import AST
+from core.ast_md.parse_cache import get_parse_cache, digest_file
+from core.ast_md.prefetch import get_active_prefetcher
+from core.ast_md.binary_ast import load_ctx_binary
+from core.config import Config
 
 def parse_file(filename: str) -> AST:
-    content = read_file(filename)
-    return AST(content)
+    # A .ctx written by the runner comes back from its binary copy, with the
+    # keys and params it was written with
+    if filename.endswith('.ctx'):
+        ast = load_ctx_binary(filename)
+        if ast is not None:
+            return ast
+    # Files referenced by the running workflow are usually parsed already
+    prefetcher = get_active_prefetcher()
+    if prefetcher is not None:
+        ast = prefetcher.take(filename)
+        if ast is not None:
+            return ast
+    return load_file(filename)
+
+def load_file(filename: str) -> AST:
+    """Parse filename through the persistent parse cache, bypassing prefetch."""
+    cache = get_parse_cache()
+    digest = None
+    if cache is not None:
+        try:
+            digest = digest_file(filename, Config.LAZY_VALIDATION)
+        except OSError as e:
+            raise IOError(f"Error reading file '{filename}': {e}")
+        ast = cache.get(digest)
+        if ast is not None:
+            return ast
+
+    # Parse straight from the file so that large documents are never held
+    # in memory as one string
+    try:
+        with open(filename, 'r') as file:
+            ast = AST(file)
+    except OSError as e:
+        raise IOError(f"Error reading file '{filename}': {e}")
+
+    # Files with invalid operations are parsed again so that their errors
+    # are reported on every run
+    if digest is not None and not ast.parser.errors:
+        cache.put(digest, ast)
+    return ast
 
 @contextmanager
 def change_working_directory(new_path):
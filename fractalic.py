@@ -9,6 +9,9 @@ from pathlib import Path
 
 from core.git import commit_changes, ensure_git_repo
 from core.ast_md.parser import print_parsed_structure
+from core.ast_md.parse_cache import ParseCache
+from core.check import check_workflows
+from core.ast_md.symbol_index import find_workflows
 from core.utils import parse_file, load_settings
 from core.config import Config
 from core.ast_md.ast import AST
@@ -84,7 +87,52 @@ def setup_provider_config(args, settings):
     
     return provider, api_key, provider_settings
 
+def check_workflow(paths, jobs=None, use_cache=True) -> int:
+    """Validate the operations and file references of workflows without running them."""
+    console = Console(force_terminal=True, color_system="auto")
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(find_workflows(path))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            console.print(f"[bright_red]✗[/bright_red] Not found: {path}")
+            return 1
+
+    cache = None
+    if use_cache and files:
+        root = paths[0] if os.path.isdir(paths[0]) else os.path.dirname(os.path.abspath(paths[0]))
+        cache = ParseCache(os.path.join(root, '.fractalic_cache', 'check'), Config.PARSE_CACHE_MAX_BYTES)
+
+    report = check_workflows(files, max_workers=jobs, cache=cache)
+    failed = {path: errors for path, errors in report.items() if errors}
+    for path, errors in failed.items():
+        console.print(f"[bright_red]✗[/bright_red] {os.path.relpath(path)}: {len(errors)} error(s)")
+        for error in errors:
+            console.print(f"  [bright_red]-[/bright_red] {error}")
+
+    if failed:
+        console.print(f"[bright_red]✗[/bright_red] {len(failed)} of {len(report)} workflow(s) have errors")
+        return 1
+    console.print(f"[light_green]✓[/light_green] {len(report)} workflow(s) checked, no errors")
+    return 0
+
+def check_main(argv) -> int:
+    parser = argparse.ArgumentParser(prog="fractalic.py check",
+                                     description="Validate workflows without running them.")
+    parser.add_argument('paths', nargs='+', help='Markdown files or folders to check recursively.')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes (default: CPU count).')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Check every file again instead of using the .fractalic_cache check results')
+    args = parser.parse_args(argv)
+    return check_workflow(args.paths, args.jobs, not args.no_cache)
+
 def main():
+    # `fractalic.py check <dir>` validates a whole project
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        sys.exit(check_main(sys.argv[2:]))
+
     settings = load_settings()  # Load settings.toml once
     
     default_provider = settings.get('defaultProvider', 'openai')
@@ -100,9 +148,23 @@ def main():
                        default=default_operation)
     parser.add_argument('--param_input_user_request', type=str,
                        help='Part path for ParamInput-UserRequest', default=None)
+    parser.add_argument('--check', action='store_true',
+                       help='Validate all operations of the input file and exit without running it')
+    parser.add_argument('--no_parse_cache', action='store_true',
+                       help='Parse every markdown file from scratch instead of using the .fractalic_cache parse cache')
+    parser.add_argument('--no_symbol_index', action='store_true',
+                       help='Resolve @import blocks by parsing the whole file instead of using the .fractalic_cache block index')
+    parser.add_argument('--no_blob_store', action='store_true',
+                       help='Keep large block contents in memory instead of moving them to the .fractalic_cache blob store')
 
     args = parser.parse_args()
 
+    if args.check:
+        if not os.path.exists(args.input_file):
+            print(f"[ERROR fractalic.py] Input file not found: {args.input_file}")
+            sys.exit(1)
+        sys.exit(check_workflow([args.input_file], jobs=1, use_cache=False))
+
     try:
         provider, api_key, provider_settings = setup_provider_config(args, settings)
 
@@ -116,6 +178,14 @@ def main():
         if not os.path.exists(args.input_file):
             raise FileNotFoundError(f"Input file not found: {args.input_file}")
 
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(args.input_file)), '.fractalic_cache')
+        if not args.no_parse_cache:
+            Config.PARSE_CACHE_DIR = os.path.join(cache_dir, 'parse')
+        if not args.no_symbol_index:
+            Config.SYMBOL_INDEX_DIR = os.path.join(cache_dir, 'index')
+        if not args.no_blob_store:
+            Config.BLOB_DIR = os.path.join(cache_dir, 'blobs')
+
         if args.task_file and args.param_input_user_request:
             if not os.path.exists(args.task_file):
                 raise FileNotFoundError(f"Task file not found: {args.task_file}")
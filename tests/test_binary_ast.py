@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+from core.ast_md.ast import AST
+from core.ast_md.binary_ast import (binary_ctx_path, load_binary_ast, load_ctx_binary, save_binary_ast,
+                                    write_ctx_binary)
+from core.config import Config
+from core.render.render_ast import render_ast_to_markdown
+from core.utils import parse_file
+
+DOCUMENT = """# Task {id=task}
+Do things
+
+## Same
+repeated
+
+@shell
+prompt: echo hi
+use-header: "# Output {id=output}"
+
+## Same
+repeated
+"""
+
+
+@pytest.fixture(autouse=True)
+def no_parse_cache(monkeypatch):
+    monkeypatch.setattr(Config, 'PARSE_CACHE_DIR', None)
+
+
+def signature(ast):
+    return [(node.type, node.level, node.name, node.id, node.key, node.content)
+            for node in ast.parser.iter_nodes()]
+
+
+def write_ctx(ast, path):
+    render_ast_to_markdown(ast, path)
+    write_ctx_binary(ast, path)
+
+
+def reparsed(path):
+    with open(path, encoding='utf-8') as f:
+        return AST(f.read())
+
+
+def test_round_trip_matches_a_parse_of_the_ctx(tmp_path):
+    ctx = str(tmp_path / 'main.ctx')
+    ast = AST(DOCUMENT)
+    write_ctx(ast, ctx)
+    assert os.path.exists(binary_ctx_path(ctx))
+
+    loaded = load_ctx_binary(ctx)
+    assert loaded is not None
+    assert signature(loaded) == signature(ast) == signature(reparsed(ctx))
+    assert signature(parse_file(ctx)) == signature(reparsed(ctx))
+    loaded.parser.verify_integrity()
+
+    operation = [node for node in loaded.parser.iter_nodes() if node.name == 'shell'][0]
+    original = [node for node in ast.parser.iter_nodes() if node.name == 'shell'][0]
+    assert operation.params == original.params
+    assert operation.needs_validation == original.needs_validation
+
+
+def test_verbatim_headings_leave_no_binary(tmp_path):
+    # Output inserted with `parse: false` can hold lines that read as headings
+    ctx = str(tmp_path / 'main.ctx')
+    ast = AST("# Doc {id=doc}\n\ntext\n\n# Out {id=out}\n\nresult\n")
+    ast.parser.set_content(ast.parser.get_node_by_id('out'),
+                           "# Out {id=out}\n\nresult\n\n# Injected {id=inj}\n\nmore")
+    write_ctx(ast, ctx)
+    assert not os.path.exists(binary_ctx_path(ctx))
+    assert [node.id for node in parse_file(ctx).parser.iter_nodes()] == ['doc', 'out', 'inj']
+
+
+def test_keys_derived_out_of_order_leave_no_binary(tmp_path):
+    ctx = str(tmp_path / 'main.ctx')
+    write_ctx(AST(DOCUMENT), ctx)
+    assert os.path.exists(binary_ctx_path(ctx))
+
+    # The inserted copy comes first but has the derived key
+    ast = AST("# Task {id=task}\n\ntext\n\n## Same\n\nrepeated\n")
+    with ast.transaction() as transaction:
+        transaction.insert_before(ast.first(), AST("## Same\n\nrepeated\n"))
+    write_ctx(ast, ctx)
+    assert not os.path.exists(binary_ctx_path(ctx))
+    assert signature(parse_file(ctx)) == signature(reparsed(ctx))
+
+
+def test_changed_ctx_is_parsed_again(tmp_path):
+    ctx = str(tmp_path / 'main.ctx')
+    write_ctx(AST(DOCUMENT), ctx)
+    with open(ctx, encoding='utf-8') as f:
+        text = f.read()
+    # Same size, only the digest tells the copy is stale
+    with open(ctx, 'w', encoding='utf-8') as f:
+        f.write(text.replace('Do things', 'Do thing!'))
+    assert load_ctx_binary(ctx) is None
+    assert 'Do thing!' in parse_file(ctx).first().content
+
+
+def test_corrupt_binary_falls_back_to_the_ctx(tmp_path):
+    ctx = str(tmp_path / 'main.ctx')
+    write_ctx(AST(DOCUMENT), ctx)
+    with open(binary_ctx_path(ctx), 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.truncate(size // 2)
+    assert load_ctx_binary(ctx) is None
+    assert signature(parse_file(ctx)) == signature(reparsed(ctx))
+
+    with open(binary_ctx_path(ctx), 'wb') as f:
+        f.write(b'not a binary ast')
+    assert load_ctx_binary(ctx) is None
+    assert signature(parse_file(ctx)) == signature(reparsed(ctx))
+
+
+def test_run_once_state_is_not_stored(tmp_path):
+    path = str(tmp_path / 'ast.ctxb')
+    ast = AST(DOCUMENT)
+    for node in ast.parser.iter_nodes():
+        node.enabled = False
+    save_binary_ast(ast, path)
+    assert all(node.enabled for node in load_binary_ast(path).parser.iter_nodes())
@@ -0,0 +1,109 @@
+import gc
+import os
+import subprocess
+import sys
+
+import pytest
+
+from core.ast_md import blob_store
+from core.ast_md.ast import AST
+from core.ast_md.blob_store import BlobContent, BlobStore, get_blob_store, release_blob_store
+from core.config import Config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def blob_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'BLOB_DIR', str(tmp_path / 'blobs'))
+    monkeypatch.setattr(Config, 'BLOB_MIN_CHARS', 100)
+    monkeypatch.setattr(Config, 'BLOB_MAX_BYTES', 1000)
+    yield str(tmp_path / 'blobs')
+    release_blob_store()
+
+
+def drop(blob):
+    path = blob.path
+    del blob
+    gc.collect()
+    return path
+
+
+def test_large_contents_spill_and_read_back(blob_dir):
+    big = "# Big {id=big}\n\n" + "line of text\n" * 50
+    ast = AST(big + "\n# Small {id=small}\n\nshort\n")
+    node = ast.parser.get_node_by_id('big')
+    assert isinstance(node._content, BlobContent)
+    assert os.path.dirname(node._content.path) == os.path.abspath(blob_dir)
+    assert node.content == big.rstrip('\n')
+    assert ''.join(node.content_chunks()) == node.content
+    assert isinstance(ast.parser.get_node_by_id('small')._content, str)
+    assert node.digest == AST(big).first().digest
+
+
+def test_sweep_evicts_unreferenced_blobs(blob_dir):
+    store = get_blob_store()
+    kept = store.put(['k' * 600])
+    gone = drop(store.put(['g' * 600]))
+    store.sweep()
+    assert os.path.exists(kept.path)
+    assert not os.path.exists(gone)
+    assert str(kept) == 'k' * 600
+
+
+def test_no_sweep_while_another_process_holds_a_lease(blob_dir):
+    store = get_blob_store()
+    gone = drop(store.put(['g' * 600]))
+    code = ("import sys; sys.path.insert(0, sys.argv[1])\n"
+            "from core.ast_md.blob_store import BlobStore\n"
+            "store = BlobStore(sys.argv[2], 100, 1000)\n"
+            "print(store.put(['o' * 600]).path, flush=True)\n"
+            "sys.stdin.read()\n")
+    other = subprocess.Popen([sys.executable, '-c', code, ROOT, os.path.abspath(blob_dir)],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        other_path = other.stdout.readline().strip()
+        store.sweep()
+        assert os.path.exists(gone) and os.path.exists(other_path)
+    finally:
+        other.communicate('')
+    # The lease of the exited process is stale now, the oldest blob goes
+    store.sweep()
+    assert not os.path.exists(gone) and os.path.exists(other_path)
+    assert os.listdir(store.lease_dir) == [os.path.basename(store.lease.name)]
+
+
+def test_replaced_store_gives_up_its_lease(blob_dir, monkeypatch):
+    first = get_blob_store()
+    monkeypatch.setattr(Config, 'BLOB_MAX_BYTES', 2000)
+    second = get_blob_store()
+    assert second is not first and first.lease is None
+    assert len(os.listdir(second.lease_dir)) == 1
+    gone = drop(second.put(['g' * 2500]))
+    release_blob_store()
+    # Only this process held a lease, so the sweep at release ran
+    assert not os.path.exists(gone)
+    assert os.listdir(second.lease_dir) == []
+
+
+def test_release_unmaps_blobs(blob_dir):
+    blob = get_blob_store().put(['w' * 200])
+    assert str(blob) == 'w' * 200 and str(blob) == 'w' * 200
+    assert list(blob_store._mapped) == [blob.path]
+    release_blob_store()
+    assert not blob_store._mapped
+    assert str(blob) == 'w' * 200
+
+
+def test_disabled_store_keeps_contents_in_memory(monkeypatch):
+    monkeypatch.setattr(Config, 'BLOB_DIR', None)
+    assert get_blob_store() is None
+    assert isinstance(AST("# Big\n\n" + "x" * (2 * 1024 * 1024)).first()._content, str)
+
+
+def test_store_without_lease_does_not_sweep(tmp_path):
+    store = BlobStore(str(tmp_path), 1, 10)
+    gone = drop(store.put(['g' * 100]))
+    store.close()
+    store.sweep()
+    assert os.path.exists(gone)
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from core.ast_md.ast import AST
+from core.ast_md.tree_index import TreeIndex
+
+LINES = [
+    '# Title {id=title}', '## Part', '### Deep {id=deep}', 'text', 'more text', '', '',
+    '@shell', 'prompt: echo hi', '@llm', 'prompt: hello', '```', '# Fenced', '```', '#NoSpace',
+]
+
+
+def random_lines(rng, count):
+    return [rng.choice(LINES) for _ in range(count)]
+
+
+def signature(ast):
+    return [(node.type, node.level, node.name, node.id, node.content, node.params, node.needs_validation)
+            for node in ast.parser.iter_nodes()]
+
+
+def assert_consistent(ast):
+    ast.parser.verify_integrity()
+    fresh = TreeIndex()
+    fresh.build(ast.parser.iter_nodes())
+    assert fresh.parent == ast.parser.tree.parent
+
+
+def test_update_text_matches_a_fresh_parse():
+    rng = random.Random(3)
+    for trial in range(200):
+        lines = random_lines(rng, rng.randint(0, 30))
+        ast = AST('\n'.join(lines), track_lines=True)
+        for step in range(5):
+            start = rng.randint(0, len(lines))
+            end = rng.randint(start, min(len(lines), start + 4))
+            lines[start:end] = random_lines(rng, rng.randint(0, 4))
+            text = '\n'.join(lines)
+            ast.update_text(text)
+            assert signature(ast) == signature(AST(text))
+            assert_consistent(ast)
+
+
+def test_apply_edit_matches_a_fresh_parse():
+    rng = random.Random(5)
+    for trial in range(200):
+        ast = AST('\n'.join(random_lines(rng, rng.randint(1, 30))), track_lines=True)
+        lines = list(ast.parser.source_lines)
+        start = rng.randint(0, len(lines))
+        end = rng.randint(start, len(lines))
+        new_lines = random_lines(rng, rng.randint(0, 5))
+        ast.apply_edit(start, end, new_lines)
+        lines[start:end] = new_lines
+        assert signature(ast) == signature(AST('\n'.join(lines)))
+        assert_consistent(ast)
+
+
+def test_untouched_blocks_keep_their_nodes():
+    text = "# One {id=one}\n\nfirst\n\n# Two {id=two}\n\nsecond\n\n# Three {id=three}\n\nthird\n"
+    ast = AST(text, track_lines=True)
+    before = list(ast.parser.iter_nodes())
+    removed, added = ast.update_text(text.replace('second', 'changed'))
+    after = list(ast.parser.iter_nodes())
+    assert removed == [before[1]]
+    assert added == [after[1]]
+    assert after[0] is before[0] and after[2] is before[2]
+    assert after[1].content == "# Two {id=two}\n\nchanged"
+
+
+def test_unchanged_text_changes_nothing():
+    text = "# One\n\nfirst\n"
+    ast = AST(text, track_lines=True)
+    assert ast.update_text(text) == ([], [])
+
+
+def test_update_text_needs_tracked_lines():
+    with pytest.raises(ValueError):
+        AST("# One\n").update_text("# Two\n")
+
+    ast = AST("# One\n\ntext\n", track_lines=True)
+    ast.parser.add_node(AST("# Two\n").first().view())
+    with pytest.raises(ValueError):
+        ast.update_text("# One\n\nother\n")
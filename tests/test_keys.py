@@ -0,0 +1,79 @@
+import random
+
+from core.ast_md.ast import AST
+from core.ast_md.tree_index import TreeIndex
+
+DOCUMENT = """# Intro {id=intro}
+text
+
+## Same
+repeated
+
+## Other
+other
+
+## Same
+repeated
+
+# Outro {id=outro}
+end
+"""
+
+
+def keys(ast):
+    return [node.key for node in ast.parser.iter_nodes()]
+
+
+def fresh_digest(ast, node=None):
+    tree = TreeIndex()
+    tree.build(ast.parser.iter_nodes())
+    return tree.subtree_digest(node)
+
+
+def test_keys_come_from_content():
+    first, second = AST(DOCUMENT), AST(DOCUMENT)
+    assert keys(first) == keys(second)
+    assert len(set(keys(first))) == len(keys(first))  # Repeated blocks get derived keys
+    moved = AST(DOCUMENT.replace("# Intro {id=intro}\ntext\n", "# Intro {id=intro}\nchanged\n"))
+    assert keys(moved)[1:] == keys(first)[1:]
+    assert keys(moved)[0] != keys(first)[0]
+
+
+def test_keys_of_listed_nodes_never_change():
+    ast = AST(DOCUMENT)
+    before = {id(node): node.key for node in ast.parser.iter_nodes()}
+    # A copy of a repeated block inserted ahead of both copies
+    with ast.transaction() as transaction:
+        transaction.insert_after(ast.first(), AST("## Same\nrepeated\n"))
+    for node in ast.parser.iter_nodes():
+        if id(node) in before:
+            assert node.key == before[id(node)]
+    assert len(set(keys(ast))) == len(keys(ast))
+
+
+def test_digests_match_a_fresh_computation():
+    rng = random.Random(9)
+    ast = AST(DOCUMENT * 3)
+    for step in range(50):
+        nodes = list(ast.parser.iter_nodes())
+        node = rng.choice(nodes)
+        ast.digest(rng.choice(nodes))  # Leave some digests cached
+        if rng.random() < 0.5:
+            ast.parser.set_content(node, f"{'#' * node.level} Changed {step}\nbody")
+        else:
+            with ast.transaction() as transaction:
+                transaction.insert_after(node, AST(f"### Added {step}\nbody\n"))
+        assert ast.digest() == fresh_digest(ast)
+        for node in ast.parser.iter_nodes():
+            assert ast.digest(node) == fresh_digest(ast, node)
+
+
+def test_equal_branches_have_equal_digests():
+    ast = AST(DOCUMENT + DOCUMENT.replace("{id=intro}", "{id=intro2}").replace("{id=outro}", "{id=outro2}"))
+    intro, intro2 = ast.parser.get_node_by_id('intro'), ast.parser.get_node_by_id('intro2')
+    # Ids are part of the heading text, so the branches differ only there
+    assert ast.digest(intro) != ast.digest(intro2)
+    same = [node for node in ast.parser.iter_nodes() if node.name == '## Same']
+    assert len({ast.digest(node) for node in same}) == 1
+    assert AST(DOCUMENT).digest() == AST(DOCUMENT).digest()
+    assert AST(DOCUMENT).digest() != AST(DOCUMENT.replace("## Other\nother\n", "## Other\nelse\n")).digest()
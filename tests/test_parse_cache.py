@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from core.ast_md.ast import AST
+from core.ast_md.parse_cache import ParseCache, digest_file, digest_text
+from core.config import Config
+from core.utils import load_file
+
+DOCUMENT = """# Task {id=task}
+Do things
+
+@shell
+prompt: echo hi
+use-header: "# Output {id=output}"
+
+## Notes
+notes
+"""
+
+
+def signature(ast):
+    return [(node.type, node.level, node.name, node.id, node.content, node.params, node.needs_validation)
+            for node in ast.parser.iter_nodes()]
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'PARSE_CACHE_DIR', str(tmp_path / 'cache'))
+    return ParseCache(str(tmp_path / 'cache'), 1024 * 1024)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'main.md'
+    path.write_text(DOCUMENT, encoding='utf-8')
+    return str(path)
+
+
+def test_hit_returns_the_parsed_nodes(cache, source):
+    digest = digest_file(source, Config.LAZY_VALIDATION)
+    assert digest == digest_text(DOCUMENT, Config.LAZY_VALIDATION)
+    first = load_file(source)
+    cached = cache.get(digest)
+    assert cached is not None
+    assert signature(cached) == signature(first) == signature(AST(DOCUMENT))
+    cached.parser.verify_integrity()
+    assert signature(load_file(source)) == signature(first)
+
+
+def test_miss_on_unknown_or_changed_content(cache, source):
+    assert cache.get(digest_text(DOCUMENT, True)) is None
+    load_file(source)
+    with open(source, 'a', encoding='utf-8') as f:
+        f.write("more\n")
+    assert cache.get(digest_file(source, Config.LAZY_VALIDATION)) is None
+    assert load_file(source).parser.get_node_by_id('task') is not None
+    # Lazy and eager parses never share an entry
+    assert digest_text(DOCUMENT, True) != digest_text(DOCUMENT, False)
+
+
+def test_files_with_errors_are_not_cached(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'LAZY_VALIDATION', False)
+    path = tmp_path / 'bad.md'
+    path.write_text("# Doc\n\n@import\nnot: valid\n", encoding='utf-8')
+    assert load_file(str(path)).parser.errors
+    assert cache.get(digest_file(str(path), Config.LAZY_VALIDATION)) is None
+
+
+@pytest.mark.parametrize('entry', [b'{not json', b'\xff\xfe', b'{"a": 1}', b'[[1, 2]]', b'[["heading"]]', b'7'])
+def test_corrupt_entries_fall_back_to_parsing(cache, source, entry):
+    digest = digest_file(source, Config.LAZY_VALIDATION)
+    with open(os.path.join(cache.cache_dir, f"{digest}.json"), 'wb') as f:
+        f.write(entry)
+    assert cache.get(digest) is None
+    assert signature(load_file(source)) == signature(AST(DOCUMENT))
+    # The parse replaced the corrupt entry
+    assert signature(cache.get(digest)) == signature(AST(DOCUMENT))
+
+
+def test_running_total_evicts_least_recently_used(tmp_path):
+    cache = ParseCache(str(tmp_path), 1000)
+    for i in range(5):
+        cache.put_object(f"entry{i}", 'x' * 300)
+        os.utime(os.path.join(tmp_path, f"entry{i}.json"), (i, i))
+    # The oldest entries go first, until the total is back under the budget
+    remaining = sorted(name for name in os.listdir(tmp_path) if name.endswith('.json'))
+    assert sum(os.path.getsize(os.path.join(tmp_path, name)) for name in remaining) <= 1000
+    assert 'entry4.json' in remaining and 'entry0.json' not in remaining
+    assert cache.total_bytes == sum(os.path.getsize(os.path.join(tmp_path, name)) for name in remaining)
+    # A replaced entry is counted once
+    cache.put_object('entry4', 'y' * 300)
+    assert cache.total_bytes == sum(os.path.getsize(os.path.join(tmp_path, name))
+                                    for name in os.listdir(tmp_path) if name.endswith('.json'))
@@ -0,0 +1,74 @@
+import subprocess
+from collections import deque
+
+import pytest
+
+from core.ast_md.ast import AST
+from core.operations.runner import retain_inserted, run
+
+# Each run-once @goto jumps back once, so the @shell runs three times
+WORKFLOW = """# Loop {{id=loop}}
+
+@shell
+prompt: echo run >> runs.txt; echo "count $(wc -l < runs.txt)"
+{keep}
+
+@goto
+block: loop
+run-once: true
+
+@goto
+block: loop
+run-once: true
+
+# End {{id=end}}
+"""
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for command in (['init', '-q', '.'], ['config', 'user.email', 'test@example.com'],
+                    ['config', 'user.name', 'test']):
+        subprocess.run(['git', *command], check=True)
+    return tmp_path
+
+
+def run_workflow(workdir, keep):
+    (workdir / 'main.md').write_text(WORKFLOW.format(keep=keep), encoding='utf-8')
+    subprocess.run(['git', 'add', 'main.md'], check=True)
+    subprocess.run(['git', 'commit', '-q', '-m', 'init'], check=True)
+    run('main.md')
+    return (workdir / 'main.ctx').read_text(encoding='utf-8')
+
+
+def test_keep_retains_the_last_runs_across_a_goto_loop(workdir):
+    ctx = run_workflow(workdir, 'keep: 2')
+    assert ctx.count('# OS Shell Tool response block') == 2
+    assert 'count 1' not in ctx
+    # Each run inserts right after the operation, so the newest comes first
+    assert ctx.index('count 3') < ctx.index('count 2') < ctx.index('# End')
+
+
+def test_without_keep_every_run_stays(workdir):
+    ctx = run_workflow(workdir, '')
+    assert ctx.count('# OS Shell Tool response block') == 3
+    assert 'count 1' in ctx
+
+
+def test_retain_inserted_removes_expired_runs():
+    ast = AST("@shell\nprompt: echo hi\n\n# After {id=after}\n")
+    operation = ast.first()
+    retained = {}
+    runs = []
+    for i in range(3):
+        ast.parser.insert_log = []
+        with ast.transaction() as transaction:
+            transaction.insert_after(operation, AST(f"# Output {i} {{id=out{i}}}\n\nresult {i}\n"))
+        inserted, ast.parser.insert_log = ast.parser.insert_log, None
+        runs.append(inserted)
+        next_node = retain_inserted(ast, operation, inserted, 2, retained, runs[0][0])
+    assert [node.id for node in ast.parser.iter_nodes()][1:] == ['out2', 'out1', 'after']
+    assert retained[operation.key] == deque(runs[1:])
+    # The node to continue with was removed, the walk goes on to the next one in the AST
+    assert next_node is ast.parser.get_node_by_id('after')
@@ -0,0 +1,97 @@
+import pytest
+
+from core.ast_md.ast import AST, get_ast_part_by_path, get_part_nodes_by_path
+from core.ast_md.parser import Parser
+from core.ast_md.selector import compile_selector, is_selector
+from core.errors import BlockNotFoundError
+
+DOCUMENT = """# Intro {id=intro}
+intro text
+
+## Setup Steps {id=setup}
+setup text
+
+### Detail {id=detail}
+detail text
+
+## Usage {id=usage}
+usage text
+
+# Appendix {id=appendix}
+appendix text
+
+@shell
+prompt: echo hi
+"""
+
+
+def ids(nodes):
+    return [node.id for node in nodes]
+
+
+def select(path, use_hierarchy=False):
+    return ids(get_part_nodes_by_path(AST(DOCUMENT), path, use_hierarchy))
+
+
+def test_plain_paths_are_not_selectors():
+    assert not is_selector('intro/setup')
+    assert not is_selector('intro')
+    assert is_selector('**')
+    assert is_selector('title~"Setup"')
+    assert is_selector('intro/*[level<=2]')
+
+
+def test_descendants_wildcard():
+    assert select('**') == ['intro', 'setup', 'detail', 'usage', 'appendix']
+    assert select('intro/**') == ['setup', 'detail', 'usage']
+
+
+def test_children_with_level_condition():
+    assert select('*[level<=2]') == ['intro', 'appendix']
+    assert select('intro/*[level<=2]') == ['setup', 'usage']
+
+
+def test_title_and_field_conditions():
+    assert select('title~"Set"') == ['setup']
+    assert select('title~"^(Usage|Detail)$"') == ['detail', 'usage']
+    assert select('**[title="Usage"]') == ['usage']
+    assert select('**[content~"appendix text"]') == ['appendix']
+    assert select('intro/**[level=3]') == ['detail']
+    assert select('**[id!=intro][level=1]') == ['appendix']
+
+
+def test_named_steps_and_keys():
+    ast = AST(DOCUMENT)
+    usage = ast.parser.get_node_by_id('usage')
+    assert select('intro/setup') == ['setup']
+    assert ids(get_part_nodes_by_path(ast, f'**[key={usage.key}]')) == ['usage']
+
+
+def test_hierarchy_takes_the_branches_of_matches():
+    assert select('title~"Set"', use_hierarchy=True) == ['setup', 'detail']
+    part = get_ast_part_by_path(AST(DOCUMENT), '*[level<=2]', True)
+    assert ids(part.parser.iter_nodes()) == ['intro', 'setup', 'detail', 'usage', 'appendix']
+
+
+def test_no_match_and_malformed_selectors():
+    with pytest.raises(BlockNotFoundError):
+        get_ast_part_by_path(AST(DOCUMENT), 'title~"Missing"')
+    with pytest.raises(BlockNotFoundError):
+        get_ast_part_by_path(AST(DOCUMENT), 'intro/*[level>2]')  # Detail is a grandchild
+    for selector in ('**[level<x]', '**[title~"("]', '**[title<"a"]', '*[level=1', 'intro/**[name=x]'):
+        with pytest.raises(ValueError):
+            compile_selector(selector)
+
+
+def validation_errors(operation):
+    parser = Parser(lazy_validation=False)
+    parser.parse(operation)
+    return parser.errors
+
+
+def test_selectors_are_rejected_in_to():
+    assert validation_errors('@import\nfile: lib.md\nblock: title~"Setup"\n') == []
+    assert validation_errors('@import\nfile: lib.md\nto: intro/*\n') == []
+    errors = validation_errors('@import\nfile: lib.md\nto: "**[level<=2]"\n')
+    assert len(errors) == 1 and 'selector' in errors[0]
+    assert len(validation_errors('@import\nfile: lib.md\nblock: "**[level<x]"\n')) == 1
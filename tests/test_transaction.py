@@ -0,0 +1,169 @@
+import random
+
+import pytest
+
+from core.ast_md.ast import AST
+from core.ast_md.tree_index import TreeIndex
+
+
+def document(count, tag):
+    return "".join(f"{'#' * (1 + i % 3)} {tag}{i}\n\nText {tag}{i}\n\n" for i in range(count))
+
+
+def names(ast):
+    return [node.name for node in ast.parser.iter_nodes()]
+
+
+def state(ast):
+    """Everything a transaction may touch, to compare before and after a rollback."""
+    parser = ast.parser
+    return {
+        'list': [(node, node.key) for node in parser.iter_nodes()],
+        'nodes': dict(parser.nodes),
+        'ids': {node_id: dict(bucket) for node_id, bucket in parser.id_index.items()},
+        'parents': dict(parser.tree.parent),
+        'digest': ast.digest(),
+        'key_attempts': dict(parser.key_attempts),
+        'insert_log': list(parser.insert_log) if parser.insert_log is not None else None,
+    }
+
+
+def assert_consistent(ast):
+    ast.parser.verify_integrity()
+    fresh = TreeIndex()
+    fresh.build(ast.parser.iter_nodes())
+    assert fresh.parent == ast.parser.tree.parent
+    assert fresh.subtree_digest(None) == ast.digest()
+
+
+class FailingListener:
+    """Change listener that raises on its nth call."""
+
+    def __init__(self, fail_at):
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def __call__(self, last_unchanged):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError("listener failed")
+
+
+def test_interleaved_changes_match_a_list_model():
+    rng = random.Random(7)
+    for trial in range(200):
+        ast = AST(document(rng.randint(1, 12), 'a'))
+        original = list(ast.parser.iter_nodes())
+        # Inserted names keyed by the id of the original node they follow, None for the head
+        inserted = {}
+        removed = set()
+        with ast.transaction() as transaction:
+            for step in range(rng.randint(1, 6)):
+                new = AST(document(rng.randint(1, 2), f"n{trial}_{step}_"))
+                new_names = names(new)
+                kind = rng.choice(['after', 'before', 'append', 'remove', 'replace'])
+                node = rng.choice(original)
+                if kind == 'append':
+                    transaction.append(new)
+                    inserted.setdefault(id(original[-1]), []).extend(new_names)
+                elif kind == 'after':
+                    transaction.insert_after(node, new)
+                    inserted.setdefault(id(node), []).extend(new_names)
+                elif kind == 'before':
+                    transaction.insert_before(node, new)
+                    inserted.setdefault(id(node.prev) if node.prev else None, []).extend(new_names)
+                else:
+                    branch = rng.random() < 0.5
+                    if any(id(n) in removed for n in transaction._branch(node, branch)):
+                        continue
+                    prev_node = node.prev
+                    if kind == 'remove':
+                        transaction.remove(node, branch)
+                    else:
+                        transaction.replace(node, new, branch)
+                        inserted.setdefault(id(prev_node) if prev_node else None, []).extend(new_names)
+                    removed.update(id(n) for n in transaction._branch(node, branch))
+
+        expected = list(inserted.get(None, []))
+        for node in original:
+            if id(node) not in removed:
+                expected.append(node.name)
+            expected.extend(inserted.get(id(node), []))
+        assert names(ast) == expected
+        assert_consistent(ast)
+
+
+def test_exception_inside_block_leaves_ast_untouched():
+    ast = AST(document(5, 'a'))
+    before = state(ast)
+    with pytest.raises(KeyError):
+        with ast.transaction() as transaction:
+            transaction.append(AST(document(2, 'b')))
+            transaction.remove(ast.first(), branch=True)
+            raise KeyError("abort")
+    assert state(ast) == before
+
+
+def test_removing_a_node_twice_is_rejected():
+    ast = AST(document(3, 'a'))
+    with pytest.raises(ValueError):
+        with ast.transaction() as transaction:
+            transaction.remove(ast.first(), branch=True)
+            transaction.remove(ast.first().next)
+
+
+@pytest.mark.parametrize('fail_at', [1, 2, 3])
+def test_failed_commit_rolls_back_every_splice(fail_at):
+    # Three separate stretches change, the listener fails at the start of
+    # the first, second or third splice
+    ast = AST(document(9, 'a') + document(3, 'a'))  # Repeated blocks get derived keys
+    ast.parser.insert_log = []
+    nodes = list(ast.parser.iter_nodes())
+    before = state(ast)
+    listener = FailingListener(fail_at)
+    ast.parser.change_listeners.append(listener)
+
+    repeated = AST(document(3, 'a'))  # Same contents, keys are derived on insert
+    new_keys = [node.key for node in repeated.parser.iter_nodes()]
+    with pytest.raises(RuntimeError):
+        with ast.transaction() as transaction:
+            transaction.insert_after(nodes[0], repeated)
+            transaction.replace(nodes[6], AST(document(1, 'b')))
+            transaction.remove(nodes[-1])
+            transaction.append(AST(document(1, 'c')))
+
+    assert state(ast) == before
+    assert [node.key for node in repeated.parser.iter_nodes()] == new_keys
+    assert_consistent(ast)
+
+    # The same changes go through once the listener stops failing, with the
+    # keys a first attempt would have given
+    ast.parser.change_listeners.remove(listener)
+    reference = AST(document(9, 'a') + document(3, 'a'))
+    for target in (ast, reference):
+        target_nodes = list(target.parser.iter_nodes())
+        with target.transaction() as transaction:
+            transaction.insert_after(target_nodes[0], AST(document(3, 'a')))
+    assert [node.key for node in ast.parser.iter_nodes()] == [node.key for node in reference.parser.iter_nodes()]
+
+
+def test_failed_splice_restores_indexes(monkeypatch):
+    # Fails after the keys are claimed and the new nodes registered
+    ast = AST(document(6, 'a'))
+    ast.parser.insert_log = []
+    before = state(ast)
+
+    def failing_splice(*args):
+        raise RuntimeError("tree index failed")
+    monkeypatch.setattr(ast.parser.tree, 'splice', failing_splice)
+
+    new = list(AST(document(2, 'a')).parser.iter_nodes())
+    new_keys = [node.key for node in new]
+    first = ast.first()
+    with pytest.raises(RuntimeError):
+        ast.parser.splice(first, new, first.next, [first.next])
+    monkeypatch.undo()
+
+    assert state(ast) == before
+    assert [node.key for node in new] == new_keys
+    assert_consistent(ast)
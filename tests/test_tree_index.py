@@ -0,0 +1,97 @@
+import random
+
+from core.ast_md.ast import AST, get_ast_part_by_path
+from core.ast_md.node import NodeType
+
+
+def random_document(rng, count, tag):
+    blocks = []
+    for i in range(count):
+        if rng.random() < 0.2:
+            blocks.append(f"@shell\nprompt: echo {tag}{i}\n")
+        else:
+            blocks.append(f"{'#' * rng.randint(1, 4)} {tag}{i} {{id={tag}{i}}}\n\ntext {i}\n")
+    return "\n".join(blocks)
+
+
+def naive_parents(nodes):
+    """Nearest preceding node with a lower level, by a plain backwards scan."""
+    parents = {}
+    for i, node in enumerate(nodes):
+        parents[node.key] = next((prev for prev in reversed(nodes[:i]) if prev.level < node.level), None)
+    return parents
+
+
+def naive_branch(nodes, start):
+    """The node and every following node deeper than it."""
+    i = nodes.index(start)
+    end = i + 1
+    while end < len(nodes) and nodes[end].level > start.level:
+        end += 1
+    return nodes[i:end]
+
+
+def check_tree(ast):
+    nodes = list(ast.parser.iter_nodes())
+    tree = ast.parser.tree
+    parents = naive_parents(nodes)
+    for node in nodes:
+        assert tree.get_parent(node) is parents[node.key]
+        assert list(tree.children(node)) == [n for n in nodes if parents[n.key] is node]
+        assert tree.subtree_end(node) is naive_branch(nodes, node)[-1]
+    assert list(tree.children(None)) == [n for n in nodes if parents[n.key] is None]
+
+
+def test_parents_children_and_branch_ends_match_a_scan():
+    rng = random.Random(1)
+    for trial in range(100):
+        check_tree(AST(random_document(rng, rng.randint(0, 40), 'a')))
+
+
+def test_tree_follows_list_changes():
+    rng = random.Random(2)
+    for trial in range(100):
+        ast = AST(random_document(rng, rng.randint(1, 20), 'a'))
+        for step in range(4):
+            nodes = list(ast.parser.iter_nodes())
+            new = AST(random_document(rng, rng.randint(1, 3), f"n{trial}_{step}_"))
+            with ast.transaction() as transaction:
+                if nodes and rng.random() < 0.5:
+                    transaction.replace(rng.choice(nodes), new, branch=rng.random() < 0.5)
+                elif nodes:
+                    transaction.insert_after(rng.choice(nodes), new)
+                else:
+                    transaction.append(new)
+            check_tree(ast)
+
+
+def test_paths_resolve_through_ancestors():
+    rng = random.Random(3)
+    for trial in range(50):
+        ast = AST(random_document(rng, rng.randint(1, 40), 'a'))
+        tree = ast.parser.tree
+        for node in ast.parser.iter_nodes():
+            if node.type == NodeType.OPERATION:
+                continue
+            chain = tree.ancestors(node)
+            # Every step of a path names a child one level down
+            if any(child.level != parent.level + 1 for parent, child in zip(chain, chain[1:])):
+                continue
+            if any(n.type == NodeType.OPERATION for n in chain):
+                continue
+            assert ast.get_node_by_path('/'.join(n.id for n in chain)) is node
+
+
+def test_branch_extraction_matches_a_scan():
+    rng = random.Random(4)
+    for trial in range(50):
+        ast = AST(random_document(rng, rng.randint(1, 30), 'a'))
+        nodes = list(ast.parser.iter_nodes())
+        for node in nodes:
+            if node.type == NodeType.OPERATION:
+                continue
+            part = get_ast_part_by_path(ast, node.id, True)
+            expected = [n.key for n in naive_branch(nodes, node) if n is node or n.type != NodeType.OPERATION]
+            assert [n.key for n in part.parser.iter_nodes()] == expected
+            single = get_ast_part_by_path(ast, node.id, False)
+            assert [n.key for n in single.parser.iter_nodes()] == [node.key]